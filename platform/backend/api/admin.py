@@ -1,18 +1,43 @@
 from django.contrib import admin
-from .models import App, Deployment
+from .models import App, Deployment, Node, Route
 
 
 @admin.register(App)
 class AppAdmin(admin.ModelAdmin):
-    list_display = ['name', 'status', 'git_url', 'branch', 'created_at']
-    list_filter = ['status', 'created_at']
+    list_display = ['name', 'status', 'git_url', 'branch', 'node', 'maintenance', 'created_at']
+    list_filter = ['status', 'node', 'maintenance', 'created_at']
     search_fields = ['name', 'git_url']
     readonly_fields = ['created_at', 'updated_at']
 
 
 @admin.register(Deployment)
 class DeploymentAdmin(admin.ModelAdmin):
-    list_display = ['id', 'app', 'status', 'created_at', 'finished_at']
-    list_filter = ['status', 'created_at']
-    search_fields = ['app__name']
+    list_display = ['id', 'app', 'status', 'commit', 'created_at', 'finished_at', 'compacted']
+    list_filter = ['status', 'compacted', 'created_at']
+    search_fields = ['app__name', 'commit']
     readonly_fields = ['created_at']
+    list_select_related = ['app']
+    # Avoid a full COUNT(*) on large history tables
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        # The change list never shows log bodies
+        qs = super().get_queryset(request)
+        if request.resolver_match and request.resolver_match.url_name.endswith("changelist"):
+            qs = qs.defer("logs")
+        return qs
+
+
+@admin.register(Node)
+class NodeAdmin(admin.ModelAdmin):
+    list_display = ['name', 'docker_host', 'address', 'enabled', 'cpu_capacity', 'memory_capacity_mb', 'last_seen']
+    list_filter = ['enabled']
+    search_fields = ['name', 'docker_host', 'address']
+    readonly_fields = ['cpu_load', 'memory_used_mb', 'last_seen', 'last_error', 'created_at']
+
+
+@admin.register(Route)
+class RouteAdmin(admin.ModelAdmin):
+    list_display = ['path_prefix', 'app', 'service', 'port', 'strip_prefix']
+    list_filter = ['app']
+    search_fields = ['path_prefix', 'app__name', 'service']
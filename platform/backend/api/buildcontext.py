@@ -0,0 +1,208 @@
+"""
+Keystone Build Context
+
+`docker build .` sends the whole build directory to the daemon, and the
+generated Dockerfiles `COPY . .` it into the image. Prepare writes a
+.dockerignore for the detected stack (VCS metadata, dependency and cache
+directories) and measures what is left. An existing .dockerignore is kept:
+Keystone's patterns go first, so the repo's own rules (including "!"
+re-includes) still win.
+
+Deployments record the context size and how long BuildKit took to
+transfer it, parsed from the build output.
+"""
+import os
+import re
+
+from django.conf import settings
+
+from .images import format_size, parse_size
+
+DOCKERIGNORE = ".dockerignore"
+BLOCK_START = "# --- Keystone defaults (managed, edit below this block) ---"
+BLOCK_END = "# --- end Keystone defaults ---"
+
+COMMON_PATTERNS = [".git", ".hg", ".svn", "**/.DS_Store", ".idea", ".vscode", "**/*.log"]
+STACK_PATTERNS = {
+    "python": [
+        "**/__pycache__", "**/*.py[cod]", ".venv", "venv", ".pytest_cache", ".mypy_cache",
+        ".ruff_cache", ".tox", ".nox", ".coverage", "htmlcov", "*.egg-info",
+    ],
+    "node": ["**/node_modules", ".npm", ".yarn/cache", ".pnpm-store", ".next/cache", ".parcel-cache", "coverage"],
+}
+# Files that identify a stack in the build directory
+STACK_MARKERS = {
+    "python": ["manage.py", "requirements.txt", "pyproject.toml", "setup.py"],
+    "node": ["package.json"],
+}
+LARGEST_ENTRIES = 5
+
+# BuildKit: "#5 transferring context: 45.12MB 1.2s done"; classic builder: "Sending build context to Docker daemon  45.2MB"
+TRANSFER_RE = re.compile(r"transferring context: ([\d.]+\s*[kKMGT]?B)(?: ([\d.]+)s)?")
+LEGACY_CONTEXT_RE = re.compile(r"Sending build context to Docker daemon\s+([\d.]+\s*[kKMGT]?B)")
+
+
+def detect_stacks(build_dir):
+    """Stacks ("python", "node") whose marker files are in the build directory."""
+    return sorted(
+        stack for stack, markers in STACK_MARKERS.items()
+        if any((build_dir / marker).exists() for marker in markers)
+    )
+
+
+def default_patterns(build_dir):
+    patterns = list(COMMON_PATTERNS)
+    for stack in detect_stacks(build_dir):
+        patterns.extend(STACK_PATTERNS[stack])
+    return patterns
+
+
+def write_dockerignore(build_dir):
+    """
+    Generate or merge the build directory's .dockerignore.
+    Returns "generated", "merged" or "unchanged".
+    """
+    path = build_dir / DOCKERIGNORE
+    existing = path.read_text() if path.exists() else ""
+
+    # Drop a block from an earlier prepare, and patterns the repo already lists itself
+    own_lines = existing.splitlines()
+    if BLOCK_START in own_lines and BLOCK_END in own_lines:
+        start, end = own_lines.index(BLOCK_START), own_lines.index(BLOCK_END)
+        own_lines = own_lines[:start] + own_lines[end + 1:]
+    mentioned = {line.strip().lstrip("!").strip("/") for line in own_lines}
+    patterns = [pattern for pattern in default_patterns(build_dir) if pattern not in mentioned]
+    if not patterns:
+        return "unchanged"
+
+    content = "\n".join([BLOCK_START, *patterns, BLOCK_END, *own_lines]) + "\n"
+    if content == existing:
+        return "unchanged"
+    path.write_text(content)
+    return "merged" if own_lines else "generated"
+
+
+def _segment_regex(segment):
+    """Regex for one path segment of a .dockerignore pattern."""
+    regex, i = "", 0
+    while i < len(segment):
+        char = segment[i]
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[" and "]" in segment[i + 1:]:
+            end = segment.index("]", i + 1)
+            regex += "[" + segment[i + 1:end].replace("\\", "\\\\") + "]"
+            i = end
+        else:
+            regex += re.escape(char)
+        i += 1
+    return regex
+
+
+def compile_pattern(pattern):
+    """
+    Regex matching paths (relative, "/"-separated) excluded by a pattern,
+    including everything below a matched directory.
+    """
+    segments = [segment for segment in pattern.strip("/").split("/") if segment not in ("", ".")]
+    regex = ""
+    for segment in segments[:-1]:
+        regex += "(?:.*/)?" if segment == "**" else _segment_regex(segment) + "/"
+    regex += ".*" if segments[-1] == "**" else _segment_regex(segments[-1])
+    return re.compile(f"^{regex}(?:/.*)?$")
+
+
+def read_rules(build_dir):
+    """[(negated, compiled pattern)] from the build directory's .dockerignore."""
+    path = build_dir / DOCKERIGNORE
+    if not path.exists():
+        return []
+    rules = []
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        pattern = line.lstrip("!").strip()
+        if pattern.strip("/."):
+            rules.append((negated, compile_pattern(pattern)))
+    return rules
+
+
+def _excluded(rel_path, rules):
+    excluded = False
+    for negated, regex in rules:
+        if regex.match(rel_path):
+            excluded = not negated
+    return excluded
+
+
+def measure_context(build_dir):
+    """
+    Size of what `docker build` would send: {"bytes", "files", "size", "largest"}.
+    "largest" lists the biggest top-level entries still included.
+    """
+    rules = read_rules(build_dir)
+    # Excluded directories can only be skipped whole when nothing re-includes files below them
+    can_prune = not any(negated for negated, _ in rules)
+
+    total, files, per_entry = 0, 0, {}
+    for root, dirs, names in os.walk(build_dir):
+        rel_root = os.path.relpath(root, build_dir).replace(os.sep, "/")
+        prefix = "" if rel_root == "." else rel_root + "/"
+        if can_prune:
+            dirs[:] = [name for name in dirs if not _excluded(prefix + name, rules)]
+        for name in names:
+            rel_path = prefix + name
+            if _excluded(rel_path, rules):
+                continue
+            try:
+                size = os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+            total += size
+            files += 1
+            top = rel_path.split("/", 1)[0]
+            per_entry[top] = per_entry.get(top, 0) + size
+
+    largest = sorted(per_entry.items(), key=lambda item: -item[1])[:LARGEST_ENTRIES]
+    return {
+        "bytes": total,
+        "files": files,
+        "size": format_size(total),
+        "largest": [{"path": path, "bytes": size, "size": format_size(size)} for path, size in largest],
+    }
+
+
+def context_warning(num_bytes):
+    """Warning for an oversized build context, or ""."""
+    limit = settings.KEYSTONE_BUILD_CONTEXT_WARN_MB * 1000 ** 2
+    if num_bytes <= limit:
+        return ""
+    return (
+        f"Build context is {format_size(num_bytes)} (warning threshold {format_size(limit)}). "
+        f"Add large files that the image doesn't need to {DOCKERIGNORE}."
+    )
+
+
+def slim_build_context(build_dir):
+    """Write the .dockerignore and report the resulting context (prepare step)."""
+    report = {"dockerignore": write_dockerignore(build_dir), "stacks": detect_stacks(build_dir)}
+    report.update(measure_context(build_dir))
+    report["warning"] = context_warning(report["bytes"])
+    return report
+
+
+def parse_context_transfer(output):
+    """(bytes, seconds) of the context transfer reported by `docker build`, None where unknown."""
+    matches = TRANSFER_RE.findall(output)
+    if matches:
+        size, seconds = matches[-1]
+        # Small contexts finish within one progress update and report no time
+        return parse_size(size), float(seconds) if seconds else None
+    legacy = LEGACY_CONTEXT_RE.findall(output)
+    if legacy:
+        return parse_size(legacy[-1]), None
+    return None, None
@@ -0,0 +1,113 @@
+"""
+Keystone Read Coalescing
+
+Reads that shell out to Docker (container logs, live status) go through a
+CoalescingCache: concurrent identical requests share one in-flight call,
+and its result is reused for a few seconds. Five people watching the same
+app cost one `docker logs` per TTL instead of one per click.
+
+Requests joining an in-flight call wait at most `wait_timeout` seconds for
+it, so one hung `docker` call doesn't hold every request behind it.
+
+The cache is per server process, which matches the single runserver
+process the backend runs as.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+# Seconds a request waits for someone else's in-flight call
+WAIT_TIMEOUT = 60
+
+
+class _Call:
+    """An in-flight call other requests can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class CoalescingCache:
+    """Single-flight calls plus a short TTL result cache, with hit/miss counters."""
+
+    def __init__(self, name, ttl, wait_timeout=WAIT_TIMEOUT):
+        self.name = name
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._results = {}
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0, "timeouts": 0}
+
+    def get(self, key, fn):
+        """Return fn() for `key`, sharing in-flight calls and fresh results."""
+        with self._lock:
+            cached = self._results.get(key)
+            if cached and cached[0] > time.monotonic():
+                self._counters["hits"] += 1
+                return cached[1]
+
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+                self._counters["misses"] += 1
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise Exception(f"Timed out after {self.wait_timeout}s waiting for an in-flight {self.name} call")
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if call.error is None:
+                    now = time.monotonic()
+                    self._results = {k: v for k, v in self._results.items() if v[0] > now}
+                    self._results[key] = (now + self.ttl, call.value)
+                else:
+                    self._counters["errors"] += 1
+            call.done.set()
+        return call.value
+
+    def invalidate(self, app_id):
+        """Drop cached results for an app (keys start with the app id)."""
+        with self._lock:
+            self._results = {k: v for k, v in self._results.items() if k[0] != app_id}
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"] + self._counters["coalesced"]
+            return {
+                **self._counters,
+                "hit_rate": round((lookups - self._counters["misses"]) / lookups, 3) if lookups else None,
+                "in_flight": len(self._inflight),
+                "entries": len(self._results),
+                "ttl": self.ttl,
+            }
+
+
+APP_LOGS = CoalescingCache("logs", settings.KEYSTONE_READ_CACHE_TTL)
+APP_STATUS = CoalescingCache("status", settings.KEYSTONE_READ_CACHE_TTL)
+# Single-flight only: concurrent first requests to a sleeping app start it once
+APP_WAKES = CoalescingCache("wake", 0, wait_timeout=settings.KEYSTONE_WAKE_TIMEOUT + WAIT_TIMEOUT)
+
+
+def invalidate_app(app_id):
+    """Forget cached reads of an app after it was deployed, stopped, etc."""
+    for cache in [APP_LOGS, APP_STATUS]:
+        cache.invalidate(app_id)
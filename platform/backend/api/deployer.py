@@ -0,0 +1,1163 @@
+"""
+Keystone Deployer
+
+Prepare/deploy/rollback/stop logic shared by the API views and management
+commands. Functions take an App, drive Docker through run_cmd and keep the
+App/Deployment rows up to date; failures are recorded and re-raised.
+"""
+import os
+import shutil
+import socket
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import yaml
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .buildcontext import context_warning, measure_context, parse_context_transfer, slim_build_context
+from .dockerfiles import generate_django_dockerfile, generate_node_dockerfile
+from .images import ensure_deployment_image, image_id, tag_compose_images, tag_deployment_image
+from .models import Deployment
+from .routing import register_routes, route_url, sync_routes
+from .runtime import (
+    REPOS_DIR,
+    TRAEFIK_NETWORK,
+    cancel_job,
+    container_name,
+    deploy_mode,
+    is_cancelled,
+    project_name,
+    run_cmd,
+    track_job,
+    use_node,
+)
+from .scheduler import place_app, same_daemon
+
+# App statuses each step can start from
+PREPARABLE_STATUSES = ["imported", "failed", "prepared"]
+DEPLOYABLE_STATUSES = ["prepared", "running", "sleeping", "stopped", "failed"]
+
+# Default per-phase timeouts in seconds, overridden per app by App.timeouts
+PHASE_TIMEOUTS = {"clone": 300, "pull": 600, "stop": 120, "build": 900, "start": 300}
+
+
+class DeploymentCancelled(Exception):
+    """Raised in the deploying thread once its deployment has been cancelled."""
+
+
+def phase_timeout(app, phase, default=None):
+    """Timeout for a phase: the app's override, else `default`, else PHASE_TIMEOUTS."""
+    return int((app.timeouts or {}).get(phase) or default or PHASE_TIMEOUTS[phase])
+
+
+def _cancelled(deployment):
+    # The DB check covers cancels handled by another server process
+    return is_cancelled(deployment.id) or Deployment.objects.filter(pk=deployment.pk, status="cancelled").exists()
+
+
+@contextmanager
+def _phase(deployment, name):
+    """
+    Record a deploy phase and its duration in deployment.phases.
+    Cancellation is checked on the way in and out, and a command failing
+    because the deployment was cancelled raises DeploymentCancelled.
+    """
+    if _cancelled(deployment):
+        raise DeploymentCancelled("Deployment cancelled")
+
+    entry = {"phase": name, "started_at": timezone.now().isoformat(), "seconds": None, "status": "running"}
+    deployment.phases.append(entry)
+    Deployment.objects.filter(pk=deployment.pk).update(phases=deployment.phases)
+    started = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        if _cancelled(deployment):
+            entry["status"] = "cancelled"
+            raise DeploymentCancelled("Deployment cancelled") from e
+        entry["status"] = "failed"
+        raise
+    finally:
+        entry["seconds"] = round(time.monotonic() - started, 1)
+
+    entry["status"] = "ok"
+    if _cancelled(deployment):
+        raise DeploymentCancelled("Deployment cancelled")
+
+
+def inject_traefik_config(compose_path, app_slug, app_traefik_rule):
+    """
+    Modify a docker-compose.yml so Traefik can reach its web-facing services.
+    - Detects web-facing services and the path prefix each should get
+    - Connects them to keystone_web network
+    - Removes conflicting port mappings (80, 443)
+    - Converts relative volume mounts to absolute paths
+    - Backs up original file
+    Returns the detected routes ({"name", "port", "path", "host"}); the
+    routing itself is generated from the DB, see routing.py.
+    """
+    # Read original compose file
+    with open(compose_path, 'r') as f:
+        compose_data = yaml.safe_load(f)
+
+    # Get the absolute path of the repo directory for volume mount conversion
+    repo_dir = compose_path.parent
+
+    # Convert container path to host path for Docker-in-Docker volume mounts
+    # Container has /runtime/repos, but Docker needs host path
+    host_runtime_path = os.environ.get('HOST_RUNTIME_PATH', '/runtime')
+    container_runtime_path = '/runtime'
+
+    if not compose_data or 'services' not in compose_data:
+        raise Exception("Invalid docker-compose.yml: no services found")
+
+    # Backup original
+    backup_path = compose_path.parent / f"{compose_path.name}.original"
+    shutil.copy(compose_path, backup_path)
+
+    modified_services = []
+
+    # Common web service names to look for
+    web_service_names = ['nginx', 'frontend', 'web', 'proxy', 'gateway', 'app']
+    backend_service_names = ['backend', 'api', 'server', 'django', 'flask', 'fastapi']
+
+    # Process ALL services - convert volumes and add network
+    for service_name, service_config in compose_data['services'].items():
+        if service_config is None:
+            service_config = {}
+            compose_data['services'][service_name] = service_config
+
+        # Convert relative volume mounts to absolute HOST paths
+        # This is needed for Docker-in-Docker: the path must be valid on the Docker host
+        if 'volumes' in service_config:
+            new_volumes = []
+            for vol in service_config['volumes']:
+                if isinstance(vol, str):
+                    # Short syntax: ./host:container or ./host:container:ro
+                    if vol.startswith('./') or vol.startswith('../'):
+                        parts = vol.split(':')
+                        host_path = parts[0]
+                        # Convert relative to absolute (container path)
+                        container_abs_path = str((repo_dir / host_path).resolve())
+                        # Convert container path to host path
+                        if container_abs_path.startswith(container_runtime_path):
+                            host_abs_path = container_abs_path.replace(container_runtime_path, host_runtime_path, 1)
+                        else:
+                            host_abs_path = container_abs_path
+                        parts[0] = host_abs_path
+                        vol = ':'.join(parts)
+                    new_volumes.append(vol)
+                elif isinstance(vol, dict):
+                    # Long syntax with 'source' key
+                    source = vol.get('source', '')
+                    if source.startswith('./') or source.startswith('../'):
+                        container_abs_path = str((repo_dir / source).resolve())
+                        if container_abs_path.startswith(container_runtime_path):
+                            host_abs_path = container_abs_path.replace(container_runtime_path, host_runtime_path, 1)
+                        else:
+                            host_abs_path = container_abs_path
+                        vol['source'] = host_abs_path
+                    new_volumes.append(vol)
+                else:
+                    new_volumes.append(vol)
+            service_config['volumes'] = new_volumes
+
+        is_web_service = False
+        service_port = None
+
+        # Check if service has ports that look like web ports
+        ports = service_config.get('ports', [])
+        for port in ports:
+            port_str = str(port)
+            # Look for common web ports (80, 443, 3000, 8000, 8080, 5000)
+            if any(p in port_str for p in ['80:', '443:', '3000:', '8000:', '8080:', '5000:', ':80', ':443']):
+                is_web_service = True
+                # Extract the container port
+                if ':' in port_str:
+                    parts = port_str.split(':')
+                    service_port = parts[-1].split('/')[0]  # Handle "8000:8000/tcp"
+                break
+
+        # Check if service name suggests it's a web service
+        service_name_lower = service_name.lower()
+        if any(name in service_name_lower for name in web_service_names):
+            is_web_service = True
+            if not service_port:
+                service_port = "80"
+        elif any(name in service_name_lower for name in backend_service_names):
+            is_web_service = True
+            if not service_port:
+                service_port = "8000"
+
+        if is_web_service:
+            # Determine the path prefix for this service
+            if service_name_lower in ['nginx', 'frontend', 'web', 'proxy', 'gateway']:
+                # Frontend/proxy gets the main path
+                path_prefix = f"/{app_slug}"
+            else:
+                # Backend services get a subpath
+                path_prefix = f"/{app_slug}/api" if 'backend' in service_name_lower or 'api' in service_name_lower else f"/{app_slug}/{service_name}"
+
+            # Remove conflicting port mappings (ports that would conflict on host)
+            if 'ports' in service_config:
+                new_ports = []
+                for port in service_config['ports']:
+                    port_str = str(port)
+                    # Keep internal-only ports, remove host-mapped ones
+                    if ':' not in port_str:
+                        new_ports.append(port)
+                    else:
+                        # Check if it's mapping to host ports 80 or 443 (which Traefik uses)
+                        host_port = port_str.split(':')[0]
+                        if host_port not in ['80', '443']:
+                            # Keep non-conflicting ports but comment them out by not adding
+                            pass
+                # Remove ports section if empty, Traefik handles routing
+                if new_ports:
+                    service_config['ports'] = new_ports
+                else:
+                    service_config.pop('ports', None)
+
+            # Ensure service is on keystone_web network
+            networks = service_config.get('networks', [])
+            if isinstance(networks, list):
+                if TRAEFIK_NETWORK not in networks:
+                    networks.append(TRAEFIK_NETWORK)
+            elif isinstance(networks, dict):
+                if TRAEFIK_NETWORK not in networks:
+                    networks[TRAEFIK_NETWORK] = {}
+            else:
+                networks = [TRAEFIK_NETWORK]
+            service_config['networks'] = networks
+
+            modified_services.append({
+                "name": service_name,
+                "port": service_port,
+                "path": path_prefix,
+                "host": service_config.get('container_name', ''),
+            })
+
+    # Add keystone_web to top-level networks as external
+    if 'networks' not in compose_data:
+        compose_data['networks'] = {}
+
+    compose_data['networks'][TRAEFIK_NETWORK] = {
+        'external': True
+    }
+
+    # Write modified compose file
+    with open(compose_path, 'w') as f:
+        yaml.dump(compose_data, f, default_flow_style=False, sort_keys=False)
+
+    return modified_services
+
+
+# Compose override used to pin services to a previous deployment's images
+ROLLBACK_OVERRIDE_FILE = ".keystone-rollback.yml"
+# Compose override pointing services at App.service_images
+IMAGE_OVERRIDE_FILE = ".keystone-images.yml"
+
+
+def deployable(app):
+    """Whether a deploy can start: prepared apps, or image apps straight after import."""
+    return app.status in DEPLOYABLE_STATUSES or (bool(app.image) and app.status == "imported")
+
+
+def run_app_container(app, image, logs):
+    """
+    Replace the app's container with a new one running `image`.
+    - Removes the existing container, if any
+    - Injects the app's env vars (skipping internal keys)
+    - Joins the Traefik network (routes come from the file provider)
+    Returns the short container ID.
+    """
+    env_vars = app.env_vars or {}
+
+    # Stop existing container if any
+    name = container_name(app)
+    run_cmd(["docker", "stop", name])
+    run_cmd(["docker", "rm", name])
+
+    # Prepare environment variables (skip internal keys)
+    env_args = []
+    for key, value in env_vars.items():
+        if not key.startswith("_keystone_"):
+            env_args.extend(["-e", f"{key}={value}"])
+
+    # Local apps join the Traefik network; the network only exists on the
+    # Keystone host, so apps on remote nodes are reached through a published port
+    if app.node and not app.node.is_local:
+        network_args = ["-p", f"{app.host_port}:{app.container_port}"]
+    else:
+        network_args = ["--network", TRAEFIK_NETWORK]
+
+    docker_run_cmd = [
+        "docker", "run", "-d",
+        "--name", name,
+        "--restart", "unless-stopped",
+    ] + network_args + env_args + [image]
+
+    logs.append(f"Running container: {name}")
+    code, out, err = run_cmd(docker_run_cmd, timeout=phase_timeout(app, "start"))
+    logs.append(f"Run output:\n{out}\n{err}")
+
+    if code != 0:
+        raise Exception(f"Docker run failed: {err or out}")
+
+    return out.strip()[:12]
+
+
+def rollback_compose_stack(app, images, repo_dir, logs):
+    """
+    Restart a compose app with its services pinned to recorded images.
+    Writes a compose override and runs `up --no-build`, so nothing is rebuilt.
+    """
+    env_vars = app.env_vars or {}
+    compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
+    project = project_name(app)
+
+    override = {"services": {}}
+    for service, entry in images.items():
+        override["services"][service] = {
+            "image": ensure_deployment_image(entry),
+            "pull_policy": "never",
+        }
+
+    with open(repo_dir / ROLLBACK_OVERRIDE_FILE, "w") as f:
+        yaml.dump(override, f, default_flow_style=False, sort_keys=False)
+
+    logs.append("Starting services from recorded images...")
+    code, out, err = run_cmd(
+        ["docker", "compose", "-p", project, "-f", compose_file, "-f", ROLLBACK_OVERRIDE_FILE,
+         "up", "-d", "--no-build", "--remove-orphans"],
+        cwd=str(repo_dir),
+        timeout=phase_timeout(app, "start")
+    )
+    logs.append(f"Up output:\n{out}\n{err}")
+
+    if code != 0:
+        raise Exception(f"Docker compose up failed: {err or out}")
+
+    return project
+
+
+def write_image_override(repo_dir, service_images):
+    """Write the compose override that swaps service builds for prebuilt images."""
+    override = {"services": {service: {"image": image} for service, image in service_images.items()}}
+    with open(repo_dir / IMAGE_OVERRIDE_FILE, "w") as f:
+        yaml.dump(override, f, default_flow_style=False, sort_keys=False)
+    return IMAGE_OVERRIDE_FILE
+
+
+def services_with_build(compose_path):
+    """Names of the compose services that have a build section."""
+    with open(compose_path) as f:
+        compose_data = yaml.safe_load(f) or {}
+    return [name for name, config in (compose_data.get("services") or {}).items() if config and config.get("build")]
+
+
+def find_dockerfile_or_app(repo_dir):
+    """
+    Find Dockerfile or app files in repo, checking root and common subdirectories.
+    Returns: (dockerfile_path, app_type, build_context)
+    """
+    # Common subdirectory names to check
+    subdirs_to_check = ["", "backend", "app", "src", "api", "server"]
+
+    for subdir in subdirs_to_check:
+        check_dir = repo_dir / subdir if subdir else repo_dir
+        if not check_dir.exists():
+            continue
+
+        # Check for Dockerfile
+        if (check_dir / "Dockerfile").exists():
+            return (check_dir / "Dockerfile", "dockerfile", check_dir)
+
+        # Check for Django app
+        if (check_dir / "manage.py").exists():
+            return (None, "django", check_dir)
+
+        # Check for Node app
+        if (check_dir / "package.json").exists():
+            return (None, "node", check_dir)
+
+        # Check for Python app with requirements.txt
+        if (check_dir / "requirements.txt").exists():
+            return (None, "python", check_dir)
+
+    return (None, None, None)
+
+
+def prepare_app(app):
+    """
+    Step 2: Prepare repo for Traefik deployment.
+    - Clone the repo
+    - Detect structure (Django backend, frontend, docker-compose, etc.)
+    - Record the app's Traefik routes
+    Returns the prepare result. On failure the app is marked failed and the error re-raised.
+    """
+    app.status = "preparing"
+    app.error_message = ""
+    app.save()
+
+    try:
+        # Clone or update repo
+        repo_dir = REPOS_DIR / app.slug
+
+        if repo_dir.exists():
+            shutil.rmtree(repo_dir)
+
+        # Clone repo
+        code, out, err = run_cmd(
+            ["git", "clone", "--depth", "1", "-b", app.branch, app.git_url, str(repo_dir)],
+            timeout=phase_timeout(app, "clone")
+        )
+
+        if code != 0:
+            raise Exception(f"Git clone failed: {err or out}")
+
+        # Check for docker-compose.yml first (multi-service apps)
+        has_compose = (repo_dir / "docker-compose.yml").exists() or (repo_dir / "compose.yml").exists()
+        compose_file = "docker-compose.yml" if (repo_dir / "docker-compose.yml").exists() else "compose.yml" if (repo_dir / "compose.yml").exists() else None
+
+        # Detect app structure at root level
+        has_dockerfile = (repo_dir / "Dockerfile").exists()
+        has_requirements = (repo_dir / "requirements.txt").exists()
+        has_manage_py = (repo_dir / "manage.py").exists()
+        has_package_json = (repo_dir / "package.json").exists()
+
+        # Find Dockerfile or app in subdirectories
+        dockerfile_path, app_type, build_context = find_dockerfile_or_app(repo_dir)
+
+        structure = {
+            "dockerfile": has_dockerfile or (dockerfile_path is not None),
+            "docker_compose": has_compose,
+            "django": has_manage_py or app_type == "django",
+            "python": has_requirements or app_type == "python",
+            "node": has_package_json or app_type == "node",
+            "build_context": str(build_context.relative_to(repo_dir)) if build_context and build_context != repo_dir else ".",
+            "deploy_mode": "compose" if has_compose else "dockerfile",
+        }
+
+        # Determine deployment strategy
+        if has_compose:
+            # Multi-service app with docker-compose.yml
+            # INJECT TRAEFIK CONFIGURATION into the compose file
+            compose_path = repo_dir / compose_file
+            modified_services = inject_traefik_config(
+                compose_path,
+                app.slug,
+                f"PathPrefix(`/{app.slug}`)"
+            )
+
+            # Store the compose file path for deploy step
+            app.env_vars = app.env_vars or {}
+            app.env_vars["_keystone_deploy_mode"] = "compose"
+            app.env_vars["_keystone_compose_file"] = compose_file
+
+            structure["message"] = "Modified docker-compose.yml with Traefik routing"
+            structure["modified_services"] = modified_services
+            structure["traefik_injected"] = True
+            routes = [
+                {"service": entry["name"], "port": entry["port"], "path": entry["path"], "host": entry["host"]}
+                for entry in modified_services
+            ]
+
+        elif dockerfile_path:
+            # Found Dockerfile (possibly in subdirectory)
+            app.env_vars = app.env_vars or {}
+            app.env_vars["_keystone_deploy_mode"] = "dockerfile"
+            app.env_vars["_keystone_build_context"] = str(build_context.relative_to(repo_dir)) if build_context != repo_dir else "."
+
+        elif has_dockerfile:
+            # Dockerfile at root
+            app.env_vars = app.env_vars or {}
+            app.env_vars["_keystone_deploy_mode"] = "dockerfile"
+            app.env_vars["_keystone_build_context"] = "."
+
+        elif app_type == "django":
+            # Generate Django Dockerfile
+            dockerfile_content, detected = generate_django_dockerfile(build_context)
+            with open(build_context / "Dockerfile", "w") as f:
+                f.write(dockerfile_content)
+            app.env_vars = app.env_vars or {}
+            app.env_vars["_keystone_deploy_mode"] = "dockerfile"
+            app.env_vars["_keystone_build_context"] = str(build_context.relative_to(repo_dir)) if build_context != repo_dir else "."
+            structure["generated_dockerfile"] = True
+            structure["detected"] = detected
+
+        elif app_type == "node":
+            # Generate Node Dockerfile
+            dockerfile_content, detected = generate_node_dockerfile(build_context)
+            with open(build_context / "Dockerfile", "w") as f:
+                f.write(dockerfile_content)
+            app.env_vars = app.env_vars or {}
+            app.env_vars["_keystone_deploy_mode"] = "dockerfile"
+            app.env_vars["_keystone_build_context"] = str(build_context.relative_to(repo_dir)) if build_context != repo_dir else "."
+            structure["generated_dockerfile"] = True
+            structure["detected"] = detected
+
+        else:
+            raise Exception(
+                "No Dockerfile or docker-compose.yml found, and couldn't detect app type. "
+                "Checked: root, backend/, app/, src/, api/, server/ directories. "
+                "Please add a Dockerfile or docker-compose.yml to your repository."
+            )
+
+        if not has_compose:
+            routes = [{"service": "", "port": None, "path": f"/{app.slug}"}]
+            # .dockerignore for the detected stack, and the size of what remains
+            structure["context"] = slim_build_context(repo_dir / app.env_vars["_keystone_build_context"])
+        register_routes(app, routes)
+        structure["routes"] = list(app.routes.values_list("path_prefix", flat=True))
+
+        # Set Traefik rule (path-based routing)
+        app.traefik_rule = f"PathPrefix(`/{app.slug}`)"
+        app.status = "prepared"
+        app.save()
+        sync_routes()
+
+        result = {
+            "status": "prepared",
+            "structure": structure,
+            "traefik_rule": app.traefik_rule,
+            "message": f"App prepared. Will be accessible at /{app.slug}"
+        }
+        if structure.get("context", {}).get("warning"):
+            result["warning"] = structure["context"]["warning"]
+        return result
+
+    except Exception as e:
+        app.status = "failed"
+        app.error_message = str(e)
+        app.save()
+        raise
+
+
+def deploy_app(app):
+    """
+    Step 3: Deploy the app.
+    - For docker-compose apps: use docker compose up
+    - For single Dockerfile apps: build and run on the Traefik network
+    - For image apps: pull App.image and run it, no clone or build
+    Returns the deploy result. On failure the app and deployment are marked
+    failed and the error re-raised.
+    """
+    # Get deployment mode (set during prepare, or "image" for prebuilt images)
+    mode = deploy_mode(app)
+
+    # Create deployment record
+    deployment = Deployment.objects.create(app=app, status="running", deploy_mode=mode)
+
+    app.status = "deploying"
+    app.error_message = ""
+    app.save()
+
+    logs = []
+
+    try:
+        with track_job(deployment.id):
+            repo_dir = REPOS_DIR / app.slug
+
+            if mode != "image":
+                if not repo_dir.exists():
+                    raise Exception("Repo not found. Please prepare first.")
+                code, out, err = run_cmd(["git", "rev-parse", "HEAD"], cwd=str(repo_dir), timeout=30)
+                deployment.commit = out.strip() if code == 0 else ""
+
+            # Pick a node; stop the old containers if the app moves
+            previous = app.node
+            node = place_app(app)
+            if not same_daemon(previous, node):
+                logs.append(f"Moving from {previous.name if previous else 'the local host'}")
+                with use_node(previous):
+                    _stop_containers(app)
+            if node:
+                logs.append(f"Deploying on node {node.name}")
+
+            with use_node(node):
+                if mode == "compose":
+                    # Deploy using docker-compose
+                    result = _deploy_compose(app, deployment, repo_dir, logs)
+                elif mode == "image":
+                    # Deploy a prebuilt image
+                    result = _deploy_image(app, deployment, logs)
+                else:
+                    # Deploy using single Dockerfile
+                    result = _deploy_dockerfile(app, deployment, repo_dir, logs)
+
+        sync_routes()
+        return result
+
+    except Exception as e:
+        _record_failure(app, deployment, logs, e)
+        raise
+
+
+def _record_failure(app, deployment, logs, error):
+    """
+    Mark the app and deployment failed. Cancelled deployments were already
+    finalised by cancel_deployment(), only their logs and timing are added.
+    Any error counts as a cancel once the deployment is cancelled (killing
+    a command makes whatever ran it fail), and the status only moves from
+    "running" to "failed" in a conditional UPDATE, as in _record_success.
+    """
+    failed = 0
+    if not isinstance(error, DeploymentCancelled) and not _cancelled(deployment):
+        failed = Deployment.objects.filter(pk=deployment.pk, status="running").update(
+            status="failed",
+            error=str(error),
+            logs="\n".join(logs),
+            phases=deployment.phases,
+            commit=deployment.commit,
+            finished_at=timezone.now(),
+        )
+
+    if not failed:
+        logs.append("Deployment cancelled")
+        Deployment.objects.filter(pk=deployment.pk).update(logs="\n".join(logs), phases=deployment.phases)
+        return
+
+    # Only the status: the in-memory app may be stale
+    app.status = "failed"
+    app.error_message = str(error)
+    app.save(update_fields=["status", "error_message", "updated_at"])
+
+
+def _record_success(app, deployment, logs):
+    """
+    Mark the deployment successful, then the app running. The status only
+    moves from "running" to "success" in a single conditional UPDATE, so a
+    cancel landing after the last phase check is never overwritten.
+    """
+    deployment.status = "success"
+    deployment.logs = "\n".join(logs)
+    deployment.finished_at = timezone.now()
+    finished = Deployment.objects.filter(pk=deployment.pk, status="running").update(
+        status=deployment.status,
+        logs=deployment.logs,
+        finished_at=deployment.finished_at,
+        images=deployment.images,
+        phases=deployment.phases,
+        commit=deployment.commit,
+        context_bytes=deployment.context_bytes,
+        context_transfer_seconds=deployment.context_transfer_seconds,
+    )
+    if not finished:
+        raise DeploymentCancelled("Deployment cancelled")
+
+    app.status = "running"
+    app.save()
+
+
+def _deploy_compose(app, deployment, repo_dir, logs):
+    """Deploy app using docker-compose with Traefik routing."""
+    env_vars = app.env_vars or {}
+    compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
+
+    logs.append(f"Deploying with docker-compose: {compose_file}")
+    logs.append(f"Traefik routing: {app.traefik_rule}")
+
+    # Create a project name based on app slug
+    project = project_name(app)
+
+    # Services with a prebuilt image are pulled (before the old stack goes down)
+    service_images = app.service_images or {}
+    files = ["-f", compose_file]
+    if service_images:
+        files += ["-f", write_image_override(repo_dir, service_images)]
+        logs.append(f"Pulling images: {', '.join(service_images.values())}")
+        with _phase(deployment, "pull"):
+            code, out, err = run_cmd(
+                ["docker", "compose", "-p", project, *files, "pull", *service_images],
+                cwd=str(repo_dir),
+                timeout=phase_timeout(app, "pull")
+            )
+            logs.append(f"Pull output:\n{out}\n{err}")
+
+            if code != 0:
+                raise Exception(f"Docker compose pull failed: {err or out}")
+
+    # Stop existing compose stack if any
+    logs.append("Stopping existing containers...")
+    with _phase(deployment, "stop"):
+        run_cmd(
+            ["docker", "compose", "-p", project, "-f", compose_file, "down", "--remove-orphans"],
+            cwd=str(repo_dir),
+            timeout=phase_timeout(app, "stop")
+        )
+
+    # Handle .env file - copy from .env.example if exists and .env doesn't
+    env_example = repo_dir / ".env.example"
+    env_file = repo_dir / ".env"
+    if env_example.exists() and not env_file.exists():
+        shutil.copy(env_example, env_file)
+        logs.append("Created .env from .env.example")
+
+    # Prepare environment variables to inject
+    env_file_content = []
+    for key, value in env_vars.items():
+        if not key.startswith("_keystone_"):  # Skip internal keys
+            env_file_content.append(f"{key}={value}")
+
+    # Append Keystone env vars to .env file
+    if env_file_content:
+        mode = "a" if env_file.exists() else "w"
+        with open(env_file, mode) as f:
+            f.write("\n# Keystone injected vars\n")
+            f.write("\n".join(env_file_content) + "\n")
+        logs.append(f"Added {len(env_file_content)} env vars to .env")
+
+    # Build images (only services without a prebuilt image)
+    to_build = []
+    if service_images:
+        to_build = [name for name in services_with_build(repo_dir / compose_file) if name not in service_images]
+    if to_build or not service_images:
+        logs.append("Building images...")
+        with _phase(deployment, "build"):
+            code, out, err = run_cmd(
+                ["docker", "compose", "-p", project, *files, "build", "--no-cache", *to_build],
+                cwd=str(repo_dir),
+                timeout=phase_timeout(app, "build")
+            )
+            logs.append(f"Build output:\n{out}\n{err}")
+
+            if code != 0:
+                raise Exception(f"Docker compose build failed: {err or out}")
+
+    # Start services
+    logs.append("Starting services with Traefik routing...")
+    with _phase(deployment, "start"):
+        code, out, err = run_cmd(
+            ["docker", "compose", "-p", project, *files, "up", "-d"] + (["--no-build"] if service_images else []),
+            cwd=str(repo_dir),
+            timeout=phase_timeout(app, "start")
+        )
+        logs.append(f"Up output:\n{out}\n{err}")
+
+        if code != 0:
+            raise Exception(f"Docker compose up failed: {err or out}")
+
+        # Get running containers
+        code, out, err = run_cmd(
+            ["docker", "compose", "-p", project, "-f", compose_file, "ps", "--format", "table"],
+            cwd=str(repo_dir)
+        )
+        logs.append(f"Running containers:\n{out}")
+
+        # Tag service images with deployment id so older builds can be garbage collected
+        deployment.images = tag_compose_images(app, deployment, project, compose_file, str(repo_dir))
+        logs.append(f"Tagged images: {', '.join(entry['tag'] for entry in deployment.images.values())}")
+
+    app.container_id = project  # Store project name for compose apps
+    _record_success(app, deployment, logs)
+
+    return {
+        "status": "running",
+        "container_id": project,
+        "deploy_mode": "compose",
+        "url": f"/{app.slug}",
+        "message": f"App deployed! Access at http://YOUR_VPS_IP/{app.slug}"
+    }
+
+
+def _deploy_dockerfile(app, deployment, repo_dir, logs):
+    """Deploy app using single Dockerfile."""
+    env_vars = app.env_vars or {}
+    build_context = env_vars.get("_keystone_build_context", ".")
+    build_dir = repo_dir / build_context if build_context != "." else repo_dir
+
+    # Build image
+    image_tag = f"keystone/{app.slug}:latest"
+    context = measure_context(build_dir)
+    deployment.context_bytes = context["bytes"]
+    logs.append(f"Building image: {image_tag} (context: {build_context}, {context['size']} in {context['files']} files)")
+    warning = context_warning(context["bytes"])
+    if warning:
+        logs.append(f"WARNING: {warning}")
+
+    with _phase(deployment, "build"):
+        code, out, err = run_cmd(
+            ["docker", "build", "-t", image_tag, "--label", f"keystone.app={app.slug}", "."],
+            cwd=str(build_dir),
+            timeout=phase_timeout(app, "build", 600)
+        )
+        logs.append(f"Build output:\n{out}\n{err}")
+        transferred, seconds = parse_context_transfer(f"{out}\n{err}")
+        deployment.context_bytes = transferred or deployment.context_bytes
+        deployment.context_transfer_seconds = seconds
+
+        if code != 0:
+            raise Exception(f"Docker build failed: {err or out}")
+
+    with _phase(deployment, "start"):
+        # Tag with deployment id so older builds can be garbage collected
+        deploy_tag = tag_deployment_image(image_tag, app, deployment)
+        logs.append(f"Tagged image: {deploy_tag}")
+
+        deployment.images = {"app": {"id": image_id(image_tag), "tag": deploy_tag}}
+
+        # Replace the running container (kept up until the build succeeded)
+        app.container_id = run_app_container(app, image_tag, logs)
+    _record_success(app, deployment, logs)
+
+    return {
+        "status": "running",
+        "container_id": app.container_id,
+        "url": f"/{app.slug}",
+        "deploy_mode": "dockerfile",
+        "context_bytes": deployment.context_bytes,
+        "context_transfer_seconds": deployment.context_transfer_seconds,
+        "message": f"App deployed! Access at http://YOUR_VPS_IP/{app.slug}"
+    }
+
+
+def _deploy_image(app, deployment, logs):
+    """Deploy a prebuilt image: pull it (only changed layers are fetched) and run it."""
+    logs.append(f"Pulling image: {app.image}")
+    with _phase(deployment, "pull"):
+        code, out, err = run_cmd(["docker", "pull", app.image], timeout=phase_timeout(app, "pull"))
+        logs.append(f"Pull output:\n{out}\n{err}")
+
+        if code != 0:
+            raise Exception(f"Docker pull failed: {err or out}")
+
+    # Image apps skip prepare, so they get their default route here
+    if not app.routes.exists():
+        register_routes(app, [{"service": "", "port": None, "path": f"/{app.slug}"}])
+    app.traefik_rule = f"PathPrefix(`/{app.slug}`)"
+
+    with _phase(deployment, "start"):
+        # Tag with deployment id so rollback and garbage collection work as for built images
+        deploy_tag = tag_deployment_image(app.image, app, deployment)
+        logs.append(f"Tagged image: {deploy_tag}")
+
+        deployment.images = {"app": {"id": image_id(app.image), "tag": deploy_tag}}
+
+        app.container_id = run_app_container(app, app.image, logs)
+    _record_success(app, deployment, logs)
+
+    return {
+        "status": "running",
+        "container_id": app.container_id,
+        "url": f"/{app.slug}",
+        "deploy_mode": "image",
+        "image": app.image,
+        "message": f"App deployed! Access at http://YOUR_VPS_IP/{app.slug}"
+    }
+
+
+def _stop_containers(app):
+    """Stop the app's container or compose stack on the current node."""
+    env_vars = app.env_vars or {}
+
+    if deploy_mode(app) == "compose":
+        # Stop compose stack
+        repo_dir = REPOS_DIR / app.slug
+        compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
+        project = project_name(app)
+        run_cmd(
+            ["docker", "compose", "-p", project, "-f", compose_file, "stop"],
+            cwd=str(repo_dir)
+        )
+    else:
+        # Stop single container
+        name = container_name(app)
+        run_cmd(["docker", "stop", name])
+
+
+def stop_app(app):
+    """Stop a running app."""
+    with use_node(app.node):
+        _stop_containers(app)
+
+    app.status = "stopped"
+    app.save()
+    sync_routes()
+
+    return {"status": "stopped"}
+
+
+def sleep_app(app):
+    """Scale an idle app to zero. Its routes switch to the waker."""
+    with use_node(app.node):
+        _stop_containers(app)
+
+    app.status = "sleeping"
+    app.save()
+    sync_routes()
+
+
+def wake_app(app, timeout=60):
+    """
+    Start a sleeping app's stopped containers and wait until it accepts
+    connections, then route traffic back to it.
+    """
+    env_vars = app.env_vars or {}
+
+    with use_node(app.node):
+        if deploy_mode(app) == "compose":
+            compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
+            code, out, err = run_cmd(
+                ["docker", "compose", "-p", project_name(app), "-f", compose_file, "start"],
+                cwd=str(REPOS_DIR / app.slug),
+                timeout=phase_timeout(app, "start")
+            )
+        else:
+            code, out, err = run_cmd(["docker", "start", container_name(app)], timeout=phase_timeout(app, "start"))
+
+    if code != 0:
+        raise Exception(f"Wake failed: {err or out}")
+
+    wait_until_ready(app, timeout)
+
+    app.status = "running"
+    app.last_request_at = timezone.now()
+    app.save()
+    sync_routes()
+
+
+def restore_app(app, timeout=60):
+    """
+    Bring a running app back after a host reboot or Keystone restart,
+    without building: start its existing containers or, when they are gone,
+    recreate them from the images of its last successful deployment.
+    Returns "running" (already up) or "started", once the app accepts connections.
+    """
+    env_vars = app.env_vars or {}
+
+    with use_node(app.node):
+        containers = _container_status(app)
+        if containers and all(container["state"] == "running" for container in containers):
+            wait_until_ready(app, timeout)
+            return "running"
+
+        mode = deploy_mode(app)
+        repo_dir = REPOS_DIR / app.slug
+        compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
+        if containers:
+            if mode == "compose":
+                code, out, err = run_cmd(
+                    ["docker", "compose", "-p", project_name(app), "-f", compose_file, "start"],
+                    cwd=str(repo_dir),
+                    timeout=phase_timeout(app, "start")
+                )
+            else:
+                code, out, err = run_cmd(["docker", "start", container_name(app)], timeout=phase_timeout(app, "start"))
+            if code != 0:
+                raise Exception(f"Start failed: {err or out}")
+        else:
+            last = (
+                Deployment.objects.filter(app=app, status="success")
+                .exclude(images={})
+                .order_by("-created_at")
+                .first()
+            )
+            if last is None:
+                raise Exception("No containers and no successful deployment with recorded images")
+            logs = []
+            if mode == "compose":
+                app.container_id = rollback_compose_stack(app, last.images, repo_dir, logs)
+            else:
+                app.container_id = run_app_container(app, ensure_deployment_image(last.images["app"]), logs)
+            app.save(update_fields=["container_id"])
+
+    wait_until_ready(app, timeout)
+    return "started"
+
+
+def wait_until_ready(app, timeout):
+    """Poll until every route target of the app accepts TCP connections."""
+    targets = []
+    for route in app.routes.all():
+        url = urlparse(route_url(app, route))
+        targets.append((url.hostname, url.port or 80))
+
+    deadline = time.monotonic() + timeout
+    for host, port in targets:
+        while True:
+            try:
+                with socket.create_connection((host, port), timeout=2):
+                    break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise Exception(f"{app.name} not ready after {timeout}s ({host}:{port})")
+                time.sleep(0.5)
+
+
+def app_logs(app, tail=100):
+    """Get the last `tail` lines of container logs."""
+    with use_node(app.node):
+        return _container_logs(app, tail)
+
+
+def app_status(app):
+    """Live state of the app's containers: [{"name", "service", "state", "status"}]."""
+    with use_node(app.node):
+        return _container_status(app)
+
+
+def _container_status(app):
+    env_vars = app.env_vars or {}
+
+    if deploy_mode(app) == "compose":
+        repo_dir = REPOS_DIR / app.slug
+        compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
+        code, out, err = run_cmd(
+            ["docker", "compose", "-p", project_name(app), "-f", compose_file, "ps", "-a",
+             "--format", "{{.Name}}|{{.Service}}|{{.State}}|{{.Status}}"],
+            cwd=str(repo_dir),
+            timeout=30
+        )
+    else:
+        code, out, err = run_cmd(
+            ["docker", "inspect", "--format",
+             "{{.Name}}||{{.State.Status}}|started {{.State.StartedAt}}, {{.RestartCount}} restarts",
+             container_name(app)],
+            timeout=30
+        )
+        if code != 0 and ("No such object" in err or "No such container" in err):
+            return []
+        out = out.lstrip("/")
+
+    if code != 0:
+        raise Exception(f"Docker status failed: {err or out}")
+
+    containers = []
+    for line in out.splitlines():
+        parts = line.split("|")
+        if len(parts) == 4:
+            containers.append(dict(zip(["name", "service", "state", "status"], parts)))
+    return containers
+
+
+def _container_logs(app, tail):
+    env_vars = app.env_vars or {}
+
+    if deploy_mode(app) == "compose":
+        # Get compose logs
+        repo_dir = REPOS_DIR / app.slug
+        compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
+        project = project_name(app)
+        code, out, err = run_cmd(
+            ["docker", "compose", "-p", project, "-f", compose_file, "logs", "--tail", str(tail)],
+            cwd=str(repo_dir)
+        )
+    else:
+        # Get single container logs
+        name = container_name(app)
+        code, out, err = run_cmd(["docker", "logs", "--tail", str(tail), name])
+
+    return out or err
+
+
+def rollback_deployment(target):
+    """
+    Restart the app from the images a previous deployment produced.
+    No git clone or docker build is involved. Returns the rollback result.
+    On failure the app and deployment are marked failed and the error re-raised.
+    """
+    app = target.app
+
+    deployment = Deployment.objects.create(
+        app=app,
+        status="running",
+        deploy_mode=target.deploy_mode,
+        images=target.images,
+        rollback_of=target,
+    )
+
+    app.status = "deploying"
+    app.error_message = ""
+    app.save()
+
+    logs = [f"Rolling back to deployment #{target.id}"]
+
+    try:
+        with track_job(deployment.id), use_node(app.node), _phase(deployment, "start"):
+            if target.deploy_mode == "compose":
+                repo_dir = REPOS_DIR / app.slug
+                if not repo_dir.exists():
+                    raise Exception("Repo not found. Please prepare first.")
+                app.container_id = rollback_compose_stack(app, target.images, repo_dir, logs)
+            else:
+                image = ensure_deployment_image(target.images["app"])
+                app.container_id = run_app_container(app, image, logs)
+
+        _record_success(app, deployment, logs)
+        sync_routes()
+
+        return {
+            "status": "running",
+            "container_id": app.container_id,
+            "deploy_mode": target.deploy_mode,
+            "deployment": deployment.id,
+            "rollback_of": target.id,
+            "url": f"/{app.slug}",
+            "message": f"Rolled back to deployment #{target.id}"
+        }
+
+    except Exception as e:
+        _record_failure(app, deployment, logs, e)
+        raise
+
+
+def _container_running(app):
+    """Whether the app's single container is up on the current node."""
+    code, out, err = run_cmd(["docker", "inspect", "-f", "{{.State.Running}}", container_name(app)], timeout=30)
+    return code == 0 and out.strip() == "true"
+
+
+def cancel_deployment(deployment):
+    """
+    Cancel a running deployment: mark it cancelled, kill the process group
+    of its current command and take down a half-started compose stack.
+    The app is released straight away (running if its previous container
+    survived, stopped otherwise) so it can be deployed again at once.
+    Returns None if the deployment finished before it could be cancelled.
+    """
+    app = deployment.app
+    now = timezone.now()
+
+    phases = deployment.phases or []
+    if phases and phases[-1]["status"] == "running":
+        started = parse_datetime(phases[-1]["started_at"])
+        phases[-1].update(status="cancelled", seconds=round((now - started).total_seconds(), 1))
+
+    # Conditional, like _record_success: whichever lands first wins
+    cancelled = Deployment.objects.filter(pk=deployment.pk, status="running").update(
+        status="cancelled", error="Cancelled", phases=phases, finished_at=now
+    )
+    if not cancelled:
+        return None
+    deployment.status = "cancelled"
+
+    killed = cancel_job(deployment.id)
+
+    with use_node(app.node):
+        if deployment.deploy_mode == "compose":
+            repo_dir = REPOS_DIR / app.slug
+            compose_file = (app.env_vars or {}).get("_keystone_compose_file", "docker-compose.yml")
+            run_cmd(
+                ["docker", "compose", "-p", project_name(app), "-f", compose_file, "down", "--remove-orphans"],
+                cwd=str(repo_dir),
+                timeout=phase_timeout(app, "stop")
+            )
+            running = False
+        else:
+            running = _container_running(app)
+
+    app.status = "running" if running else "stopped"
+    app.error_message = ""
+    app.save()
+    sync_routes()
+
+    return {
+        "status": "cancelled",
+        "deployment": deployment.id,
+        "process_killed": killed,
+        "app_status": app.status,
+        "phases": phases,
+    }
@@ -0,0 +1,191 @@
+"""
+Keystone Dockerfile Generator
+
+Generates multi-stage Dockerfiles for repos without one:
+- Django: dependencies installed into a venv in a build stage, WSGI module detected
+- Node: lockfile-aware installs, build script run in a build stage,
+  production-only node_modules in the final image
+
+pip/npm/yarn/pnpm caches live in BuildKit cache mounts with fixed ids, so
+every app built on this host shares them and rebuilds only fetch what changed.
+"""
+import json
+import re
+
+# Shared BuildKit cache mount ids
+PIP_CACHE = "--mount=type=cache,id=keystone-pip,target=/root/.cache/pip"
+NPM_CACHE = "--mount=type=cache,id=keystone-npm,target=/root/.npm"
+YARN_CACHE = "--mount=type=cache,id=keystone-yarn,target=/usr/local/share/.cache/yarn"
+PNPM_CACHE = "--mount=type=cache,id=keystone-pnpm,target=/root/.local/share/pnpm/store"
+
+# Directories never searched for a wsgi.py
+IGNORED_DIRS = {".git", "node_modules", "venv", ".venv", "env", "site-packages", "__pycache__"}
+
+# Node package managers: lockfile -> (install, production install, cache mount, setup)
+NODE_PACKAGE_MANAGERS = {
+    "pnpm-lock.yaml": (
+        "pnpm install --frozen-lockfile",
+        "pnpm install --frozen-lockfile --prod",
+        PNPM_CACHE,
+        "corepack enable && ",
+    ),
+    "yarn.lock": (
+        "yarn install --frozen-lockfile",
+        "yarn install --frozen-lockfile --production",
+        YARN_CACHE,
+        "",
+    ),
+    "package-lock.json": ("npm ci", "npm ci --omit=dev", NPM_CACHE, ""),
+    "npm-shrinkwrap.json": ("npm ci", "npm ci --omit=dev", NPM_CACHE, ""),
+}
+
+
+def detect_wsgi_module(build_dir):
+    """
+    Find the Django WSGI module, e.g. "config.wsgi".
+    Prefers the settings package named in manage.py, then any wsgi.py
+    close to the project root. Falls back to "config.wsgi".
+    """
+    manage_py = build_dir / "manage.py"
+    if manage_py.exists():
+        match = re.search(
+            r"DJANGO_SETTINGS_MODULE['\"]\s*,\s*['\"]([\w.]+)['\"]",
+            manage_py.read_text(errors="ignore"),
+        )
+        if match:
+            package = match.group(1).split(".")[0]
+            if (build_dir / package / "wsgi.py").exists():
+                return f"{package}.wsgi"
+
+    candidates = sorted(
+        (path for path in build_dir.glob("*/wsgi.py") if path.parent.name not in IGNORED_DIRS),
+        key=lambda path: path.parent.name,
+    )
+    if candidates:
+        return f"{candidates[0].parent.name}.wsgi"
+    return "config.wsgi"
+
+
+def detect_node_project(build_dir):
+    """Return lockfile, scripts and entry point of a Node project."""
+    try:
+        package = json.loads((build_dir / "package.json").read_text())
+    except (OSError, ValueError):
+        package = {}
+
+    lockfile = next((name for name in NODE_PACKAGE_MANAGERS if (build_dir / name).exists()), None)
+    scripts = package.get("scripts") or {}
+
+    return {
+        "lockfile": lockfile,
+        "build_script": "build" in scripts,
+        "start_script": "start" in scripts,
+        "main": package.get("main") or "index.js",
+    }
+
+
+def generate_django_dockerfile(build_dir):
+    """
+    Generate a multi-stage Dockerfile for a Django app.
+    Returns (content, detected info).
+    """
+    wsgi_module = detect_wsgi_module(build_dir)
+    content = f'''# syntax=docker/dockerfile:1
+# Generated by Keystone
+
+FROM python:3.12-slim AS build
+WORKDIR /app
+
+RUN python -m venv /opt/venv
+ENV PATH="/opt/venv/bin:$PATH"
+
+# Install dependencies (wheel cache shared across apps)
+COPY requirements.txt .
+RUN {PIP_CACHE} \\
+    pip install -r requirements.txt gunicorn
+
+FROM python:3.12-slim
+
+ENV PATH="/opt/venv/bin:$PATH" \\
+    PYTHONDONTWRITEBYTECODE=1 \\
+    PYTHONUNBUFFERED=1
+
+WORKDIR /app
+
+COPY --from=build /opt/venv /opt/venv
+
+# Copy app
+COPY . .
+
+# Collect static files
+RUN python manage.py collectstatic --noinput 2>/dev/null || true
+
+EXPOSE 8000
+
+CMD ["gunicorn", "--bind", "0.0.0.0:8000", "--workers", "2", "{wsgi_module}:application"]
+'''
+    return content, {"wsgi_module": wsgi_module}
+
+
+def generate_node_dockerfile(build_dir):
+    """
+    Generate a multi-stage Dockerfile for a Node app.
+    Returns (content, detected info).
+    """
+    project = detect_node_project(build_dir)
+    lockfile = project["lockfile"]
+
+    if lockfile:
+        install, install_prod, cache, setup = NODE_PACKAGE_MANAGERS[lockfile]
+        manifests = f"package.json {lockfile}"
+    else:
+        install, install_prod, cache, setup = ("npm install", "npm install --omit=dev", NPM_CACHE, "")
+        manifests = "package.json"
+
+    if project["start_script"]:
+        cmd = '["npm", "start"]'
+    else:
+        cmd = f'["node", "{project["main"]}"]'
+
+    if project["build_script"]:
+        build_stage = '''
+FROM deps AS build
+COPY . .
+# Drop dev dependencies so only production node_modules reach the final image
+RUN npm run build && rm -rf node_modules
+'''
+        copy_app = "COPY --from=build /app ./"
+    else:
+        build_stage = ""
+        copy_app = "COPY . ."
+
+    content = f'''# syntax=docker/dockerfile:1
+# Generated by Keystone
+
+FROM node:20-alpine AS deps
+WORKDIR /app
+COPY {manifests} ./
+RUN {cache} \\
+    {setup}{install}
+{build_stage}
+FROM node:20-alpine AS prod-deps
+WORKDIR /app
+COPY {manifests} ./
+RUN {cache} \\
+    {setup}{install_prod}
+
+FROM node:20-alpine
+ENV NODE_ENV=production
+WORKDIR /app
+
+{copy_app}
+COPY --from=prod-deps /app/node_modules ./node_modules
+
+EXPOSE 3000
+
+CMD {cmd}
+'''
+    return content, {
+        "lockfile": lockfile,
+        "build_script": project["build_script"],
+    }
@@ -0,0 +1,215 @@
+"""
+Keystone State Events
+
+Pushes App and Deployment changes to dashboards over Server-Sent Events
+(GET /api/events/) instead of every tab polling /api/apps/.
+
+While at least one client is connected, a watcher thread reads the app
+rows and the unfinished deployments once per KEYSTONE_EVENT_POLL_INTERVAL
+and diffs them against the previous read. Diffing the DB rather than
+hooking model signals also catches queryset/bulk updates and changes made
+by other processes (scale_idle_apps, sync_fleet, the admin).
+
+Events carry only the changed fields:
+    snapshot          {"apps": [...], "deployments": [...]}   full state
+    app               {"id", ...changed fields}                new app: all fields
+    app-deleted       {"id"}
+    deployment        {"id", "app", ...changed fields}         new deployment: all fields
+
+Event ids are "<epoch>-<seq>". A reconnecting client sends the last id it
+saw (Last-Event-ID) and gets the events it missed from a bounded history,
+or a fresh snapshot when they are gone or the server restarted.
+
+Like the read coalescing cache, the hub is per server process.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import App, Deployment
+from .serializers import AppSerializer, DeploymentStateSerializer
+
+logger = logging.getLogger(__name__)
+
+HISTORY = 1000
+KEEPALIVE_SECONDS = 15
+ACTIVE_DEPLOYMENT_STATUSES = ["pending", "running"]
+
+
+def _diff(old, new):
+    """Fields of `new` that differ from `old`, plus the id."""
+    changed = {key: value for key, value in new.items() if old.get(key) != value}
+    return {"id": new["id"], **changed} if changed else None
+
+
+class EventHub:
+    """Watches the DB while clients are connected and keeps a short event history."""
+
+    def __init__(self, interval, history=HISTORY):
+        self.interval = interval
+        self.epoch = uuid.uuid4().hex[:8]
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        self._apps = None
+        self._deployments = {}
+        self._last_deployment_id = 0
+        self._subscribers = 0
+        self._thread = None
+        self._ready = threading.Event()
+
+    @contextmanager
+    def subscribe(self):
+        """Keep the watcher running for the duration of a client connection."""
+        with self._cond:
+            self._subscribers += 1
+            if self._thread is None:
+                self._ready.clear()
+                self._thread = threading.Thread(target=self._run, name="keystone-events", daemon=True)
+                self._thread.start()
+        try:
+            self._ready.wait(timeout=10)
+            yield
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+    def snapshot(self):
+        """(event id, full state) as of the latest poll."""
+        with self._cond:
+            state = {
+                "apps": list((self._apps or {}).values()),
+                "deployments": [
+                    deployment for deployment in self._deployments.values()
+                    if deployment["status"] in ACTIVE_DEPLOYMENT_STATUSES
+                ],
+            }
+            return self.event_id(self._seq), state
+
+    def event_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def parse_event_id(self, value):
+        """Sequence number of an event id from this process, else None."""
+        epoch, _, seq = (value or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def events_after(self, seq, timeout=0):
+        """
+        Events newer than `seq`, waiting up to `timeout` seconds for one.
+        Returns None when some of them already fell out of the history.
+        """
+        with self._cond:
+            if seq > self._seq:
+                return None
+            if seq == self._seq and timeout:
+                self._cond.wait_for(lambda: self._seq > seq, timeout=timeout)
+            if self._seq == seq:
+                return []
+            if not self._events or self._events[0][0] > seq + 1:
+                return None
+            return [event for event in self._events if event[0] > seq]
+
+    def _publish(self, events):
+        if not events:
+            return
+        with self._cond:
+            for event_type, data in events:
+                self._seq += 1
+                self._events.append((self._seq, event_type, data))
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception("Event poll failed")
+                    connection.close()
+                self._ready.set()
+                time.sleep(self.interval)
+                with self._cond:
+                    if self._subscribers == 0:
+                        self._thread = None
+                        return
+        finally:
+            connection.close()
+
+    def poll(self):
+        """Read current state, publish what changed since the previous poll."""
+        apps = {data["id"]: data for data in AppSerializer(App.objects.order_by("-created_at"), many=True).data}
+
+        if self._apps is None:
+            # First poll: nothing to compare with, only track unfinished deployments
+            rows = Deployment.objects.filter(status__in=ACTIVE_DEPLOYMENT_STATUSES)
+            self._last_deployment_id = Deployment.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        else:
+            rows = Deployment.objects.filter(Q(id__gt=self._last_deployment_id) | Q(id__in=list(self._deployments)))
+        deployments = {
+            data["id"]: data
+            for data in DeploymentStateSerializer(rows.defer("logs").order_by("id"), many=True).data
+        }
+
+        events = []
+        if self._apps is not None:
+            for app_id, data in apps.items():
+                change = data if app_id not in self._apps else _diff(self._apps[app_id], data)
+                if change:
+                    events.append(("app", change))
+            for app_id in self._apps.keys() - apps.keys():
+                events.append(("app-deleted", {"id": app_id}))
+
+            for deployment_id, data in deployments.items():
+                previous = self._deployments.get(deployment_id)
+                change = data if previous is None else _diff(previous, data)
+                if change:
+                    events.append(("deployment", {**change, "app": data["app"]}))
+
+        with self._cond:
+            self._apps = apps
+            # Finished deployments won't change any more, stop reading them
+            self._deployments = {
+                deployment_id: data for deployment_id, data in deployments.items()
+                if data["status"] in ACTIVE_DEPLOYMENT_STATUSES
+            }
+            self._last_deployment_id = max([self._last_deployment_id, *deployments])
+            # Same lock as the state update, so a snapshot never runs ahead of its event id
+            self._publish(events)
+
+
+def format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def stream(hub, last_event_id=None):
+    """SSE body: missed events or a snapshot, then changes as they happen."""
+    with hub.subscribe():
+        yield f"retry: {int(hub.interval * 1000) + 2000}\n\n"
+        seq = hub.parse_event_id(last_event_id)
+        events = None if seq is None else hub.events_after(seq)
+
+        while True:
+            if events is None:
+                event_id, state = hub.snapshot()
+                seq = hub.parse_event_id(event_id)
+                yield format_event(event_id, "snapshot", state)
+            elif not events:
+                yield ": keepalive\n\n"
+            for event_seq, event_type, data in events or []:
+                seq = event_seq
+                yield format_event(hub.event_id(event_seq), event_type, data)
+            events = hub.events_after(seq, timeout=KEEPALIVE_SECONDS)
+
+
+EVENTS = EventHub(settings.KEYSTONE_EVENT_POLL_INTERVAL)
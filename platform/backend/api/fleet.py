@@ -0,0 +1,226 @@
+"""
+Keystone Fleet Manifest Sync
+
+Applies a declarative YAML manifest of apps:
+
+    apps:
+      - name: billing
+        git_url: https://github.com/org/billing
+        branch: main
+        container_port: 8000
+        env_vars:
+          DEBUG: "0"
+      - name: reports
+        image: ghcr.io/org/reports:2.1
+
+The manifest is diffed against the DB and written with bulk_create /
+bulk_update in a single transaction. Only apps whose source changed are
+re-prepared, and only running apps whose runtime config changed are
+redeployed. Apps with an `image` skip prepare and are deployed when the
+image reference changes.
+"""
+import logging
+import threading
+
+import yaml
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .deployer import deploy_app, prepare_app
+from .models import App
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+# Changing these needs a fresh clone (prepare) before deploying
+SOURCE_FIELDS = ["git_url", "branch"]
+# Changing these only needs a redeploy
+RUNTIME_FIELDS = ["image", "container_port", "env_vars"]
+
+
+class EnvValueField(serializers.Field):
+    """Env var value. YAML scalars (numbers, booleans) are kept as strings."""
+    
+    def to_internal_value(self, data):
+        if not isinstance(data, (str, int, float, bool)):
+            raise serializers.ValidationError("Expected a string, number or boolean")
+        return str(data)
+    
+    def to_representation(self, value):
+        return value
+
+
+class ManifestAppSerializer(serializers.Serializer):
+    """One app entry of a fleet manifest."""
+    name = serializers.CharField(max_length=100)
+    git_url = serializers.URLField(required=False, allow_blank=True, default="")
+    branch = serializers.CharField(max_length=100, default="main")
+    image = serializers.CharField(max_length=500, required=False, allow_blank=True, default="")
+    container_port = serializers.IntegerField(default=8000, min_value=1, max_value=65535)
+    env_vars = serializers.DictField(child=EnvValueField(), default=dict)
+    
+    def validate(self, attrs):
+        if not attrs["git_url"] and not attrs["image"]:
+            raise serializers.ValidationError("Either git_url or image is required")
+        return attrs
+
+
+def parse_manifest(manifest):
+    """
+    Validate a manifest (YAML text, {"apps": [...]} or a plain list).
+    Returns a list of validated app dicts. Raises serializers.ValidationError.
+    """
+    if isinstance(manifest, str):
+        try:
+            manifest = yaml.safe_load(manifest)
+        except yaml.YAMLError as e:
+            raise serializers.ValidationError({"manifest": f"Invalid YAML: {e}"})
+
+    if isinstance(manifest, dict):
+        manifest = manifest.get("apps")
+    if not isinstance(manifest, list):
+        raise serializers.ValidationError({"manifest": "Expected a list of apps under 'apps'"})
+
+    serializer = ManifestAppSerializer(data=manifest, many=True)
+    serializer.is_valid(raise_exception=True)
+
+    names = [entry["name"] for entry in serializer.validated_data]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise serializers.ValidationError({"manifest": f"Duplicate app names: {', '.join(duplicates)}"})
+
+    return serializer.validated_data
+
+
+def _user_env(env_vars):
+    """
+    Env vars without Keystone's internal _keystone_* keys, as strings (apps
+    created through the API may store {"WORKERS": 4}, the manifest gives "4").
+    """
+    return {k: str(v) for k, v in (env_vars or {}).items() if not k.startswith("_keystone_")}
+
+
+def plan_sync(entries):
+    """
+    Diff manifest entries against the DB.
+    Returns a plan dict: apps to create, apps to update (with changed
+    fields), unchanged and unmanaged app names.
+    """
+    existing = {app.name: app for app in App.objects.all()}
+    plan = {"create": [], "update": [], "unchanged": [], "unmanaged": []}
+
+    for entry in entries:
+        app = existing.pop(entry["name"], None)
+        if app is None:
+            plan["create"].append(entry)
+            continue
+
+        changed = [field for field in SOURCE_FIELDS + ["image", "container_port"] if getattr(app, field) != entry[field]]
+        if _user_env(app.env_vars) != entry["env_vars"]:
+            changed.append("env_vars")
+
+        if changed:
+            plan["update"].append({"app": app, "entry": entry, "changed": changed})
+        else:
+            plan["unchanged"].append(app.name)
+
+    plan["unmanaged"] = sorted(existing)
+    return plan
+
+
+def apply_sync(plan):
+    """
+    Write a sync plan in one transaction using bulk operations.
+    Returns the list of follow-up actions: (app name, "prepare" | "deploy").
+    """
+    now = timezone.now()
+    created = [
+        App(
+            name=entry["name"],
+            git_url=entry["git_url"],
+            branch=entry["branch"],
+            image=entry["image"],
+            container_port=entry["container_port"],
+            env_vars=entry["env_vars"],
+        )
+        for entry in plan["create"]
+    ]
+
+    updated = []
+    # Image apps have nothing to prepare
+    actions = [(app.name, "deploy" if app.image else "prepare") for app in created]
+    for item in plan["update"]:
+        app, entry, changed = item["app"], item["entry"], item["changed"]
+        internal = {k: v for k, v in (app.env_vars or {}).items() if k.startswith("_keystone_")}
+
+        app.git_url = entry["git_url"]
+        app.branch = entry["branch"]
+        app.image = entry["image"]
+        app.container_port = entry["container_port"]
+        app.env_vars = {**internal, **entry["env_vars"]}
+        app.updated_at = now
+        updated.append(app)
+
+        if any(field in SOURCE_FIELDS + ["image"] for field in changed) and not app.image:
+            actions.append((app.name, "prepare"))
+        elif "image" in changed:
+            actions.append((app.name, "deploy"))
+        elif app.status == "running":
+            actions.append((app.name, "deploy"))
+
+    with transaction.atomic():
+        App.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        App.objects.bulk_update(
+            updated, SOURCE_FIELDS + RUNTIME_FIELDS + ["updated_at"], batch_size=BATCH_SIZE
+        )
+
+    return actions
+
+
+def run_actions(actions, deploy=True):
+    """
+    Run follow-up prepare/deploy steps one app at a time.
+    Every step ends with a deploy unless `deploy` is False, in which case
+    only prepare steps run.
+    Returns {app name: "ok" | error message}.
+    """
+    results = {}
+    for name, step in actions:
+        app = App.objects.get(name=name)
+        try:
+            if app.status in ["preparing", "deploying"]:
+                raise Exception(f"App is busy ({app.status})")
+            if step == "prepare":
+                prepare_app(app)
+            if deploy:
+                deploy_app(app)
+            results[name] = "ok"
+        except Exception as e:
+            logger.warning("Fleet sync %s of %s failed: %s", step, name, e)
+            results[name] = str(e)
+    return results
+
+
+def run_actions_in_background(actions, deploy=True):
+    """Run follow-up steps in a daemon thread (used by the API endpoint)."""
+    def worker():
+        try:
+            run_actions(actions, deploy=deploy)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=worker, name="keystone-fleet-sync", daemon=True)
+    thread.start()
+    return thread
+
+
+def describe_plan(plan):
+    """JSON-friendly summary of a sync plan."""
+    return {
+        "create": [entry["name"] for entry in plan["create"]],
+        "update": {item["app"].name: item["changed"] for item in plan["update"]},
+        "unchanged": plan["unchanged"],
+        "unmanaged": plan["unmanaged"],
+    }
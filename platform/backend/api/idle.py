@@ -0,0 +1,145 @@
+"""
+Keystone Idle Policy (scale to zero)
+
+Traefik writes a JSON access log that Keystone reads incrementally to
+record App.last_request_at. A request counts for the app whose router
+matched it and for the app whose service answered it, which differ when
+a traffic split sends it to another app. Running apps with an idle_timeout_minutes and
+no request within that window are stopped and marked "sleeping"; their
+routes then point at the waker (see views.wake), which starts them again
+on the next request.
+
+Read position is kept in LOGS_DIR/access-log.offset. Once the log grows
+past KEYSTONE_ACCESS_LOG_MAX_BYTES it is truncated after being read
+(Traefik appends, so it just carries on at the start of the file).
+"""
+import json
+import logging
+import os
+import re
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .deployer import sleep_app
+from .models import App, Route
+from .routing import service_name
+from .runtime import LOGS_DIR
+
+logger = logging.getLogger(__name__)
+
+OFFSET_FILE = LOGS_DIR / "access-log.offset"
+# Router names generated by routing.build_config(): "<slug>-route-<id>@file"
+ROUTER_RE = re.compile(r"^(?P<slug>.+)-route-\d+@file$")
+
+
+def _load_offset():
+    try:
+        inode, offset = OFFSET_FILE.read_text().split()
+        return int(inode), int(offset)
+    except (OSError, ValueError):
+        return None, 0
+
+
+def route_services():
+    """{Traefik service name: app slug} for every route's container."""
+    return {service_name(route.app, route): route.app.slug for route in Route.objects.select_related("app")}
+
+
+def read_activity(path=None, services=None):
+    """
+    Read access log lines written since the last call. `services` maps
+    Traefik service names to app slugs (see route_services()).
+    Returns {app slug: time of its latest request}.
+    """
+    services = services or {}
+    path = Path(path or settings.KEYSTONE_TRAEFIK_ACCESS_LOG)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return {}
+
+    inode, offset = _load_offset()
+    if inode != stat.st_ino or stat.st_size < offset:
+        offset = 0
+
+    latest = {}
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                # Half-written line, read it next time
+                break
+            offset += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            when = parse_datetime(entry.get("StartUTC", "") or "")
+            if not when:
+                continue
+            slugs = set()
+            match = ROUTER_RE.match(entry.get("RouterName", ""))
+            if match:
+                slugs.add(match["slug"])
+            # With a traffic split the answering service can belong to another app
+            service = (entry.get("ServiceName") or "").removesuffix("@file")
+            if service in services:
+                slugs.add(services[service])
+            for slug in slugs:
+                if slug not in latest or when > latest[slug]:
+                    latest[slug] = when
+
+    if offset >= settings.KEYSTONE_ACCESS_LOG_MAX_BYTES:
+        os.truncate(path, 0)
+        offset = 0
+    OFFSET_FILE.write_text(f"{stat.st_ino} {offset}")
+    return latest
+
+
+def record_activity(path=None):
+    """Update App.last_request_at from the access log. Returns the number of apps seen."""
+    latest = read_activity(path, services=route_services())
+    if not latest:
+        return 0
+
+    apps = [app for app in App.objects.all() if app.slug in latest]
+    for app in apps:
+        if app.last_request_at is None or latest[app.slug] > app.last_request_at:
+            app.last_request_at = latest[app.slug]
+    App.objects.bulk_update(apps, ["last_request_at"])
+    return len(apps)
+
+
+def idle_apps(now=None):
+    """Running apps with an idle policy and no request (or deploy) within their timeout."""
+    now = now or timezone.now()
+    apps = (
+        App.objects.filter(status="running", idle_timeout_minutes__isnull=False, maintenance=False)
+        .annotate(last_deployed_at=Max("deployments__finished_at"))
+    )
+    idle = []
+    for app in apps:
+        active_at = max(filter(None, [app.last_request_at, app.last_deployed_at]), default=None)
+        if active_at is None or now - active_at >= timedelta(minutes=app.idle_timeout_minutes):
+            idle.append(app)
+    return idle
+
+
+def scale_idle(dry_run=False):
+    """Record traffic, then put idle apps to sleep. Returns the names of the idle apps."""
+    record_activity()
+    names = []
+    for app in idle_apps():
+        names.append(app.name)
+        if dry_run:
+            continue
+        try:
+            sleep_app(app)
+        except Exception as e:
+            logger.warning("Could not scale %s to zero: %s", app.name, e)
+    return names
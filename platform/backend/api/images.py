@@ -0,0 +1,220 @@
+"""
+Keystone Image Retention
+
+Every deployment tags the images it produced with its deployment id:
+- Dockerfile apps: keystone/{slug}:deploy-{id}
+- Compose apps:    keystone/{slug}-{service}:deploy-{id}
+
+collect_garbage() keeps the newest N deployment tags per app, then prunes
+dangling layers and trims the build cache down to a size budget.
+"""
+import re
+
+from django.conf import settings
+
+from .models import Deployment, Node
+from .runtime import run_cmd, use_node
+
+DEPLOY_TAG_PREFIX = "deploy-"
+
+SIZE_UNITS = {"B": 1, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4}
+
+
+def image_repository(app, service=None):
+    """Image repository name for an app (or one of its compose services)."""
+    if service:
+        return f"keystone/{app.slug}-{service}"
+    return f"keystone/{app.slug}"
+
+
+def deployment_tag(deployment):
+    return f"{DEPLOY_TAG_PREFIX}{deployment.id}"
+
+
+def parse_size(value):
+    """Convert a Docker size string ("1.2GB", "512kB") into bytes."""
+    match = re.match(r"^\s*([\d.]+)\s*([kKMGT]?B)\s*$", value or "")
+    if not match:
+        return 0
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def format_size(num_bytes):
+    """Convert bytes into a short human readable string."""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1000:
+            return f"{num_bytes:.1f}{unit}" if unit != "B" else f"{num_bytes}B"
+        num_bytes /= 1000
+    return f"{num_bytes:.1f}TB"
+
+
+def tag_deployment_image(image, app, deployment, service=None):
+    """Tag a built image with the deployment id. Returns the new reference."""
+    reference = f"{image_repository(app, service)}:{deployment_tag(deployment)}"
+    code, out, err = run_cmd(["docker", "tag", image, reference])
+    if code != 0:
+        raise Exception(f"Docker tag failed: {err or out}")
+    return reference
+
+
+def image_id(reference):
+    """Resolve an image reference to its sha256 ID, or "" if it doesn't exist."""
+    code, out, err = run_cmd(["docker", "image", "inspect", "--format", "{{.Id}}", reference])
+    return out.strip() if code == 0 else ""
+
+
+def ensure_deployment_image(entry):
+    """
+    Make sure a recorded deployment image ({"id", "tag"}) can still be run.
+    Re-creates the tag from the image ID if only the tag was pruned.
+    """
+    if image_id(entry["tag"]) == entry["id"]:
+        return entry["tag"]
+    if not image_id(entry["id"]):
+        raise Exception(f"Image {entry['tag']} is no longer available (garbage collected)")
+    code, out, err = run_cmd(["docker", "tag", entry["id"], entry["tag"]])
+    if code != 0:
+        raise Exception(f"Docker tag failed: {err or out}")
+    return entry["tag"]
+
+
+def tag_compose_images(app, deployment, project, compose_file, cwd):
+    """
+    Tag the images behind every container of a compose stack.
+    Returns {service: {"id": image_id, "tag": reference}}.
+    """
+    code, out, err = run_cmd(
+        ["docker", "compose", "-p", project, "-f", compose_file, "ps", "-a", "--format", "{{.Service}} {{.ID}}"],
+        cwd=cwd
+    )
+    if code != 0:
+        raise Exception(f"Docker compose ps failed: {err or out}")
+
+    references = {}
+    for line in out.splitlines():
+        parts = line.split()
+        if len(parts) != 2:
+            continue
+        service, container = parts
+        code, sha, err = run_cmd(["docker", "inspect", "--format", "{{.Image}}", container])
+        if code != 0:
+            continue
+        references[service] = {
+            "id": sha.strip(),
+            "tag": tag_deployment_image(sha.strip(), app, deployment, service),
+        }
+    return references
+
+
+def app_repositories(app):
+    """
+    Image repositories holding an app's deployment tags: its own, plus one per
+    compose service recorded on its deployments. A "keystone/{slug}-*" glob
+    would also match apps whose slug starts with this one.
+    """
+    repositories = {image_repository(app)}
+    for images in Deployment.objects.filter(app=app).exclude(images={}).values_list("images", flat=True):
+        for entry in images.values():
+            repositories.add(entry["tag"].rsplit(":", 1)[0])
+    return sorted(repositories)
+
+
+def list_deployment_images(app):
+    """
+    Return {deployment_id: [references]} for every deploy-* tag of an app.
+    """
+    images = {}
+    for repository in app_repositories(app):
+        code, out, err = run_cmd(
+            ["docker", "images", "--filter", f"reference={repository}:{DEPLOY_TAG_PREFIX}*",
+             "--format", "{{.Repository}}:{{.Tag}}"]
+        )
+        if code != 0:
+            continue
+        for line in out.splitlines():
+            tag = line.rsplit(":", 1)[-1]
+            try:
+                deployment_id = int(tag[len(DEPLOY_TAG_PREFIX):])
+            except ValueError:
+                continue
+            images.setdefault(deployment_id, []).append(line.strip())
+    return images
+
+
+def prune_app_images(app, keep, dry_run=False):
+    """
+    Remove deployment tags older than the newest `keep` deployments.
+    Images of the app's latest successful deployment (which may be a
+    rollback to an older build) are always kept.
+    Returns (removed references, approximate bytes reclaimed).
+    """
+    images = list_deployment_images(app)
+    expired = sorted(images, reverse=True)[keep:]
+
+    live = app.deployments.filter(status="success").first()
+    protected = {entry["tag"] for entry in live.images.values()} if live else set()
+
+    references = [
+        ref for deployment_id in expired for ref in images[deployment_id]
+        if ref not in protected
+    ]
+    if not references or dry_run:
+        return references, 0
+
+    sizes = {}
+    code, out, err = run_cmd(["docker", "image", "inspect", "--format", "{{.Id}} {{.Size}}"] + references)
+    for line in out.splitlines():
+        sha, _, size = line.partition(" ")
+        sizes[sha] = int(size or 0)
+
+    removed = []
+    reclaimed = 0
+    for reference in references:
+        code, out, err = run_cmd(["docker", "rmi", reference])
+        if code != 0:
+            continue
+        removed.append(reference)
+        for line in out.splitlines():
+            if line.startswith("Deleted: "):
+                reclaimed += sizes.pop(line[len("Deleted: "):].strip(), 0)
+    return removed, reclaimed
+
+
+def _reclaimed_space(output):
+    match = re.search(r"Total(?: reclaimed space)?:\s*(\S+)", output)
+    return parse_size(match.group(1)) if match else 0
+
+
+def collect_garbage(apps, keep=None, cache_budget=None, dry_run=False):
+    """
+    Apply the retention policy to all apps and prune Docker leftovers.
+    Returns a report dict with per-app removals and bytes reclaimed.
+    """
+    keep = settings.KEYSTONE_IMAGE_RETENTION if keep is None else keep
+    cache_budget = cache_budget or settings.KEYSTONE_BUILD_CACHE_BUDGET
+
+    report = {"apps": {}, "images_reclaimed": 0, "dangling_reclaimed": 0, "cache_reclaimed": 0}
+
+    for app in apps:
+        with use_node(app.node):
+            removed, reclaimed = prune_app_images(app, keep, dry_run=dry_run)
+        if removed:
+            report["apps"][app.name] = removed
+        report["images_reclaimed"] += reclaimed
+
+    if not dry_run:
+        # Local daemon plus every remote node
+        for node in [None] + [node for node in Node.objects.all() if not node.is_local]:
+            with use_node(node):
+                code, out, err = run_cmd(["docker", "image", "prune", "-f"], timeout=600)
+                report["dangling_reclaimed"] += _reclaimed_space(out)
+
+                code, out, err = run_cmd(
+                    ["docker", "builder", "prune", "-f", "--keep-storage", cache_budget], timeout=600
+                )
+                report["cache_reclaimed"] += _reclaimed_space(out)
+
+    report["total_reclaimed"] = (
+        report["images_reclaimed"] + report["dangling_reclaimed"] + report["cache_reclaimed"]
+    )
+    return report
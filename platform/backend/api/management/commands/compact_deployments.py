@@ -0,0 +1,50 @@
+"""Compact old deployment rows and archive or drop their logs."""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.images import format_size
+from api.models import App
+from api.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = "Keep the last N deployments per app plus successful milestones, compact the rest"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--app", action="append", help="Only this app (repeatable)")
+        parser.add_argument(
+            "--keep", type=int, default=settings.KEYSTONE_DEPLOYMENT_RETENTION,
+            help="Latest deployments kept in full per app",
+        )
+        parser.add_argument(
+            "--milestones", type=int, default=settings.KEYSTONE_DEPLOYMENT_MILESTONES,
+            help="Latest successful deployments kept in full per app",
+        )
+        parser.add_argument("--batch-size", type=int, default=200, help="Rows compacted per transaction")
+        parser.add_argument(
+            "--delete-logs", action="store_true",
+            default=not settings.KEYSTONE_DEPLOYMENT_LOG_ARCHIVE,
+            help="Drop log bodies instead of archiving them",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only count rows that would be compacted")
+
+    def handle(self, *args, **options):
+        apps = App.objects.all()
+        if options["app"]:
+            apps = apps.filter(name__in=options["app"])
+
+        report = apply_retention(
+            apps,
+            keep=options["keep"],
+            milestones=options["milestones"],
+            batch_size=options["batch_size"],
+            archive=not options["delete_logs"],
+            dry_run=options["dry_run"],
+        )
+
+        verb = "Would compact" if options["dry_run"] else "Compacted"
+        for app_name, count in report["apps"].items():
+            self.stdout.write(f"{app_name}: {verb} {count} deployment(s)")
+
+        if not options["dry_run"]:
+            self.stdout.write(f"Log text removed from the database: {format_size(report['bytes_freed'])}")
@@ -0,0 +1,43 @@
+"""Prune old deployment images, dangling layers and build cache."""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.images import collect_garbage, format_size
+from api.models import App
+
+
+class Command(BaseCommand):
+    help = "Keep the last N images per app and prune dangling layers and build cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep", type=int, default=settings.KEYSTONE_IMAGE_RETENTION,
+            help="Deployment images to keep per app",
+        )
+        parser.add_argument(
+            "--cache-budget", default=settings.KEYSTONE_BUILD_CACHE_BUDGET,
+            help="Build cache size to keep (e.g. 5GB)",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only list images that would be removed")
+
+    def handle(self, *args, **options):
+        report = collect_garbage(
+            App.objects.all(),
+            keep=options["keep"],
+            cache_budget=options["cache_budget"],
+            dry_run=options["dry_run"],
+        )
+
+        for app_name, references in report["apps"].items():
+            verb = "Would remove" if options["dry_run"] else "Removed"
+            self.stdout.write(f"{app_name}: {verb} {len(references)} image(s)")
+            for reference in references:
+                self.stdout.write(f"  {reference}")
+
+        if options["dry_run"]:
+            return
+
+        self.stdout.write(f"Deployment images: {format_size(report['images_reclaimed'])}")
+        self.stdout.write(f"Dangling layers: {format_size(report['dangling_reclaimed'])}")
+        self.stdout.write(f"Build cache: {format_size(report['cache_reclaimed'])}")
+        self.stdout.write(f"Total reclaimed: {format_size(report['total_reclaimed'])}")
@@ -0,0 +1,44 @@
+"""Bring apps marked running back up after a reboot, without rebuilding."""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.restore import READY_TIMEOUT, restore_fleet
+
+
+class Command(BaseCommand):
+    help = "Start or recreate every app marked running, in restore_priority order"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only list apps in restore order")
+        parser.add_argument("--concurrency", type=int, help="Apps restored at the same time")
+        parser.add_argument(
+            "--timeout", type=int, default=READY_TIMEOUT,
+            help="Seconds each app gets to accept connections",
+        )
+        parser.add_argument(
+            "--startup", action="store_true",
+            help="Run from the container start command; does nothing if KEYSTONE_RESTORE_ON_START=0",
+        )
+
+    def handle(self, *args, **options):
+        if options["startup"] and not settings.KEYSTONE_RESTORE_ON_START:
+            return
+
+        report = restore_fleet(
+            concurrency=options["concurrency"], timeout=options["timeout"], dry_run=options["dry_run"]
+        )
+        if options["dry_run"]:
+            for entry in report["apps"]:
+                self.stdout.write(f"[{entry['priority']}] {entry['app']}")
+            return
+
+        for entry in report["apps"]:
+            line = f"[{entry['priority']}] {entry['app']}: {entry['result']} after {entry['ready_after']}s"
+            if entry.get("error"):
+                line += f" ({entry['error']})"
+            self.stdout.write(line)
+        counts = report["counts"]
+        self.stdout.write(
+            f"Fleet restored in {report['seconds']}s: {counts['started']} started, "
+            f"{counts['running']} already running, {counts['failed']} failed"
+        )
@@ -0,0 +1,30 @@
+"""Stop apps that had no traffic for longer than their idle timeout."""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.idle import scale_idle
+
+
+class Command(BaseCommand):
+    help = "Read the Traefik access log and scale idle apps to zero"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only list apps that would be stopped")
+        parser.add_argument(
+            "--loop", type=int, metavar="SECONDS",
+            help="Keep running and check every SECONDS instead of once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            names = scale_idle(dry_run=options["dry_run"])
+            verb = "Would stop" if options["dry_run"] else "Stopped"
+            for name in names:
+                self.stdout.write(f"{verb} idle app: {name}")
+
+            if not options["loop"]:
+                return
+            connection.close()
+            time.sleep(options["loop"])
@@ -0,0 +1,45 @@
+"""Apply a YAML fleet manifest to the app registry."""
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+
+from api.fleet import apply_sync, describe_plan, parse_manifest, plan_sync, run_actions
+
+
+class Command(BaseCommand):
+    help = "Create/update apps from a YAML manifest and prepare/deploy the ones that changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifest", help="Path to the YAML manifest")
+        parser.add_argument("--dry-run", action="store_true", help="Only show what would change")
+        parser.add_argument("--no-deploy", action="store_true", help="Prepare changed apps but don't deploy them")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["manifest"]) as f:
+                entries = parse_manifest(f.read())
+        except OSError as e:
+            raise CommandError(f"Cannot read manifest: {e}")
+        except serializers.ValidationError as e:
+            raise CommandError(f"Invalid manifest: {e.detail}")
+
+        plan = plan_sync(entries)
+        summary = describe_plan(plan)
+
+        for name in summary["create"]:
+            self.stdout.write(f"+ {name}")
+        for name, changed in summary["update"].items():
+            self.stdout.write(f"~ {name} ({', '.join(changed)})")
+        for name in summary["unmanaged"]:
+            self.stdout.write(f"? {name} (not in manifest, left untouched)")
+        self.stdout.write(
+            f"{len(summary['create'])} to create, {len(summary['update'])} to update, "
+            f"{len(summary['unchanged'])} unchanged"
+        )
+
+        if options["dry_run"]:
+            return
+
+        actions = apply_sync(plan)
+        results = run_actions(actions, deploy=not options["no_deploy"])
+        for name, result in results.items():
+            self.stdout.write(f"{name}: {result}")
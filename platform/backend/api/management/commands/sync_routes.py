@@ -0,0 +1,24 @@
+"""Regenerate the Traefik routes file from the DB."""
+import yaml
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.routing import ROUTES_FILE, build_config, sync_routes
+
+
+class Command(BaseCommand):
+    help = "Write the Traefik file-provider config for all routed apps"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--print", action="store_true", help="Print the config instead of writing it")
+
+    def handle(self, *args, **options):
+        config = build_config()
+        routers = config.get("http", {}).get("routers", {})
+
+        if options["print"]:
+            self.stdout.write(yaml.dump(config, default_flow_style=False, sort_keys=False))
+            return
+
+        sync_routes()
+        self.stdout.write(f"Wrote {len(routers)} router(s) to {settings.KEYSTONE_TRAEFIK_DYNAMIC_DIR}/{ROUTES_FILE}")
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_deployment_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Node',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('docker_host', models.CharField(blank=True, default='', help_text='DOCKER_HOST for this node (tcp://... or ssh://...). Empty = local socket.', max_length=255)),
+                ('address', models.CharField(blank=True, default='', help_text='Host/IP Traefik uses to reach apps published on this node', max_length=255)),
+                ('enabled', models.BooleanField(default=True, help_text='Accept new apps')),
+                ('cpu_capacity', models.FloatField(default=0, help_text='CPU cores')),
+                ('memory_capacity_mb', models.IntegerField(default=0)),
+                ('cpu_load', models.FloatField(default=0, help_text='CPU cores in use by containers')),
+                ('memory_used_mb', models.IntegerField(default=0)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='cpu_reservation',
+            field=models.FloatField(default=0.5, help_text='CPU cores reserved on the node'),
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='host_port',
+            field=models.IntegerField(blank=True, help_text='Published port on remote nodes', null=True),
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='memory_reservation_mb',
+            field=models.IntegerField(default=512, help_text='Memory reserved on the node'),
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='node',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='apps', to='api.node'),
+        ),
+    ]
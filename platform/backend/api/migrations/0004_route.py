@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_default_routes(apps, schema_editor):
+    """
+    Give prepared Dockerfile apps their /<slug> route. Compose apps keep the
+    labels written into their compose file until they are prepared again.
+    """
+    App = apps.get_model("api", "App")
+    Route = apps.get_model("api", "Route")
+    routes = []
+    for app in App.objects.exclude(status__in=["imported", "preparing"]):
+        if (app.env_vars or {}).get("_keystone_deploy_mode", "dockerfile") == "compose":
+            continue
+        slug = app.name.lower().replace(" ", "-").replace("_", "-")
+        routes.append(Route(app=app, path_prefix=f"/{slug}"))
+    Route.objects.bulk_create(routes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_node'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='maintenance',
+            field=models.BooleanField(default=False, help_text='Serve a maintenance page instead of the app'),
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='traffic_split',
+            field=models.JSONField(blank=True, default=dict, help_text="Percent of this app's traffic sent to other apps: {app name: weight}"),
+        ),
+        migrations.CreateModel(
+            name='Route',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path_prefix', models.CharField(help_text='e.g. /myapp or /myapp/api', max_length=200)),
+                ('service', models.CharField(blank=True, default='', help_text='Compose service. Empty = the app container', max_length=100)),
+                ('port', models.IntegerField(blank=True, help_text="Container port. Empty = the app's container_port", null=True)),
+                ('host', models.CharField(blank=True, default='', help_text='Container name, if the compose file sets one', max_length=255)),
+                ('strip_prefix', models.BooleanField(default=True, help_text='Remove the prefix before forwarding')),
+                ('middlewares', models.JSONField(blank=True, default=list, help_text='Extra Traefik middlewares, e.g. ["auth@file"]')),
+                ('app', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='routes', to='api.app')),
+            ],
+            options={
+                'ordering': ['path_prefix'],
+            },
+        ),
+        migrations.RunPython(create_default_routes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_route'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='timeouts',
+            field=models.JSONField(blank=True, default=dict, help_text='Per-phase timeouts in seconds, e.g. {"build": 1800}. Phases: clone, stop, build, start'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='phases',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AlterField(
+            model_name='deployment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('success', 'Success'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_deployment_phases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='image',
+            field=models.CharField(blank=True, default='', help_text='Image to run instead of building from git, e.g. ghcr.io/org/app:1.4', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='service_images',
+            field=models.JSONField(blank=True, default=dict, help_text='Compose apps: {service: image} to pull instead of building'),
+        ),
+        migrations.AlterField(
+            model_name='app',
+            name='git_url',
+            field=models.URLField(blank=True, default='', help_text='GitHub repository URL'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_app_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deployment',
+            name='commit',
+            field=models.CharField(blank=True, default='', help_text='Git commit deployed', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='compacted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='log_archive',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name='deployment',
+            index=models.Index(fields=['app', '-created_at'], name='api_deploym_app_id_dd8977_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_deployment_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='idle_timeout_minutes',
+            field=models.IntegerField(blank=True, help_text='Stop after this many minutes without requests. Empty = always on', null=True),
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='last_request_at',
+            field=models.DateTimeField(blank=True, help_text='From the Traefik access log', null=True),
+        ),
+        migrations.AlterField(
+            model_name='app',
+            name='status',
+            field=models.CharField(choices=[('imported', 'Imported'), ('preparing', 'Preparing'), ('prepared', 'Prepared'), ('deploying', 'Deploying'), ('running', 'Running'), ('sleeping', 'Sleeping'), ('stopped', 'Stopped'), ('failed', 'Failed')], default='imported', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_app_idle_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deployment',
+            name='context_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='context_transfer_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_deployment_context_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='restore_priority',
+            field=models.PositiveSmallIntegerField(default=100, help_text='Lower restores first'),
+        ),
+    ]
@@ -9,6 +9,41 @@ Keystone Models - Simple VPS Deployment
 from django.db import models
 
 
+class Node(models.Model):
+    """A Docker daemon apps can be placed on."""
+    
+    name = models.CharField(max_length=100, unique=True)
+    docker_host = models.CharField(
+        max_length=255, blank=True, default="",
+        help_text="DOCKER_HOST for this node (tcp://... or ssh://...). Empty = local socket."
+    )
+    address = models.CharField(
+        max_length=255, blank=True, default="",
+        help_text="Host/IP Traefik uses to reach apps published on this node"
+    )
+    enabled = models.BooleanField(default=True, help_text="Accept new apps")
+    
+    # Capacity (0 = read from `docker info` on refresh)
+    cpu_capacity = models.FloatField(default=0, help_text="CPU cores")
+    memory_capacity_mb = models.IntegerField(default=0)
+    
+    # Current load (updated on refresh)
+    cpu_load = models.FloatField(default=0, help_text="CPU cores in use by containers")
+    memory_used_mb = models.IntegerField(default=0)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.docker_host or 'local'})"
+    
+    @property
+    def is_local(self):
+        """Whether this node is the daemon Keystone and Traefik run on."""
+        return not self.docker_host or self.docker_host.startswith("unix://")
+
+
 class App(models.Model):
     """An application to deploy from GitHub."""
     
@@ -18,15 +53,26 @@ class App(models.Model):
         ("prepared", "Prepared"),
         ("deploying", "Deploying"),
         ("running", "Running"),
+        ("sleeping", "Sleeping"),
         ("stopped", "Stopped"),
         ("failed", "Failed"),
     ]
     
     # Basic info
     name = models.CharField(max_length=100, unique=True, help_text="Unique app name (used in URL path)")
-    git_url = models.URLField(help_text="GitHub repository URL")
+    git_url = models.URLField(blank=True, default="", help_text="GitHub repository URL")
     branch = models.CharField(max_length=100, default="main")
     
+    # Prebuilt images (built by external CI): deploy pulls instead of cloning and building
+    image = models.CharField(
+        max_length=500, blank=True, default="",
+        help_text="Image to run instead of building from git, e.g. ghcr.io/org/app:1.4"
+    )
+    service_images = models.JSONField(
+        default=dict, blank=True,
+        help_text="Compose apps: {service: image} to pull instead of building"
+    )
+    
     # Status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="imported")
     error_message = models.TextField(blank=True, default="")
@@ -34,13 +80,37 @@ class App(models.Model):
     # Deployment config (set during prepare)
     container_port = models.IntegerField(default=8000, help_text="Port the app listens on inside container")
     env_vars = models.JSONField(default=dict, blank=True, help_text="Environment variables")
+    timeouts = models.JSONField(
+        default=dict, blank=True,
+        help_text="Per-phase timeouts in seconds, e.g. {\"build\": 1800}. Phases: clone, stop, build, start"
+    )
     
     # Traefik routing (set during prepare)
     traefik_rule = models.CharField(max_length=500, blank=True, default="")
+    maintenance = models.BooleanField(default=False, help_text="Serve a maintenance page instead of the app")
+    traffic_split = models.JSONField(
+        default=dict, blank=True,
+        help_text="Percent of this app's traffic sent to other apps: {app name: weight}"
+    )
     
     # Runtime info
     container_id = models.CharField(max_length=100, blank=True, default="")
     
+    # Scale to zero: stopped after idle_timeout_minutes without traffic, woken by the next request
+    idle_timeout_minutes = models.IntegerField(
+        null=True, blank=True, help_text="Stop after this many minutes without requests. Empty = always on"
+    )
+    last_request_at = models.DateTimeField(null=True, blank=True, help_text="From the Traefik access log")
+    
+    # Fleet restore after a reboot: lower priorities come back first
+    restore_priority = models.PositiveSmallIntegerField(default=100, help_text="Lower restores first")
+    
+    # Placement (set by the scheduler on first deploy)
+    node = models.ForeignKey(Node, on_delete=models.SET_NULL, null=True, blank=True, related_name="apps")
+    cpu_reservation = models.FloatField(default=0.5, help_text="CPU cores reserved on the node")
+    memory_reservation_mb = models.IntegerField(default=512, help_text="Memory reserved on the node")
+    host_port = models.IntegerField(null=True, blank=True, help_text="Published port on remote nodes")
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -53,19 +123,75 @@ class App(models.Model):
         return self.name.lower().replace(" ", "-").replace("_", "-")
 
 
+class Route(models.Model):
+    """A path prefix Traefik routes to one of an app's containers."""
+    
+    app = models.ForeignKey(App, on_delete=models.CASCADE, related_name="routes")
+    path_prefix = models.CharField(max_length=200, help_text="e.g. /myapp or /myapp/api")
+    service = models.CharField(max_length=100, blank=True, default="", help_text="Compose service. Empty = the app container")
+    port = models.IntegerField(null=True, blank=True, help_text="Container port. Empty = the app's container_port")
+    host = models.CharField(max_length=255, blank=True, default="", help_text="Container name, if the compose file sets one")
+    strip_prefix = models.BooleanField(default=True, help_text="Remove the prefix before forwarding")
+    middlewares = models.JSONField(default=list, blank=True, help_text='Extra Traefik middlewares, e.g. ["auth@file"]')
+    
+    class Meta:
+        ordering = ["path_prefix"]
+    
+    def __str__(self):
+        return f"{self.path_prefix} -> {self.app.name}{':' + self.service if self.service else ''}"
+
+
 class Deployment(models.Model):
     """Deployment history for an app."""
     
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("success", "Success"),
+        ("failed", "Failed"),
+        ("cancelled", "Cancelled"),
+    ]
+    
     app = models.ForeignKey(App, on_delete=models.CASCADE, related_name="deployments")
-    status = models.CharField(max_length=20, default="pending")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
     logs = models.TextField(blank=True, default="")
     error = models.TextField(blank=True, default="")
     
+    # Images produced by this deployment: {service: {"id": sha256, "tag": reference}}
+    # Dockerfile apps use the single key "app".
+    deploy_mode = models.CharField(max_length=20, blank=True, default="")
+    images = models.JSONField(default=dict, blank=True)
+    rollback_of = models.ForeignKey(
+        "self", on_delete=models.SET_NULL, null=True, blank=True, related_name="rollbacks"
+    )
+    
+    # Phase timing: [{"phase", "started_at", "seconds", "status"}], the last entry is the current phase
+    phases = models.JSONField(default=list, blank=True)
+    
+    commit = models.CharField(max_length=40, blank=True, default="", help_text="Git commit deployed")
+    
+    # Build context sent to the daemon (Dockerfile apps), as reported by the build
+    context_bytes = models.BigIntegerField(null=True, blank=True)
+    context_transfer_seconds = models.FloatField(null=True, blank=True)
+    
+    # Retention: compacted rows keep status, timing, commit and an error excerpt;
+    # their logs are moved to log_archive (gzip) or dropped
+    compacted = models.BooleanField(default=False)
+    log_archive = models.CharField(max_length=500, blank=True, default="")
+    
     created_at = models.DateTimeField(auto_now_add=True)
     finished_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ["-created_at"]
+        indexes = [models.Index(fields=["app", "-created_at"])]
     
     def __str__(self):
         return f"{self.app.name} - {self.status} - {self.created_at}"
+    
+    @property
+    def duration(self):
+        """Seconds from start to finish, None while running."""
+        if not self.finished_at:
+            return None
+        return round((self.finished_at - self.created_at).total_seconds(), 1)
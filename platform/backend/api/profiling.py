@@ -0,0 +1,213 @@
+"""
+Keystone Request Profiling
+
+ProfilingMiddleware profiles:
+- with KEYSTONE_PROFILING=1, a random KEYSTONE_PROFILE_SAMPLE_RATE fraction
+  of requests
+- whatever the setting, requests sent with an "X-Keystone-Profile: <token>"
+  header, where the token is a signed value staff get from
+  POST /api/profiles/token/. It is checked before anything is profiled, so
+  other clients can't make the server profile their requests.
+Without sampling and without the header, a request costs one header lookup.
+
+A profile records:
+- a wall-clock call tree, built by sampling the request thread's stack
+  every SAMPLE_INTERVAL seconds (time blocked on Docker or the DB shows up
+  like any other time)
+- SQL query count and time, with the slowest queries
+- time spent in subprocesses started through run_cmd
+
+The last PROFILE_HISTORY profiles are kept in memory (per server process,
+like the read caches) and served to staff at /api/profiles/.
+"""
+import random
+import sys
+import threading
+import time
+from collections import deque
+from itertools import count
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+from django.utils import timezone
+
+from .runtime import record_commands
+
+PROFILE_HISTORY = 50
+SAMPLE_INTERVAL = 0.005
+PROFILE_HEADER = "X-Keystone-Profile"
+TOKEN_SALT = "keystone.profiling"
+# Seconds a profiling token stays valid
+TOKEN_MAX_AGE = 24 * 3600
+# Call tree nodes below this share of the samples are dropped
+MIN_NODE_SHARE = 0.01
+SLOWEST_QUERIES = 5
+MAX_COMMANDS = 50
+
+_profiles = deque(maxlen=PROFILE_HISTORY)
+_profiles_lock = threading.Lock()
+_ids = count(1)
+
+
+def recent_profiles():
+    """Stored profiles, newest first."""
+    with _profiles_lock:
+        return list(reversed(_profiles))
+
+
+def get_profile(profile_id):
+    return next((profile for profile in recent_profiles() if profile["id"] == profile_id), None)
+
+
+def _store(profile):
+    with _profiles_lock:
+        _profiles.append(profile)
+
+
+def profile_token(user):
+    """Signed value for the X-Keystone-Profile header (issued to staff only)."""
+    return signing.dumps(user.pk, salt=TOKEN_SALT)
+
+
+def _token_user_id(token):
+    """User id a profiling token was issued to, or None if it isn't valid."""
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+class StackSampler(threading.Thread):
+    """Samples another thread's stack at a fixed interval into a call tree."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(name="keystone-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root = {"samples": 0, "children": {}}
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+
+            node = self.root
+            node["samples"] += 1
+            for code in reversed(stack):
+                node = node["children"].setdefault(code, {"samples": 0, "children": {}})
+                node["samples"] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def tree(self):
+        """Call tree as JSON: [{"name", "ms", "self_ms", "children"}], heaviest first."""
+        min_samples = max(1, int(self.root["samples"] * MIN_NODE_SHARE))
+        ms_per_sample = self.interval * 1000
+        return _export(self.root["children"], min_samples, ms_per_sample)
+
+
+def _code_label(code):
+    filename = code.co_filename
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        filename = filename[len(base) + 1:]
+    elif "site-packages/" in filename:
+        filename = filename.split("site-packages/", 1)[1]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _export(children, min_samples, ms_per_sample):
+    nodes = []
+    for code, node in sorted(children.items(), key=lambda item: -item[1]["samples"]):
+        if node["samples"] < min_samples:
+            continue
+        child_samples = sum(child["samples"] for child in node["children"].values())
+        nodes.append({
+            "name": _code_label(code),
+            "ms": round(node["samples"] * ms_per_sample, 1),
+            "self_ms": round((node["samples"] - child_samples) * ms_per_sample, 1),
+            "children": _export(node["children"], min_samples, ms_per_sample),
+        })
+    return nodes
+
+
+class _QueryTimer:
+    """connection.execute_wrapper() callable counting and timing SQL queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            self.queries.append((elapsed, sql))
+
+    def summary(self):
+        slowest = sorted(self.queries, key=lambda query: -query[0])[:SLOWEST_QUERIES]
+        return {
+            "count": self.count,
+            "ms": round(self.seconds * 1000, 1),
+            "slowest": [{"ms": round(elapsed * 1000, 1), "sql": sql[:500]} for elapsed, sql in slowest],
+        }
+
+
+class ProfilingMiddleware:
+    """Profile sampled (or explicitly requested) requests into the in-memory ring."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.KEYSTONE_PROFILE_SAMPLE_RATE if settings.KEYSTONE_PROFILING else 0
+
+    def __call__(self, request):
+        token = request.headers.get(PROFILE_HEADER)
+        requested = bool(token) and _token_user_id(token) is not None
+        if not requested and (not self.sample_rate or random.random() >= self.sample_rate):
+            return self.get_response(request)
+
+        sampler = StackSampler(threading.get_ident())
+        queries = _QueryTimer()
+        started_at = timezone.now()
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            with connection.execute_wrapper(queries), record_commands() as commands:
+                response = self.get_response(request)
+        finally:
+            sampler.stop()
+        duration = time.perf_counter() - started
+
+        user = getattr(request, "user", None)
+        profile = {
+            "id": next(_ids),
+            "method": request.method,
+            "path": request.get_full_path()[:500],
+            "status": response.status_code,
+            "user": user.get_username() if user and user.is_authenticated else "",
+            "trigger": "header" if requested else "sample",
+            "started_at": started_at.isoformat(),
+            "ms": round(duration * 1000, 1),
+            "sql": queries.summary(),
+            "subprocess": {
+                "count": len(commands),
+                "ms": round(sum(command["ms"] for command in commands), 1),
+                "commands": commands[:MAX_COMMANDS],
+            },
+            "tree": sampler.tree(),
+        }
+        _store(profile)
+        response["X-Keystone-Profile-Id"] = str(profile["id"])
+        return response
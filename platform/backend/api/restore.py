@@ -0,0 +1,153 @@
+"""
+Keystone Fleet Restore
+
+After a host reboot (or a Keystone restart) apps marked running in the DB
+may not be. restore_fleet() brings them back without rebuilding anything:
+existing containers are started, missing ones are recreated from the
+images of the app's last successful deployment (see deployer.restore_app).
+
+Apps are restored in App.restore_priority order, lowest first. Apps that
+share a priority are restored together, at most KEYSTONE_RESTORE_CONCURRENCY
+at a time, and a priority only starts once the previous one is done, so
+e.g. shared databases (priority 0) accept connections before the apps
+using them start.
+
+Only one restore runs at a time across processes (the startup
+`restore_fleet --startup` command and the API server), guarded by a
+flock on LOGS_DIR/restore.lock.
+
+The report, including the time until the whole fleet was restored, is
+written to LOGS_DIR/restore.json.
+"""
+import fcntl
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .deployer import restore_app
+from .models import App
+from .runtime import LOGS_DIR
+
+logger = logging.getLogger(__name__)
+
+REPORT_FILE = LOGS_DIR / "restore.json"
+LOCK_FILE = LOGS_DIR / "restore.lock"
+# Seconds each app gets to accept connections once its containers are started
+READY_TIMEOUT = 120
+
+
+class RestoreInProgress(Exception):
+    """Another process (or thread) is restoring the fleet."""
+
+
+@contextmanager
+def _restore_lock():
+    """Hold the cross-process restore lock; raises if another restore holds it."""
+    LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_FILE, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RestoreInProgress("A fleet restore is already running")
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def restore_candidates():
+    """Apps the DB says are running, in restore order."""
+    return list(App.objects.filter(status="running").select_related("node").order_by("restore_priority", "name"))
+
+
+def _restore_one(app, timeout, fleet_started):
+    started = time.monotonic()
+    entry = {"app": app.name, "priority": app.restore_priority}
+    try:
+        entry["result"] = restore_app(app, timeout=timeout)
+    except Exception as e:
+        entry["result"] = "failed"
+        entry["error"] = str(e)
+        app.status = "failed"
+        app.error_message = f"Restore failed: {e}"
+        app.save(update_fields=["status", "error_message", "updated_at"])
+    finally:
+        connection.close()
+    now = time.monotonic()
+    entry["seconds"] = round(now - started, 1)
+    entry["ready_after"] = round(now - fleet_started, 1)
+    logger.info("Restore %s: %s after %ss", app.name, entry["result"], entry["ready_after"])
+    return entry
+
+
+def restore_fleet(concurrency=None, timeout=READY_TIMEOUT, dry_run=False):
+    """
+    Restore every app marked running. Returns the report:
+    {"started_at", "finished_at", "seconds", "counts", "apps": [{"app", "priority", "result", ...}]}
+    where "seconds" is the time until the last app was restored.
+    """
+    concurrency = concurrency or settings.KEYSTONE_RESTORE_CONCURRENCY
+    apps = restore_candidates()
+    report = {"started_at": timezone.now().isoformat(), "concurrency": concurrency, "apps": []}
+
+    if dry_run:
+        report["apps"] = [{"app": app.name, "priority": app.restore_priority} for app in apps]
+        return report
+
+    with _restore_lock():
+        fleet_started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="keystone-restore") as pool:
+            for _, tier in groupby(apps, key=lambda app: app.restore_priority):
+                # Wait for a whole priority before starting the next
+                report["apps"].extend(pool.map(lambda app: _restore_one(app, timeout, fleet_started), list(tier)))
+        report["seconds"] = round(time.monotonic() - fleet_started, 1)
+
+    report["finished_at"] = timezone.now().isoformat()
+    report["counts"] = {
+        result: sum(1 for entry in report["apps"] if entry["result"] == result)
+        for result in ["running", "started", "failed"]
+    }
+
+    REPORT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    REPORT_FILE.write_text(json.dumps(report, indent=2))
+    return report
+
+
+def restore_in_progress():
+    """Whether any process is restoring the fleet right now."""
+    try:
+        with _restore_lock():
+            return False
+    except RestoreInProgress:
+        return True
+
+
+def restore_fleet_in_background(**kwargs):
+    """Run restore_fleet() in a daemon thread (used by the API endpoint)."""
+    def worker():
+        try:
+            restore_fleet(**kwargs)
+        except Exception as e:
+            logger.warning("Fleet restore failed: %s", e)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=worker, name="keystone-fleet-restore", daemon=True)
+    thread.start()
+    return thread
+
+
+def last_report():
+    """Report of the most recent restore, or None."""
+    try:
+        return json.loads(REPORT_FILE.read_text())
+    except (OSError, ValueError):
+        return None
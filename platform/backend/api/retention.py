@@ -0,0 +1,102 @@
+"""
+Keystone Deployment Retention
+
+Per app, the last N deployments stay complete. Successful milestones stay
+complete as well: the last M successful deployments and any deployment
+that was rolled back to. Everything older is compacted into a summary row
+(status, timing, commit, images, error excerpt) and its log body is
+gzipped into LOGS_DIR/deployments/<app>/<id>.log.gz or dropped.
+
+Rows are processed in batches so the job can run against large tables
+without loading every log at once.
+"""
+import gzip
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import App, Deployment
+from .runtime import LOGS_DIR
+
+ARCHIVE_DIR = LOGS_DIR / "deployments"
+ERROR_EXCERPT_CHARS = 500
+
+
+def archive_path(deployment, slug):
+    return ARCHIVE_DIR / slug / f"{deployment.id}.log.gz"
+
+
+def read_logs(deployment):
+    """Full logs of a deployment, from the row or its archive."""
+    if deployment.log_archive:
+        try:
+            with gzip.open(deployment.log_archive, "rt") as f:
+                return f.read()
+        except OSError:
+            return ""
+    return deployment.logs
+
+
+def compaction_candidates(app, keep, milestones):
+    """IDs of an app's deployments that fall outside the retention policy."""
+    rows = list(
+        Deployment.objects.filter(app=app)
+        .exclude(status__in=["pending", "running"])
+        .order_by("-created_at")
+        .values_list("id", "status", "compacted")
+    )
+    rolled_back_to = set(
+        Deployment.objects.filter(app=app, rollback_of__isnull=False).values_list("rollback_of_id", flat=True)
+    )
+    successful = [pk for pk, status, _ in rows if status == "success"][:milestones]
+
+    protected = {pk for pk, _, _ in rows[:keep]} | set(successful) | rolled_back_to
+    return [pk for pk, _, compacted in rows if pk not in protected and not compacted]
+
+
+def compact_deployments(deployments, slug, archive=True):
+    """Compact a batch of deployments of one app. Returns the bytes of log text removed."""
+    freed = 0
+    for deployment in deployments:
+        freed += len(deployment.logs) + max(len(deployment.error) - ERROR_EXCERPT_CHARS, 0)
+        if archive and deployment.logs:
+            path = archive_path(deployment, slug)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with gzip.open(path, "wt") as f:
+                f.write(deployment.logs)
+            deployment.log_archive = str(path)
+        deployment.logs = ""
+        deployment.error = deployment.error[:ERROR_EXCERPT_CHARS]
+        deployment.compacted = True
+
+    with transaction.atomic():
+        Deployment.objects.bulk_update(deployments, ["logs", "error", "compacted", "log_archive"])
+    return freed
+
+
+def apply_retention(apps=None, keep=None, milestones=None, batch_size=200, archive=None, dry_run=False):
+    """
+    Compact deployments outside the retention policy.
+    Returns {"apps": {app name: compacted count}, "bytes_freed": int}.
+    """
+    keep = settings.KEYSTONE_DEPLOYMENT_RETENTION if keep is None else keep
+    milestones = settings.KEYSTONE_DEPLOYMENT_MILESTONES if milestones is None else milestones
+    archive = settings.KEYSTONE_DEPLOYMENT_LOG_ARCHIVE if archive is None else archive
+    apps = App.objects.all() if apps is None else apps
+
+    report = {"apps": {}, "bytes_freed": 0}
+    for app in apps:
+        ids = compaction_candidates(app, keep, milestones)
+        if not ids:
+            continue
+        report["apps"][app.name] = len(ids)
+        if dry_run:
+            continue
+
+        for start in range(0, len(ids), batch_size):
+            batch = list(
+                Deployment.objects.filter(id__in=ids[start:start + batch_size])
+                .only("id", "logs", "error", "compacted", "log_archive")
+            )
+            report["bytes_freed"] += compact_deployments(batch, app.slug, archive=archive)
+    return report
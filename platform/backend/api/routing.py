@@ -0,0 +1,174 @@
+"""
+Keystone Traefik Routing
+
+App routes live in the DB (Route rows, App.maintenance, App.traffic_split)
+and are rendered into a Traefik file-provider config. Containers carry no
+routing labels, so changing a prefix, adding a middleware, switching on a
+maintenance page or shifting traffic between apps never restarts anything.
+
+Sleeping (scaled to zero) apps are routed to Keystone's waker instead,
+which starts them on the first request.
+
+The config is written atomically (temp file + rename) into the directory
+Traefik watches, which picks the change up within a second.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+import yaml
+from django.conf import settings
+from django.db.models import Q
+
+from .models import App, Route
+from .runtime import container_name, project_name
+
+ROUTES_FILE = "keystone-routes.yml"
+
+# Keystone's backend, serving maintenance pages and the waker
+BACKEND_SERVICE = "keystone-backend"
+# Above the app routers and Keystone's own /api router (100)
+TAKEOVER_PRIORITY = 10000
+
+
+def write_config(filename, config):
+    """Atomically replace a dynamic config file in the Traefik directory."""
+    directory = Path(settings.KEYSTONE_TRAEFIK_DYNAMIC_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".yml")
+    try:
+        with os.fdopen(fd, "w") as f:
+            yaml.dump(config, f, default_flow_style=False, sort_keys=False)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, directory / filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def register_routes(app, detected):
+    """
+    Store the routes prepare detected: [{"service", "port", "path", "host"}].
+    Routes of services that are still there keep their (possibly edited)
+    prefix and middlewares and only get the new port/host; routes of
+    services that disappeared are dropped.
+    """
+    services = {entry["service"]: entry for entry in detected}
+    app.routes.exclude(service__in=list(services)).delete()
+
+    for service, entry in services.items():
+        port = int(entry["port"]) if entry.get("port") else None
+        updated = app.routes.filter(service=service).update(port=port, host=entry.get("host", ""))
+        if not updated:
+            Route.objects.create(
+                app=app, service=service, port=port, host=entry.get("host", ""), path_prefix=entry["path"]
+            )
+
+
+def route_url(app, route):
+    """Backend URL Traefik forwards a route to."""
+    if app.node and not app.node.is_local:
+        # Remote nodes publish the app container on a host port
+        return f"http://{app.node.address}:{app.host_port}"
+    if route.service:
+        host = route.host or f"{project_name(app)}-{route.service}-1"
+    else:
+        host = container_name(app)
+    return f"http://{host}:{route.port or app.container_port}"
+
+
+def service_name(app, route):
+    """Traefik service for a route's container (traffic splits point at these)."""
+    return f"{app.slug}-{route.service}" if route.service else app.slug
+
+
+def _prefix_rule(prefixes):
+    return " || ".join(f"PathPrefix(`{prefix}`)" for prefix in prefixes)
+
+
+def build_config():
+    """Traefik dynamic config for every routed app."""
+    routers, services, middlewares = {}, {}, {}
+
+    apps = list(
+        App.objects.filter(Q(maintenance=True) | (~Q(container_id="") & ~Q(status="stopped")))
+        .select_related("node")
+        .prefetch_related("routes")
+        .order_by("name")
+    )
+
+    # Service serving each app's main /<slug> route, targets for traffic splits
+    main_services = {}
+    for app in apps:
+        if app.maintenance or app.status == "sleeping":
+            continue
+        for route in app.routes.all():
+            name = service_name(app, route)
+            services[name] = {"loadBalancer": {"servers": [{"url": route_url(app, route)}]}}
+            if route.path_prefix == f"/{app.slug}":
+                main_services[app.name] = name
+
+    for app in apps:
+        # Maintenance page, or the waker (which keeps the original path) for sleeping apps
+        if app.maintenance or app.status == "sleeping":
+            prefixes = sorted({f"/{app.slug}"} | {route.path_prefix for route in app.routes.all()})
+            if app.maintenance:
+                name = f"{app.slug}-maintenance"
+                middlewares[name] = {"replacePath": {"path": f"/api/maintenance/{app.slug}/"}}
+            else:
+                name = f"{app.slug}-waker"
+                middlewares[name] = {"addPrefix": {"prefix": f"/api/wake/{app.slug}"}}
+            routers[name] = {
+                "rule": _prefix_rule(prefixes),
+                "entryPoints": ["web"],
+                "service": BACKEND_SERVICE,
+                "middlewares": [name],
+                "priority": TAKEOVER_PRIORITY,
+            }
+            services[BACKEND_SERVICE] = {
+                "loadBalancer": {"servers": [{"url": settings.KEYSTONE_BACKEND_URL}]}
+            }
+            continue
+
+        for route in app.routes.all():
+            name = f"{app.slug}-route-{route.pk}"
+            service = service_name(app, route)
+
+            if service == main_services.get(app.name) and app.traffic_split:
+                split = [
+                    {"name": main_services[other], "weight": int(weight)}
+                    for other, weight in sorted(app.traffic_split.items())
+                    if other in main_services and other != app.name and int(weight) > 0
+                ]
+                if split:
+                    own = max(100 - sum(entry["weight"] for entry in split), 0)
+                    services[f"{app.slug}-split"] = {
+                        "weighted": {"services": [{"name": service, "weight": own}] + split}
+                    }
+                    service = f"{app.slug}-split"
+
+            router = {
+                "rule": _prefix_rule([route.path_prefix]),
+                "entryPoints": ["web"],
+                "service": service,
+            }
+            route_middlewares = []
+            if route.strip_prefix:
+                middlewares[f"{name}-strip"] = {"stripPrefix": {"prefixes": [route.path_prefix]}}
+                route_middlewares.append(f"{name}-strip")
+            route_middlewares.extend(route.middlewares or [])
+            if route_middlewares:
+                router["middlewares"] = route_middlewares
+            routers[name] = router
+
+    http = {}
+    if routers:
+        http = {"routers": routers, "services": services}
+        if middlewares:
+            http["middlewares"] = middlewares
+    return {"http": http} if http else {}
+
+
+def sync_routes():
+    """Regenerate the Traefik routes file from the DB."""
+    write_config(ROUTES_FILE, build_config())
@@ -0,0 +1,185 @@
+"""
+Keystone runtime helpers
+
+Shared paths, Docker naming and the subprocess wrapper used by the API
+views, management commands and background jobs.
+
+Docker commands go to the local daemon unless wrapped in use_node(node),
+which points them at that node's DOCKER_HOST (tcp:// or ssh://).
+
+Commands run in their own process group, so a timeout or cancel_job()
+kills the whole tree (compose plugin, buildx, git helpers), not just the
+direct child.
+"""
+import os
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Directories for repos and logs
+REPOS_DIR = Path("/runtime/repos")
+LOGS_DIR = Path("/runtime/logs")
+REPOS_DIR.mkdir(parents=True, exist_ok=True)
+LOGS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Traefik network name
+TRAEFIK_NETWORK = "keystone_web"
+
+
+def container_name(app):
+    """Container name for single-Dockerfile apps."""
+    return f"keystone-app-{app.slug}"
+
+
+def project_name(app):
+    """Compose project name for multi-service apps."""
+    return f"keystone-{app.slug}"
+
+
+def deploy_mode(app):
+    """How an app runs: "image" (prebuilt App.image), or "compose"/"dockerfile" as detected by prepare."""
+    if app.image:
+        return "image"
+    return (app.env_vars or {}).get("_keystone_deploy_mode", "dockerfile")
+
+
+_local = threading.local()
+
+
+@contextmanager
+def use_node(node):
+    """Route docker commands run in this thread to `node` (None = local daemon)."""
+    previous = getattr(_local, "node", None)
+    _local.node = node
+    try:
+        yield node
+    finally:
+        _local.node = previous
+
+
+def current_node():
+    return getattr(_local, "node", None)
+
+
+def docker_env(node=None):
+    """Environment for a docker command targeting `node`, or None for the local daemon."""
+    node = node or current_node()
+    if node is None or not node.docker_host:
+        return None
+    return {**os.environ, "DOCKER_HOST": node.docker_host}
+
+
+# Cancellable jobs: job key -> running Popen, plus keys cancelled so far
+_jobs_lock = threading.Lock()
+_job_processes = {}
+_cancelled_jobs = set()
+
+
+@contextmanager
+def track_job(key):
+    """Register commands run in this thread under `key` so cancel_job(key) can kill them."""
+    previous = getattr(_local, "job", None)
+    _local.job = key
+    try:
+        yield key
+    finally:
+        _local.job = previous
+        with _jobs_lock:
+            _job_processes.pop(key, None)
+            _cancelled_jobs.discard(key)
+
+
+def cancel_job(key):
+    """
+    Cancel a job: kill its running command and make further run_cmd calls
+    in it fail. Returns True if a command was running in this process.
+    """
+    with _jobs_lock:
+        _cancelled_jobs.add(key)
+        process = _job_processes.get(key)
+    if process is None:
+        return False
+    _kill_process_group(process)
+    return True
+
+
+def is_cancelled(key):
+    with _jobs_lock:
+        return key in _cancelled_jobs
+
+
+def _kill_process_group(process, grace=5):
+    """SIGTERM the command's process group, SIGKILL whatever is left after `grace` seconds."""
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        try:
+            process.wait(timeout=grace)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+@contextmanager
+def record_commands():
+    """Collect {"cmd", "ms", "code"} for every run_cmd call made in this thread (request profiling)."""
+    previous = getattr(_local, "commands", None)
+    _local.commands = commands = []
+    try:
+        yield commands
+    finally:
+        _local.commands = previous
+
+
+def run_cmd(cmd, cwd=None, timeout=300):
+    """Run a shell command and return result."""
+    commands = getattr(_local, "commands", None)
+    if commands is None:
+        return _run_cmd(cmd, cwd, timeout)
+
+    started = time.perf_counter()
+    result = _run_cmd(cmd, cwd, timeout)
+    commands.append({"cmd": " ".join(cmd[:3]), "ms": round((time.perf_counter() - started) * 1000, 1), "code": result[0]})
+    return result
+
+
+def _run_cmd(cmd, cwd, timeout):
+    env = docker_env() if cmd and cmd[0] == "docker" else None
+    job = getattr(_local, "job", None)
+    if job is not None and is_cancelled(job):
+        return 1, "", "Cancelled"
+
+    try:
+        process = subprocess.Popen(
+            cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+            env=env, start_new_session=True
+        )
+    except Exception as e:
+        return 1, "", str(e)
+
+    if job is not None:
+        with _jobs_lock:
+            _job_processes[job] = process
+            # cancel_job() may have run between the check above and Popen
+            cancelled = job in _cancelled_jobs
+        if cancelled:
+            _kill_process_group(process)
+    try:
+        out, err = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process_group(process)
+        out, err = process.communicate()
+        return 1, out, f"{err}\nCommand timed out after {timeout}s: {' '.join(cmd[:3])}".lstrip()
+    finally:
+        if job is not None:
+            with _jobs_lock:
+                _job_processes.pop(job, None)
+
+    if job is not None and is_cancelled(job):
+        return 1, out, "Cancelled"
+    return process.returncode, out, err
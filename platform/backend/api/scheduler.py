@@ -0,0 +1,193 @@
+"""
+Keystone Placement Scheduler
+
+Assigns apps to Docker nodes. A node is eligible when it is enabled,
+reachable and has enough unreserved CPU/memory for the app. Among eligible
+nodes the least loaded one wins, where load is the larger of the reserved
+and the measured CPU/memory fractions after placing the app.
+
+Compose apps stay on the local node: Traefik reaches their services by
+container name on the keystone_web network.
+
+With no Node rows at all Keystone behaves as a single-host install and
+every app runs on the local daemon. Once a node is registered the local
+daemon gets a Node row too (if it has none yet), so it stays a candidate,
+and apps deployed before that keep running on it.
+"""
+import logging
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import App, Node
+from .runtime import deploy_mode, run_cmd, use_node
+
+logger = logging.getLogger(__name__)
+
+LOCAL_NODE_NAME = "local"
+
+
+class PlacementError(Exception):
+    """No node can take the app."""
+
+
+def _parse_memory_mb(value):
+    """Parse the used part of `docker stats` MemUsage ("12.5MiB / 1.9GiB")."""
+    units = {"B": 1 / 1024 ** 2, "KiB": 1 / 1024, "MiB": 1, "GiB": 1024, "TiB": 1024 ** 2}
+    used = value.split("/")[0].strip()
+    for unit, factor in sorted(units.items(), key=lambda item: -len(item[0])):
+        if used.endswith(unit):
+            try:
+                return float(used[:-len(unit)]) * factor
+            except ValueError:
+                return 0
+    return 0
+
+
+def refresh_node(node):
+    """
+    Update capacity (if unset) and current load of a node from its daemon.
+    Returns True when the node answered.
+    """
+    with use_node(node):
+        code, out, err = run_cmd(["docker", "info", "--format", "{{.NCPU}} {{.MemTotal}}"], timeout=30)
+        if code != 0:
+            node.last_error = err or out
+            node.save(update_fields=["last_error"])
+            return False
+
+        try:
+            ncpu, mem_total = (out.split() + ["0", "0"])[:2]
+            ncpu, mem_total = float(ncpu), int(mem_total)
+        except ValueError:
+            node.last_error = f"Unexpected docker info output: {out.strip()}"
+            node.save(update_fields=["last_error"])
+            return False
+        if not node.cpu_capacity:
+            node.cpu_capacity = ncpu
+        if not node.memory_capacity_mb:
+            node.memory_capacity_mb = int(mem_total / 1024 ** 2)
+
+        code, out, err = run_cmd(
+            ["docker", "stats", "--no-stream", "--format", "{{.CPUPerc}}|{{.MemUsage}}"], timeout=60
+        )
+        cpu, memory = 0.0, 0.0
+        for line in out.splitlines():
+            cpu_perc, _, mem_usage = line.partition("|")
+            try:
+                cpu += float(cpu_perc.rstrip("%")) / 100
+            except ValueError:
+                pass
+            memory += _parse_memory_mb(mem_usage)
+
+    node.cpu_load = round(cpu, 2)
+    node.memory_used_mb = int(memory)
+    node.last_seen = timezone.now()
+    node.last_error = ""
+    node.save()
+    return True
+
+
+def node_reservations(node, exclude=None):
+    """Total (cpu, memory_mb) reserved by apps placed on a node."""
+    qs = App.objects.filter(node=node)
+    if exclude is not None:
+        qs = qs.exclude(pk=exclude.pk)
+    totals = qs.aggregate(cpu=Sum("cpu_reservation"), memory=Sum("memory_reservation_mb"))
+    return totals["cpu"] or 0, totals["memory"] or 0
+
+
+def score_node(node, app):
+    """
+    Load score of a node after placing `app` (lower is better), or None
+    if the app doesn't fit in the unreserved capacity.
+    """
+    if not node.cpu_capacity or not node.memory_capacity_mb:
+        return None
+
+    reserved_cpu, reserved_memory = node_reservations(node, exclude=app)
+    cpu = reserved_cpu + app.cpu_reservation
+    memory = reserved_memory + app.memory_reservation_mb
+    if cpu > node.cpu_capacity or memory > node.memory_capacity_mb:
+        return None
+
+    cpu_fraction = max(cpu, node.cpu_load + app.cpu_reservation) / node.cpu_capacity
+    memory_fraction = max(memory, node.memory_used_mb + app.memory_reservation_mb) / node.memory_capacity_mb
+    return max(cpu_fraction, memory_fraction)
+
+
+def same_daemon(a, b):
+    """Whether two nodes (None = local daemon) are the same Docker daemon."""
+    if a is not None and b is not None and a.pk == b.pk:
+        return True
+    return (a is None or a.is_local) and (b is None or b.is_local)
+
+
+def local_node():
+    """The local daemon's Node row, created if only remote nodes are registered."""
+    node = next((node for node in Node.objects.all() if node.is_local), None)
+    if node is None:
+        node = Node.objects.create(name=LOCAL_NODE_NAME)
+        logger.info("Registered the local daemon as node %s", node.name)
+    return node
+
+
+def place_app(app):
+    """
+    Make sure an app is assigned to a usable node and return it.
+    Keeps the current node while it stays enabled (apps deployed without a
+    node run on the local one); returns None on single-host installs.
+    Raises PlacementError when nothing fits.
+    """
+    if not Node.objects.exists():
+        return None
+    local = local_node()
+    nodes = list(Node.objects.filter(enabled=True))
+    if deploy_mode(app) == "compose":
+        nodes = [node for node in nodes if node.is_local]
+
+    current = app.node_id
+    if current is None and app.deployments.filter(status="success").exists():
+        current = local.pk
+    if current and any(node.pk == current for node in nodes):
+        if app.node_id != current:
+            app.node = local
+            app.host_port = None
+            # Only the placement: the caller's copy of the app may be stale otherwise
+            app.save(update_fields=["node", "host_port", "updated_at"])
+        return app.node
+
+    scored = []
+    for node in nodes:
+        if not refresh_node(node):
+            logger.warning("Node %s unreachable: %s", node.name, node.last_error)
+            continue
+        score = score_node(node, app)
+        if score is not None:
+            scored.append((score, node.name, node))
+
+    if not scored:
+        raise PlacementError(
+            f"No reachable node has {app.cpu_reservation} CPU / {app.memory_reservation_mb}MB free for {app.name}"
+        )
+
+    node = min(scored)[2]
+    app.node = node
+    app.host_port = None if node.is_local else allocate_host_port(node, app)
+    app.save(update_fields=["node", "host_port", "updated_at"])
+    return node
+
+
+def allocate_host_port(node, app):
+    """Pick a free published port on a remote node from KEYSTONE_PORT_RANGE."""
+    start, end = settings.KEYSTONE_PORT_RANGE
+    used = set(
+        App.objects.filter(node=node, host_port__isnull=False)
+        .exclude(pk=app.pk)
+        .values_list("host_port", flat=True)
+    )
+    for port in range(start, end + 1):
+        if port not in used:
+            return port
+    raise PlacementError(f"No free port left on node {node.name}")
@@ -0,0 +1,148 @@
+"""
+Keystone Deployment Log Search
+
+Full-text search over Deployment.logs and Deployment.error, backed by the
+database in use:
+- PostgreSQL: GIN index on a tsvector expression, websearch_to_tsquery, ts_headline
+- SQLite: FTS5 external-content table kept in sync by triggers, bm25, snippet()
+- Anything else: case-insensitive substring match
+
+The index is (re)created after every migrate, see ApiConfig.ready().
+"""
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, TextField, Value
+from django.db.models.expressions import RawSQL
+
+SNIPPET_START = "<mark>"
+SNIPPET_STOP = "</mark>"
+
+# PostgreSQL: tsvector values are limited to 1MB, so index the tail of the
+# build log (where failures end up) plus the error text.
+PG_DOCUMENT = (
+    "right(coalesce(api_deployment.logs, ''), 250000) || ' ' || "
+    "left(coalesce(api_deployment.error, ''), 50000)"
+)
+PG_VECTOR = f"to_tsvector('english', {PG_DOCUMENT})"
+PG_QUERY = "websearch_to_tsquery('english', %s)"
+
+PG_INDEX = f"""
+CREATE INDEX IF NOT EXISTS api_deployment_search_idx
+ON api_deployment USING GIN (({PG_VECTOR.replace("api_deployment.", "")}))
+"""
+
+SQLITE_FTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS api_deployment_fts
+    USING fts5(logs, error, content='api_deployment', content_rowid='id')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS api_deployment_fts_ai AFTER INSERT ON api_deployment BEGIN
+        INSERT INTO api_deployment_fts(rowid, logs, error) VALUES (new.id, new.logs, new.error);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS api_deployment_fts_ad AFTER DELETE ON api_deployment BEGIN
+        INSERT INTO api_deployment_fts(api_deployment_fts, rowid, logs, error)
+        VALUES ('delete', old.id, old.logs, old.error);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS api_deployment_fts_au AFTER UPDATE OF logs, error ON api_deployment BEGIN
+        INSERT INTO api_deployment_fts(api_deployment_fts, rowid, logs, error)
+        VALUES ('delete', old.id, old.logs, old.error);
+        INSERT INTO api_deployment_fts(rowid, logs, error) VALUES (new.id, new.logs, new.error);
+    END
+    """,
+]
+
+
+def install_search_index(using=connection):
+    """
+    Create the backend specific search index if it is missing.
+    On SQLite, table rebuilds during migrations drop the sync triggers, so
+    the FTS table is rebuilt from scratch whenever they had to be recreated.
+    """
+    with using.cursor() as cursor:
+        if using.vendor == "postgresql":
+            cursor.execute(PG_INDEX)
+        elif using.vendor == "sqlite":
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'api_deployment_fts_%'"
+            )
+            in_sync = cursor.fetchone()[0] == 3
+            for statement in SQLITE_FTS:
+                cursor.execute(statement)
+            if not in_sync:
+                cursor.execute("INSERT INTO api_deployment_fts(api_deployment_fts) VALUES ('rebuild')")
+
+
+def _fts5_query(query):
+    """Quote every term so user input can't break FTS5 query syntax."""
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+
+
+def _excerpt(text, query, width=120):
+    """Plain substring excerpt with the first match highlighted."""
+    index = text.lower().find(query.lower())
+    if index < 0:
+        return ""
+    start = max(index - width // 2, 0)
+    end = index + len(query) + width // 2
+    return "{}{}{}{}{}{}{}".format(
+        "…" if start else "",
+        text[start:index],
+        SNIPPET_START,
+        text[index:index + len(query)],
+        SNIPPET_STOP,
+        text[index + len(query):end],
+        "…" if end < len(text) else "",
+    )
+
+
+def search_deployments(queryset, query):
+    """
+    Filter a Deployment queryset to rows whose logs or error match `query`.
+    Returns a queryset annotated with `rank` (higher is better) and
+    `snippet` (highlighted excerpt), ordered by rank.
+    """
+    vendor = connection.vendor
+
+    if vendor == "postgresql":
+        return queryset.filter(
+            RawSQL(f"{PG_VECTOR} @@ {PG_QUERY}", [query], output_field=BooleanField())
+        ).annotate(
+            rank=RawSQL(f"ts_rank({PG_VECTOR}, {PG_QUERY})", [query], output_field=FloatField()),
+            snippet=RawSQL(
+                f"ts_headline('english', {PG_DOCUMENT}, {PG_QUERY}, %s)",
+                [query, f"StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, MaxFragments=3"],
+                output_field=TextField(),
+            ),
+        ).order_by("-rank", "-created_at")
+
+    if vendor == "sqlite":
+        match = _fts5_query(query)
+        fts = "FROM api_deployment_fts WHERE api_deployment_fts MATCH %s AND rowid = api_deployment.id"
+        return queryset.filter(
+            id__in=RawSQL("SELECT rowid FROM api_deployment_fts WHERE api_deployment_fts MATCH %s", [match])
+        ).annotate(
+            rank=RawSQL(f"(SELECT -bm25(api_deployment_fts) {fts})", [match], output_field=FloatField()),
+            snippet=RawSQL(
+                f"(SELECT snippet(api_deployment_fts, -1, %s, %s, '…', 24) {fts})",
+                [SNIPPET_START, SNIPPET_STOP, match],
+                output_field=TextField(),
+            ),
+        ).order_by("-rank", "-created_at")
+
+    return queryset.filter(
+        Q(logs__icontains=query) | Q(error__icontains=query)
+    ).annotate(
+        rank=Value(0.0, output_field=FloatField()),
+        snippet=Value("", output_field=TextField()),
+    ).order_by("-created_at")
+
+
+def snippet_for(deployment, query):
+    """Highlighted excerpt for a search hit, with a plain fallback."""
+    if getattr(deployment, "snippet", ""):
+        return deployment.snippet
+    return _excerpt(deployment.error, query) or _excerpt(deployment.logs, query)
@@ -1,5 +1,9 @@
+from urllib.parse import urlparse
+
 from rest_framework import serializers
-from .models import App, Deployment
+from .deployer import PHASE_TIMEOUTS
+from .models import App, Deployment, Node, Route
+from .search import snippet_for
 
 
 class AppSerializer(serializers.ModelSerializer):
@@ -8,11 +12,119 @@ class AppSerializer(serializers.ModelSerializer):
     class Meta:
         model = App
         fields = "__all__"
+        read_only_fields = ["last_request_at"]
+    
+    def validate(self, attrs):
+        git_url = attrs.get("git_url", self.instance.git_url if self.instance else "")
+        image = attrs.get("image", self.instance.image if self.instance else "")
+        if not git_url and not image:
+            raise serializers.ValidationError("Either git_url or image is required")
+        return attrs
+    
+    def validate_service_images(self, value):
+        if not isinstance(value, dict) or not all(
+            isinstance(service, str) and isinstance(image, str) and image for service, image in value.items()
+        ):
+            raise serializers.ValidationError("Expected {service: image}")
+        return value
+    
+    def validate_timeouts(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected {phase: seconds}")
+        for phase, seconds in value.items():
+            if phase not in PHASE_TIMEOUTS:
+                raise serializers.ValidationError(f"Unknown phase {phase}. Phases: {', '.join(PHASE_TIMEOUTS)}")
+            if not isinstance(seconds, int) or seconds <= 0:
+                raise serializers.ValidationError(f"Timeout for {phase} must be a positive number of seconds")
+        return value
+    
+    def validate_traffic_split(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected {app name: weight}")
+        for name, weight in value.items():
+            if not isinstance(weight, int) or not 0 <= weight <= 100:
+                raise serializers.ValidationError(f"Weight for {name} must be an integer from 0 to 100")
+            if self.instance and name == self.instance.name:
+                raise serializers.ValidationError("An app can't split traffic to itself")
+        unknown = set(value) - set(App.objects.filter(name__in=value).values_list("name", flat=True))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown apps: {', '.join(sorted(unknown))}")
+        if sum(value.values()) > 100:
+            raise serializers.ValidationError("Weights add up to more than 100")
+        return value
+
+
+class RouteSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Route
+        fields = "__all__"
+    
+    def validate_path_prefix(self, value):
+        if not value.startswith("/") or "`" in value:
+            raise serializers.ValidationError("Expected a path starting with /")
+        value = value.rstrip("/") or "/"
+        taken = Route.objects.filter(path_prefix=value)
+        if self.instance:
+            taken = taken.exclude(pk=self.instance.pk)
+        if taken.exists():
+            raise serializers.ValidationError(f"{value} is already routed")
+        return value
+    
+    def validate_middlewares(self, value):
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise serializers.ValidationError("Expected a list of middleware names")
+        return value
+
+
+class NodeSerializer(serializers.ModelSerializer):
+    is_local = serializers.ReadOnlyField()
+    app_count = serializers.IntegerField(source="apps.count", read_only=True)
+    
+    class Meta:
+        model = Node
+        fields = "__all__"
+        read_only_fields = ["cpu_load", "memory_used_mb", "last_seen", "last_error"]
+    
+    def validate(self, attrs):
+        docker_host = attrs.get("docker_host", self.instance.docker_host if self.instance else "")
+        address = attrs.get("address", self.instance.address if self.instance else "")
+        if Node(docker_host=docker_host).is_local or address:
+            return attrs
+        # Traefik reaches remote apps at address:host_port; default to the daemon's host
+        host = urlparse(docker_host).hostname
+        if not host:
+            raise serializers.ValidationError({"address": "Required for remote nodes"})
+        attrs["address"] = host
+        return attrs
 
 
 class DeploymentSerializer(serializers.ModelSerializer):
     app_name = serializers.CharField(source="app.name", read_only=True)
+    duration = serializers.ReadOnlyField()
     
     class Meta:
         model = Deployment
         fields = "__all__"
+
+
+class DeploymentStateSerializer(serializers.ModelSerializer):
+    """Deployment without its logs, as pushed by the event stream."""
+    duration = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = Deployment
+        fields = ["id", "app", "status", "error", "commit", "phases", "rollback_of", "created_at", "finished_at", "duration"]
+
+
+class DeploymentSearchSerializer(serializers.ModelSerializer):
+    """Search hit: deployment summary plus highlighted log excerpt."""
+    app_name = serializers.CharField(source="app.name", read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Deployment
+        fields = ["id", "app", "app_name", "status", "error", "created_at", "finished_at", "rank", "snippet"]
+    
+    def get_snippet(self, obj):
+        return snippet_for(obj, self.context["query"])
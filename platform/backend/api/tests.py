@@ -0,0 +1,689 @@
+import fcntl
+import json
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from .buildcontext import (
+    BLOCK_START,
+    DOCKERIGNORE,
+    _excluded,
+    compile_pattern,
+    measure_context,
+    parse_context_transfer,
+    read_rules,
+    write_dockerignore,
+)
+from .coalesce import CoalescingCache
+from .deployer import (
+    DeploymentCancelled,
+    _record_success,
+    cancel_deployment,
+    deploy_app,
+    deployable,
+    run_app_container,
+)
+from .fleet import apply_sync, describe_plan, parse_manifest, plan_sync, run_actions
+from .idle import read_activity, record_activity
+from .models import App, Deployment, Node, Route
+from .profiling import PROFILE_HEADER, ProfilingMiddleware, get_profile, profile_token
+from .restore import RestoreInProgress, restore_fleet, restore_in_progress
+from .retention import compact_deployments
+from .runtime import cancel_job, current_node, run_cmd, track_job
+from .scheduler import PlacementError, place_app, refresh_node, same_daemon, score_node
+from .search import SNIPPET_START, SNIPPET_STOP, install_search_index, search_deployments, snippet_for
+from .serializers import NodeSerializer
+
+GB = 1024 ** 3
+
+
+class FakeDaemon:
+    """
+    Stands in for run_cmd: answers `docker info` per node and records every
+    command with the node it was sent to (None = local daemon).
+    """
+
+    def __init__(self, info=None):
+        self.info = info or {}
+        self.commands = []
+
+    def __call__(self, cmd, cwd=None, timeout=300):
+        node = current_node()
+        self.commands.append((node.name if node else None, cmd))
+        if cmd[:2] == ["docker", "info"]:
+            host = node.docker_host if node else ""
+            if host not in self.info:
+                return 1, "", "Cannot connect to the Docker daemon"
+            return 0, self.info[host], ""
+        return 0, "", ""
+
+    def sent(self, prefix):
+        return [node for node, cmd in self.commands if cmd[:len(prefix)] == prefix]
+
+
+class ScoreNodeTests(TestCase):
+    def setUp(self):
+        self.node = Node.objects.create(name="a", docker_host="tcp://a:2375", cpu_capacity=4, memory_capacity_mb=4096)
+        self.app = App.objects.create(name="web", cpu_reservation=1, memory_reservation_mb=1024)
+
+    def test_score_is_the_larger_reserved_fraction(self):
+        self.assertEqual(score_node(self.node, self.app), 0.25)
+        App.objects.create(name="db", node=self.node, cpu_reservation=0.5, memory_reservation_mb=2048)
+        self.assertEqual(score_node(self.node, self.app), 0.75)
+
+    def test_measured_load_counts_when_higher_than_reservations(self):
+        self.node.cpu_load = 2
+        self.assertEqual(score_node(self.node, self.app), 0.75)
+
+    def test_app_that_does_not_fit_is_rejected(self):
+        App.objects.create(name="db", node=self.node, cpu_reservation=3.5, memory_reservation_mb=512)
+        self.assertIsNone(score_node(self.node, self.app))
+
+    def test_own_reservation_is_not_counted_twice(self):
+        self.app.node = self.node
+        self.app.save()
+        self.assertEqual(score_node(self.node, self.app), 0.25)
+
+    def test_unknown_capacity_is_rejected(self):
+        self.node.cpu_capacity = 0
+        self.assertIsNone(score_node(self.node, self.app))
+
+
+class RefreshNodeTests(TestCase):
+    def test_unexpected_info_output_marks_node_unreachable(self):
+        node = Node.objects.create(name="a", docker_host="tcp://a:2375")
+        with mock.patch("api.scheduler.run_cmd", FakeDaemon({"tcp://a:2375": "<no value> <no value>"})):
+            self.assertFalse(refresh_node(node))
+        self.assertIn("Unexpected docker info output", node.last_error)
+
+
+class PlaceAppTests(TestCase):
+    def setUp(self):
+        self.daemon = FakeDaemon({"": f"2 {2 * GB}", "tcp://big:2375": f"16 {32 * GB}"})
+        patcher = mock.patch("api.scheduler.run_cmd", self.daemon)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_single_host_install_uses_the_local_daemon(self):
+        app = App.objects.create(name="web")
+        self.assertIsNone(place_app(app))
+        self.assertFalse(Node.objects.exists())
+
+    def test_registering_a_remote_node_keeps_the_local_daemon(self):
+        Node.objects.create(name="big", docker_host="tcp://big:2375")
+        app = App.objects.create(name="web", env_vars={"_keystone_deploy_mode": "compose"})
+
+        node = place_app(app)
+
+        self.assertTrue(node.is_local)
+        self.assertEqual(Node.objects.count(), 2)
+        self.assertIsNone(app.host_port)
+
+    def test_new_app_goes_to_the_least_loaded_node(self):
+        Node.objects.create(name="big", docker_host="tcp://big:2375")
+        app = App.objects.create(name="web")
+
+        node = place_app(app)
+
+        self.assertEqual(node.name, "big")
+        self.assertEqual(app.host_port, settings.KEYSTONE_PORT_RANGE[0])
+
+    def test_app_deployed_before_nodes_existed_stays_local(self):
+        app = App.objects.create(name="web", status="running")
+        Deployment.objects.create(app=app, status="success")
+        Node.objects.create(name="big", docker_host="tcp://big:2375")
+
+        node = place_app(app)
+
+        self.assertTrue(node.is_local)
+        self.assertEqual(app.node, node)
+        self.assertEqual(self.daemon.sent(["docker", "info"]), [])
+
+    def test_app_leaves_a_disabled_node(self):
+        small = Node.objects.create(name="small", docker_host="tcp://small:2375", enabled=False)
+        Node.objects.create(name="big", docker_host="tcp://big:2375")
+        app = App.objects.create(name="web", node=small, host_port=20000)
+
+        self.assertEqual(place_app(app).name, "big")
+
+    def test_nothing_fits(self):
+        Node.objects.create(name="big", docker_host="tcp://big:2375")
+        app = App.objects.create(name="web", cpu_reservation=64)
+
+        with self.assertRaises(PlacementError):
+            place_app(app)
+
+    def test_unreachable_nodes_are_skipped(self):
+        Node.objects.create(name="gone", docker_host="tcp://gone:2375")
+        app = App.objects.create(name="web")
+
+        self.assertTrue(place_app(app).is_local)
+
+
+class MoveTests(TestCase):
+    def setUp(self):
+        self.daemon = FakeDaemon({"": f"2 {2 * GB}", "tcp://big:2375": f"16 {32 * GB}"})
+        for target in ["api.scheduler.run_cmd", "api.deployer.run_cmd"]:
+            patcher = mock.patch(target, self.daemon)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for target in ["api.deployer._deploy_image", "api.deployer.sync_routes"]:
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_same_daemon(self):
+        local = Node.objects.create(name="local")
+        remote = Node.objects.create(name="big", docker_host="tcp://big:2375")
+        self.assertTrue(same_daemon(None, local))
+        self.assertTrue(same_daemon(remote, remote))
+        self.assertFalse(same_daemon(None, remote))
+        self.assertFalse(same_daemon(remote, local))
+
+    def test_moving_off_the_local_daemon_stops_the_local_container(self):
+        app = App.objects.create(name="web", image="nginx:1.27")
+        remote = Node.objects.create(name="big", docker_host="tcp://big:2375")
+        Node.objects.create(name="local", enabled=False)
+
+        deploy_app(app)
+
+        self.assertEqual(app.node, remote)
+        self.assertEqual(self.daemon.sent(["docker", "stop"]), [None])
+
+    def test_staying_on_the_node_stops_nothing(self):
+        remote = Node.objects.create(name="big", docker_host="tcp://big:2375")
+        app = App.objects.create(name="web", image="nginx:1.27", node=remote, host_port=20000)
+
+        deploy_app(app)
+
+        self.assertEqual(self.daemon.sent(["docker", "stop"]), [])
+
+    def test_remote_containers_publish_a_port_instead_of_joining_the_network(self):
+        remote = Node.objects.create(name="big", docker_host="tcp://big:2375")
+        app = App.objects.create(name="web", node=remote, host_port=20001, container_port=3000)
+
+        run_app_container(app, "nginx:1.27", [])
+
+        run = next(cmd for node, cmd in self.daemon.commands if cmd[:2] == ["docker", "run"])
+        self.assertIn("20001:3000", run)
+        self.assertNotIn("--network", run)
+
+
+class FinishDeploymentTests(TestCase):
+    def setUp(self):
+        self.app = App.objects.create(name="web", status="deploying")
+        self.deployment = Deployment.objects.create(app=self.app, status="running")
+
+    def test_success_is_recorded(self):
+        _record_success(self.app, self.deployment, ["done"])
+
+        self.deployment.refresh_from_db()
+        self.assertEqual(self.deployment.status, "success")
+        self.assertEqual(self.deployment.logs, "done")
+        self.assertEqual(self.app.status, "running")
+
+    def test_late_cancel_is_not_overwritten(self):
+        Deployment.objects.filter(pk=self.deployment.pk).update(status="cancelled")
+        App.objects.filter(pk=self.app.pk).update(status="stopped")
+
+        with self.assertRaises(DeploymentCancelled):
+            _record_success(self.app, self.deployment, ["done"])
+
+        self.deployment.refresh_from_db()
+        self.app.refresh_from_db()
+        self.assertEqual(self.deployment.status, "cancelled")
+        self.assertEqual(self.app.status, "stopped")
+
+
+class CancelDuringDeployTests(TestCase):
+    """A cancel landing outside a deploy phase, e.g. while the app is being placed."""
+
+    def setUp(self):
+        self.daemon = FakeDaemon({"": f"2 {2 * GB}"})
+        for target in ["api.scheduler.run_cmd", "api.deployer.run_cmd"]:
+            patcher = mock.patch(target, self.daemon)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("api.deployer.sync_routes")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Node.objects.create(name="local")
+        self.app = App.objects.create(name="web", image="nginx:1.27", status="stopped")
+
+    def cancel_then(self, place):
+        def side_effect(app):
+            cancel_deployment(Deployment.objects.get(app=app, status="running"))
+            return place(app)
+        return mock.patch("api.deployer.place_app", side_effect=side_effect)
+
+    def test_error_caused_by_the_cancel_is_not_recorded_as_a_failure(self):
+        def unreachable(app):
+            raise PlacementError("No reachable node")
+
+        with self.cancel_then(unreachable), self.assertRaises(PlacementError):
+            deploy_app(self.app)
+
+        deployment = Deployment.objects.get(app=self.app)
+        self.app.refresh_from_db()
+        self.assertEqual(deployment.status, "cancelled")
+        self.assertEqual(self.app.status, "stopped")
+        self.assertIn("Deployment cancelled", deployment.logs)
+
+    def test_placement_does_not_undo_the_released_app(self):
+        with self.cancel_then(place_app), self.assertRaises(DeploymentCancelled):
+            deploy_app(self.app)
+
+        self.app.refresh_from_db()
+        self.assertEqual(Deployment.objects.get(app=self.app).status, "cancelled")
+        self.assertEqual(self.app.status, "stopped")
+        self.assertTrue(deployable(self.app))
+        self.assertEqual(self.app.node.name, "local")
+
+    def test_real_failure_is_recorded(self):
+        def unreachable(app):
+            raise PlacementError("No reachable node")
+
+        with mock.patch("api.deployer.place_app", side_effect=unreachable), self.assertRaises(PlacementError):
+            deploy_app(self.app)
+
+        self.app.refresh_from_db()
+        self.assertEqual(Deployment.objects.get(app=self.app).status, "failed")
+        self.assertEqual(self.app.status, "failed")
+
+
+class CancelJobTests(TestCase):
+    def test_cancel_between_check_and_start_kills_the_command(self):
+        popen = subprocess.Popen
+
+        def cancel_then_start(*args, **kwargs):
+            cancel_job("race")
+            return popen(*args, **kwargs)
+
+        started = time.monotonic()
+        with track_job("race"), mock.patch("api.runtime.subprocess.Popen", side_effect=cancel_then_start):
+            code, out, err = run_cmd(["sleep", "30"])
+
+        self.assertEqual((code, err), (1, "Cancelled"))
+        self.assertLess(time.monotonic() - started, 10)
+
+
+class CoalescingCacheTests(TestCase):
+    def test_waiters_give_up_on_a_hung_call(self):
+        cache = CoalescingCache("test", 5, wait_timeout=0.05)
+        release = threading.Event()
+        leader = threading.Thread(target=cache.get, args=(("app",), release.wait))
+        leader.start()
+        while not cache.stats()["in_flight"]:
+            time.sleep(0.001)
+
+        with self.assertRaisesMessage(Exception, "Timed out"):
+            cache.get(("app",), lambda: "unused")
+
+        release.set()
+        leader.join()
+        self.assertEqual(cache.stats()["timeouts"], 1)
+        self.assertIs(cache.get(("app",), lambda: "unused"), True)
+
+
+class ActivityTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.log = Path(tmp.name) / "access.log"
+        patcher = mock.patch("api.idle.OFFSET_FILE", Path(tmp.name) / "offset")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, *entries):
+        with open(self.log, "a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+    def test_traffic_split_target_gets_the_request(self):
+        self.write(
+            {"RouterName": "shop-route-1@file", "ServiceName": "shop@file", "StartUTC": "2026-10-01T10:00:00Z"},
+            {"RouterName": "shop-route-1@file", "ServiceName": "shop-beta-web@file", "StartUTC": "2026-10-01T10:05:00Z"},
+        )
+
+        latest = read_activity(self.log, services={"shop": "shop", "shop-beta-web": "shop-beta"})
+
+        self.assertEqual(latest["shop"].isoformat(), "2026-10-01T10:05:00+00:00")
+        self.assertEqual(latest["shop-beta"].isoformat(), "2026-10-01T10:05:00+00:00")
+
+    def test_record_activity_maps_services_from_routes(self):
+        app = App.objects.create(name="shop-beta", status="running")
+        Route.objects.create(app=app, path_prefix="/shop-beta", service="web")
+        self.write({"RouterName": "shop-route-1@file", "ServiceName": "shop-beta-web@file", "StartUTC": "2026-10-01T10:05:00Z"})
+
+        record_activity(self.log)
+
+        app.refresh_from_db()
+        self.assertEqual(app.last_request_at.isoformat(), "2026-10-01T10:05:00+00:00")
+
+
+class RestoreLockTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.lock_file = Path(tmp.name) / "restore.lock"
+        patcher = mock.patch("api.restore.LOCK_FILE", self.lock_file)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_restore_held_by_another_process_blocks_a_second_one(self):
+        self.assertFalse(restore_in_progress())
+        # A separate open file description, as the startup restore_fleet process would hold
+        with open(self.lock_file, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.assertTrue(restore_in_progress())
+            with self.assertRaises(RestoreInProgress):
+                restore_fleet()
+        self.assertFalse(restore_in_progress())
+
+
+class NodeSerializerTests(TestCase):
+    def test_remote_node_address_defaults_to_the_docker_host(self):
+        serializer = NodeSerializer(data={"name": "big", "docker_host": "ssh://deploy@10.0.0.2"})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data["address"], "10.0.0.2")
+
+    def test_remote_node_needs_an_address(self):
+        serializer = NodeSerializer(data={"name": "big", "docker_host": "tcp://"})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("address", serializer.errors)
+
+    def test_local_node_needs_no_address(self):
+        serializer = NodeSerializer(data={"name": "local", "docker_host": ""})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data.get("address", ""), "")
+
+
+class FleetSyncTests(TestCase):
+    def setUp(self):
+        self.billing = App.objects.create(
+            name="billing", git_url="https://github.com/org/billing", status="running",
+            env_vars={"WORKERS": 4, "_keystone_deploy_mode": "dockerfile"},
+        )
+        self.reports = App.objects.create(name="reports", image="ghcr.io/org/reports:2.0", status="running")
+        App.objects.create(name="legacy", git_url="https://github.com/org/legacy")
+
+    def plan(self, manifest):
+        return plan_sync(parse_manifest(manifest))
+
+    def manifest(self, billing="", reports="ghcr.io/org/reports:2.0", extra=""):
+        return f"""
+apps:
+  - name: billing
+    git_url: https://github.com/org/billing
+    env_vars:
+      WORKERS: 4
+{billing}
+  - name: reports
+    image: {reports}
+{extra}
+"""
+
+    def test_unchanged_apps_are_left_alone(self):
+        plan = self.plan(self.manifest())
+
+        self.assertEqual(describe_plan(plan), {
+            "create": [], "update": {}, "unchanged": ["billing", "reports"], "unmanaged": ["legacy"],
+        })
+        self.assertEqual(apply_sync(plan), [])
+
+    def test_new_apps_are_created_and_prepared_or_deployed(self):
+        plan = self.plan(self.manifest(extra="""
+  - name: shop
+    git_url: https://github.com/org/shop
+    env_vars:
+      DEBUG: false
+  - name: docs
+    image: ghcr.io/org/docs:1.0
+"""))
+
+        self.assertEqual(describe_plan(plan)["create"], ["shop", "docs"])
+        self.assertEqual(apply_sync(plan), [("shop", "prepare"), ("docs", "deploy")])
+        self.assertEqual(App.objects.get(name="shop").env_vars, {"DEBUG": "False"})
+
+    def test_image_change_deploys(self):
+        plan = self.plan(self.manifest(reports="ghcr.io/org/reports:2.1"))
+
+        self.assertEqual(describe_plan(plan)["update"], {"reports": ["image"]})
+        self.assertEqual(apply_sync(plan), [("reports", "deploy")])
+        self.reports.refresh_from_db()
+        self.assertEqual(self.reports.image, "ghcr.io/org/reports:2.1")
+
+    def test_source_change_prepares(self):
+        plan = self.plan(self.manifest(billing="    branch: release"))
+
+        self.assertEqual(describe_plan(plan)["update"], {"billing": ["branch"]})
+        self.assertEqual(apply_sync(plan), [("billing", "prepare")])
+
+    def test_env_only_change_redeploys_running_apps_and_keeps_internal_keys(self):
+        plan = self.plan(self.manifest().replace("WORKERS: 4", "WORKERS: 8"))
+
+        self.assertEqual(describe_plan(plan)["update"], {"billing": ["env_vars"]})
+        self.assertEqual(apply_sync(plan), [("billing", "deploy")])
+        self.billing.refresh_from_db()
+        self.assertEqual(self.billing.env_vars, {"_keystone_deploy_mode": "dockerfile", "WORKERS": "8"})
+
+    def test_env_change_of_stopped_app_needs_no_action(self):
+        App.objects.filter(pk=self.billing.pk).update(status="stopped")
+        plan = self.plan(self.manifest().replace("WORKERS: 4", "WORKERS: 8"))
+
+        self.assertEqual(apply_sync(plan), [])
+
+    def test_nested_env_values_are_rejected(self):
+        with self.assertRaises(ValidationError):
+            parse_manifest({"apps": [{"name": "x", "image": "nginx", "env_vars": {"A": {"b": 1}}}]})
+
+    def test_run_actions(self):
+        App.objects.filter(pk=self.reports.pk).update(status="deploying")
+        with mock.patch("api.fleet.prepare_app") as prepare, mock.patch("api.fleet.deploy_app") as deploy:
+            results = run_actions([("billing", "prepare"), ("reports", "deploy")])
+
+        self.assertEqual(results, {"billing": "ok", "reports": "App is busy (deploying)"})
+        prepare.assert_called_once()
+        deploy.assert_called_once()
+
+    def test_run_actions_without_deploy_only_prepares(self):
+        with mock.patch("api.fleet.prepare_app") as prepare, mock.patch("api.fleet.deploy_app") as deploy:
+            run_actions([("billing", "prepare")], deploy=False)
+
+        prepare.assert_called_once()
+        deploy.assert_not_called()
+
+
+class SearchTests(TestCase):
+    """Against the SQLite test database: FTS5 index, triggers and query quoting."""
+
+    def setUp(self):
+        app = App.objects.create(name="web")
+        self.failed = Deployment.objects.create(
+            app=app, status="failed", logs="Step 4/9: RUN pip install\nERROR: psycopg2 wheel build failed",
+            error="Docker build failed",
+        )
+        self.ok = Deployment.objects.create(app=app, status="success", logs="Step 4/9: RUN pip install\nSuccessfully built")
+
+    def search(self, query):
+        return list(search_deployments(Deployment.objects.all(), query))
+
+    def test_match_with_snippet(self):
+        results = self.search("psycopg2")
+
+        self.assertEqual(results, [self.failed])
+        self.assertIn(f"{SNIPPET_START}psycopg2{SNIPPET_STOP}", snippet_for(results[0], "psycopg2"))
+
+    def test_all_terms_must_match(self):
+        self.assertCountEqual(self.search("pip install"), [self.ok, self.failed])
+        self.assertEqual(self.search("pip wheel"), [self.failed])
+
+    def test_hostile_input_is_quoted(self):
+        for query in ['"', 'psycopg2" OR "Successfully', "build*", "NEAR(a b)", "logs:x", "'; --"]:
+            self.search(query)
+        self.assertEqual(self.search('psycopg2" OR "Successfully'), [])
+
+    def test_updated_and_compacted_logs_leave_the_index(self):
+        Deployment.objects.filter(pk=self.ok.pk).update(logs="rewritten")
+        self.assertEqual(self.search("Successfully"), [])
+
+        compact_deployments([self.failed], "web", archive=False)
+        self.assertEqual(self.search("psycopg2"), [])
+        self.assertEqual(self.search("rewritten"), [self.ok])
+
+    def test_deleted_rows_leave_the_index(self):
+        self.failed.delete()
+        self.assertEqual(self.search("psycopg2"), [])
+
+    def test_index_is_rebuilt_when_triggers_were_dropped(self):
+        # What a SQLite table rebuild during a migration does to the triggers
+        with connection.cursor() as cursor:
+            for trigger in ["ai", "ad", "au"]:
+                cursor.execute(f"DROP TRIGGER api_deployment_fts_{trigger}")
+        unindexed = Deployment.objects.create(app=self.ok.app, logs="added while the triggers were gone")
+        self.assertEqual(self.search("gone"), [])
+
+        install_search_index(connection)
+
+        self.assertEqual(self.search("gone"), [unindexed])
+        Deployment.objects.filter(pk=unindexed.pk).update(logs="")
+        self.assertEqual(self.search("gone"), [])
+
+    def test_substring_fallback_on_other_databases(self):
+        with mock.patch.object(connection, "vendor", "mysql"):
+            results = self.search("wheel build")
+
+        self.assertEqual(results, [self.failed])
+        self.assertIn(f"{SNIPPET_START}wheel build{SNIPPET_STOP}", snippet_for(results[0], "wheel build"))
+
+
+class BuildContextTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.build_dir = Path(tmp.name)
+
+    def touch(self, *paths, size=10):
+        for path in paths:
+            (self.build_dir / path).parent.mkdir(parents=True, exist_ok=True)
+            (self.build_dir / path).write_bytes(b"x" * size)
+
+    def assertMatches(self, pattern, matched, unmatched):
+        regex = compile_pattern(pattern)
+        for path in matched:
+            self.assertTrue(regex.match(path), f"{pattern} should match {path}")
+        for path in unmatched:
+            self.assertFalse(regex.match(path), f"{pattern} should not match {path}")
+
+    def test_patterns(self):
+        self.assertMatches(".git", [".git", ".git/HEAD"], ["src/.git", ".github"])
+        self.assertMatches("/venv/", ["venv", "venv/bin/python"], ["app/venv"])
+        self.assertMatches("**/node_modules", ["node_modules/x", "web/app/node_modules"], ["node_modules_old"])
+        self.assertMatches("**/*.py[cod]", ["a.pyc", "pkg/sub/b.pyo"], ["a.py", "a.pyx"])
+        self.assertMatches("*.egg-info", ["app.egg-info/PKG-INFO"], ["src/app.egg-info"])
+        self.assertMatches("docs/**", ["docs/a", "docs/b/c.md"], ["src/docs/a"])
+        self.assertMatches("a/**/z", ["a/z", "a/b/c/z"], ["b/a/z"])
+        self.assertMatches("file?.txt", ["file1.txt"], ["file10.txt", "file/.txt"])
+
+    def test_negation_re_includes(self):
+        (self.build_dir / DOCKERIGNORE).write_text("# comment\n*.md\n!README.md\n\n/\n")
+        rules = read_rules(self.build_dir)
+
+        self.assertEqual(len(rules), 2)
+        self.assertTrue(_excluded("CHANGES.md", rules))
+        self.assertFalse(_excluded("README.md", rules))
+
+    def test_generate_then_merge_is_idempotent(self):
+        self.touch("manage.py")
+        self.assertEqual(write_dockerignore(self.build_dir), "generated")
+        self.assertEqual(write_dockerignore(self.build_dir), "unchanged")
+
+        path = self.build_dir / DOCKERIGNORE
+        path.write_text(path.read_text() + "secrets/\n!.venv\n")
+        # .venv is now the repo's call, so it leaves the block
+        self.assertEqual(write_dockerignore(self.build_dir), "merged")
+        self.assertEqual(write_dockerignore(self.build_dir), "unchanged")
+
+        self.touch("package.json")
+        self.assertEqual(write_dockerignore(self.build_dir), "merged")
+        lines = path.read_text().splitlines()
+        self.assertIn("**/node_modules", lines)
+        # The repo's own rules stay after the block, so "!" re-includes win; listed patterns aren't repeated
+        self.assertEqual(lines[-2:], ["secrets/", "!.venv"])
+        self.assertNotIn(".venv", lines)
+        self.assertEqual(lines.count(BLOCK_START), 1)
+
+    def test_existing_dockerignore_is_merged(self):
+        self.touch("requirements.txt")
+        (self.build_dir / DOCKERIGNORE).write_text(".git\n")
+
+        self.assertEqual(write_dockerignore(self.build_dir), "merged")
+        lines = (self.build_dir / DOCKERIGNORE).read_text().splitlines()
+        self.assertEqual(lines[0], BLOCK_START)
+        self.assertEqual(lines.count(".git"), 1)
+
+    def test_measure_context_skips_excluded_files(self):
+        self.touch("manage.py", "app/views.py", "node_modules/big.js", ".git/objects/pack", "keep/.git")
+        self.touch("data/dump.sql", size=1000)
+        (self.build_dir / DOCKERIGNORE).write_text("node_modules\n.git\n")
+
+        context = measure_context(self.build_dir)
+
+        # manage.py, app/views.py, keep/.git, data/dump.sql and the .dockerignore itself
+        self.assertEqual(context["files"], 5)
+        self.assertEqual(context["bytes"], 1030 + len("node_modules\n.git\n"))
+        self.assertEqual(context["largest"][0]["path"], "data")
+
+    def test_parse_context_transfer(self):
+        self.assertEqual(
+            parse_context_transfer("#5 transferring context: 2.1MB 0.4s\n#5 transferring context: 45.12MB 1.2s done"),
+            (45120000, 1.2),
+        )
+        self.assertEqual(parse_context_transfer("#5 transferring context: 2B done"), (2, None))
+        self.assertEqual(parse_context_transfer("Sending build context to Docker daemon  4.5MB"), (4500000, None))
+        self.assertEqual(parse_context_transfer("no context here"), (None, None))
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user("ops", is_staff=True)
+        self.middleware = ProfilingMiddleware(lambda request: HttpResponse("ok"))
+
+    def request(self, **headers):
+        return self.middleware(RequestFactory().get("/api/apps/", headers=headers))
+
+    @override_settings(KEYSTONE_PROFILING=False)
+    def test_staff_token_profiles_with_sampling_off(self):
+        self.middleware = ProfilingMiddleware(lambda request: HttpResponse("ok"))
+        response = self.request(**{PROFILE_HEADER: profile_token(self.staff)})
+
+        profile = get_profile(int(response["X-Keystone-Profile-Id"]))
+        self.assertEqual(profile["trigger"], "header")
+
+    def test_header_without_a_valid_token_is_not_profiled(self):
+        for value in ["1", "forged", signing.dumps(self.staff.pk, salt="other")]:
+            with mock.patch("api.profiling.StackSampler") as sampler:
+                response = self.request(**{PROFILE_HEADER: value})
+            sampler.assert_not_called()
+            self.assertNotIn("X-Keystone-Profile-Id", response)
+
+    def test_token_endpoint_is_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("dev"))
+        self.assertEqual(client.post("/api/profiles/token/").status_code, 403)
+
+        client.force_authenticate(self.staff)
+        token = client.post("/api/profiles/token/").json()["token"]
+        self.assertEqual(signing.loads(token, salt="keystone.profiling"), self.staff.pk)
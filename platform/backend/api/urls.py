@@ -1,20 +1,32 @@
-from django.urls import path, include
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
 from .views import (
     AppViewSet,
     DeploymentViewSet,
+    EventStreamView,
     LoginView,
     LogoutView,
+    NodeViewSet,
+    ProfileViewSet,
+    RouteViewSet,
     health,
+    maintenance,
+    wake,
 )
 
 router = DefaultRouter()
 router.register(r"apps", AppViewSet, basename="apps")
 router.register(r"deployments", DeploymentViewSet, basename="deployments")
+router.register(r"nodes", NodeViewSet, basename="nodes")
+router.register(r"routes", RouteViewSet, basename="routes")
+router.register(r"profiles", ProfileViewSet, basename="profiles")
 
 urlpatterns = [
     path("health/", health),
+    path("maintenance/<slug:slug>/", maintenance),
+    re_path(r"^wake/(?P<slug>[-\w]+)(?P<path>/.*)?$", wake),
+    path("events/", EventStreamView.as_view()),
     path("auth/login/", LoginView.as_view()),
     path("auth/logout/", LogoutView.as_view()),
     path("", include(router.urls)),
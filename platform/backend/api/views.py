@@ -5,721 +5,454 @@ Simple 3-step workflow:
 1. Import Repo - POST /api/apps/ with {name, git_url, branch}
 2. Prepare - POST /api/apps/{id}/prepare/ - Configure for Traefik
 3. Deploy - POST /api/apps/{id}/deploy/ - Build and run container
-"""
-import os
-import shutil
-import subprocess
-import copy
-from pathlib import Path
 
-import yaml
+Rollback - POST /api/deployments/{id}/rollback/ - Restart from a previous deployment's images
+Cancel - POST /api/deployments/{id}/cancel/ - Kill a running deployment's build/start commands
+Search - GET /api/deployments/search/?q= - Full-text search over deployment logs
+Fleet sync - POST /api/apps/sync/ - Apply a YAML manifest of apps
+Fleet restore - POST /api/apps/restore/ - Bring running apps back after a reboot (GET: last report)
+Nodes - /api/nodes/ - Docker hosts apps are placed on
+Routes - /api/routes/ - Traefik routes; edits (and app maintenance/traffic_split) apply without restarts
+Profiles - GET /api/profiles/ - Sampled request profiles (staff only, needs KEYSTONE_PROFILING=1)
+Events - GET /api/events/ - Server-Sent Events with app/deployment changes (replaces polling)
+Waker - /api/wake/<slug>/... - Traefik target for sleeping apps, starts them on the first request
+Status - GET /api/apps/{id}/status/ - Live container state (logs and status reads are coalesced,
+         see GET /api/apps/cache-stats/)
+"""
+import datetime
+import json
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.html import escape
+from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import permissions, status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.views import APIView
 
-from .models import App, Deployment
-from .serializers import AppSerializer, DeploymentSerializer
-
-# Directories for repos and logs
-REPOS_DIR = Path("/runtime/repos")
-LOGS_DIR = Path("/runtime/logs")
-REPOS_DIR.mkdir(parents=True, exist_ok=True)
-LOGS_DIR.mkdir(parents=True, exist_ok=True)
+from .coalesce import APP_LOGS, APP_STATUS, APP_WAKES, invalidate_app
+from .deployer import (
+    PREPARABLE_STATUSES,
+    DeploymentCancelled,
+    app_logs,
+    app_status,
+    cancel_deployment,
+    deploy_app,
+    deployable,
+    prepare_app,
+    rollback_deployment,
+    stop_app,
+    wake_app,
+)
+from .events import EVENTS, stream
+from .fleet import apply_sync, describe_plan, parse_manifest, plan_sync, run_actions_in_background
+from .models import App, Deployment, Node, Route
+from .profiling import PROFILE_HEADER, TOKEN_MAX_AGE, get_profile, profile_token, recent_profiles
+from .restore import last_report, restore_candidates, restore_fleet_in_background, restore_in_progress
+from .retention import read_logs
+from .routing import sync_routes
+from .scheduler import refresh_node
+from .search import search_deployments
+from .serializers import (
+    AppSerializer,
+    DeploymentSearchSerializer,
+    DeploymentSerializer,
+    NodeSerializer,
+    RouteSerializer,
+)
 
-# Traefik network name
-TRAEFIK_NETWORK = "keystone_web"
 
-
-def inject_traefik_config(compose_path, app_slug, app_traefik_rule):
+class AppViewSet(viewsets.ModelViewSet):
     """
-    Modify a docker-compose.yml to add Traefik routing configuration.
-    - Adds Traefik labels to web-facing services
-    - Connects services to keystone_web network
-    - Removes conflicting port mappings (80, 443)
-    - Converts relative volume mounts to absolute paths
-    - Backs up original file
+    CRUD for Apps + prepare/deploy actions.
     """
-    # Read original compose file
-    with open(compose_path, 'r') as f:
-        compose_data = yaml.safe_load(f)
-    
-    # Get the absolute path of the repo directory for volume mount conversion
-    repo_dir = compose_path.parent
-    
-    # Convert container path to host path for Docker-in-Docker volume mounts
-    # Container has /runtime/repos, but Docker needs host path
-    host_runtime_path = os.environ.get('HOST_RUNTIME_PATH', '/runtime')
-    container_runtime_path = '/runtime'
-    
-    if not compose_data or 'services' not in compose_data:
-        raise Exception("Invalid docker-compose.yml: no services found")
-    
-    # Backup original
-    backup_path = compose_path.parent / f"{compose_path.name}.original"
-    shutil.copy(compose_path, backup_path)
+    queryset = App.objects.all().order_by("-created_at")
+    serializer_class = AppSerializer
+    # Set per action: "app_reads" / "app_actions" rates in REST_FRAMEWORK settings
+    throttle_scope = None
     
-    modified_services = []
+    def perform_update(self, serializer):
+        # maintenance / traffic_split take effect through the routes file
+        serializer.save()
+        sync_routes()
     
-    # Common web service names to look for
-    web_service_names = ['nginx', 'frontend', 'web', 'proxy', 'gateway', 'app']
-    backend_service_names = ['backend', 'api', 'server', 'django', 'flask', 'fastapi']
+    def perform_destroy(self, instance):
+        instance.delete()
+        sync_routes()
     
-    # Process ALL services - convert volumes and add network
-    for service_name, service_config in compose_data['services'].items():
-        if service_config is None:
-            service_config = {}
-            compose_data['services'][service_name] = service_config
-        
-        # Convert relative volume mounts to absolute HOST paths
-        # This is needed for Docker-in-Docker: the path must be valid on the Docker host
-        if 'volumes' in service_config:
-            new_volumes = []
-            for vol in service_config['volumes']:
-                if isinstance(vol, str):
-                    # Short syntax: ./host:container or ./host:container:ro
-                    if vol.startswith('./') or vol.startswith('../'):
-                        parts = vol.split(':')
-                        host_path = parts[0]
-                        # Convert relative to absolute (container path)
-                        container_abs_path = str((repo_dir / host_path).resolve())
-                        # Convert container path to host path
-                        if container_abs_path.startswith(container_runtime_path):
-                            host_abs_path = container_abs_path.replace(container_runtime_path, host_runtime_path, 1)
-                        else:
-                            host_abs_path = container_abs_path
-                        parts[0] = host_abs_path
-                        vol = ':'.join(parts)
-                    new_volumes.append(vol)
-                elif isinstance(vol, dict):
-                    # Long syntax with 'source' key
-                    source = vol.get('source', '')
-                    if source.startswith('./') or source.startswith('../'):
-                        container_abs_path = str((repo_dir / source).resolve())
-                        if container_abs_path.startswith(container_runtime_path):
-                            host_abs_path = container_abs_path.replace(container_runtime_path, host_runtime_path, 1)
-                        else:
-                            host_abs_path = container_abs_path
-                        vol['source'] = host_abs_path
-                    new_volumes.append(vol)
-                else:
-                    new_volumes.append(vol)
-            service_config['volumes'] = new_volumes
+    @action(detail=False, methods=["post"], throttle_classes=[ScopedRateThrottle], throttle_scope="app_actions")
+    def sync(self, request):
+        """
+        Apply a fleet manifest: {"manifest": "<yaml>"} or {"apps": [...]}.
+        Writes all changes in one transaction, then prepares/deploys changed
+        apps in the background. Pass ?dry_run=1 to only get the plan.
+        """
+        if not isinstance(request.data, dict):
+            return Response(
+                {"error": 'Expected a JSON object: {"manifest": "<yaml>"} or {"apps": [...]}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        is_web_service = False
-        service_port = None
+        manifest = request.data.get("manifest", request.data)
+        entries = parse_manifest(manifest)
+        plan = plan_sync(entries)
+        summary = describe_plan(plan)
         
-        # Check if service has ports that look like web ports
-        ports = service_config.get('ports', [])
-        for port in ports:
-            port_str = str(port)
-            # Look for common web ports (80, 443, 3000, 8000, 8080, 5000)
-            if any(p in port_str for p in ['80:', '443:', '3000:', '8000:', '8080:', '5000:', ':80', ':443']):
-                is_web_service = True
-                # Extract the container port
-                if ':' in port_str:
-                    parts = port_str.split(':')
-                    service_port = parts[-1].split('/')[0]  # Handle "8000:8000/tcp"
-                break
+        if request.query_params.get("dry_run") in ["1", "true"]:
+            return Response({"dry_run": True, **summary})
         
-        # Check if service name suggests it's a web service
-        service_name_lower = service_name.lower()
-        if any(name in service_name_lower for name in web_service_names):
-            is_web_service = True
-            if not service_port:
-                service_port = "80"
-        elif any(name in service_name_lower for name in backend_service_names):
-            is_web_service = True
-            if not service_port:
-                service_port = "8000"
+        deploy = request.data.get("deploy", True) not in [False, "false", "0"]
+        actions = apply_sync(plan)
+        if actions:
+            run_actions_in_background(actions, deploy=deploy)
         
-        if is_web_service:
-            # Add Traefik labels
-            labels = service_config.get('labels', [])
-            if isinstance(labels, dict):
-                labels = [f"{k}={v}" for k, v in labels.items()]
-            
-            # Create unique router name for this service
-            router_name = f"{app_slug}-{service_name}"
-            
-            # Determine the path prefix for this service
-            if service_name_lower in ['nginx', 'frontend', 'web', 'proxy', 'gateway']:
-                # Frontend/proxy gets the main path
-                path_prefix = f"/{app_slug}"
-            else:
-                # Backend services get a subpath
-                path_prefix = f"/{app_slug}/api" if 'backend' in service_name_lower or 'api' in service_name_lower else f"/{app_slug}/{service_name}"
-            
-            traefik_labels = [
-                "traefik.enable=true",
-                f"traefik.http.routers.{router_name}.rule=PathPrefix(`{path_prefix}`)",
-                f"traefik.http.routers.{router_name}.entrypoints=web",
-                f"traefik.http.services.{router_name}.loadbalancer.server.port={service_port}",
-                f"traefik.http.middlewares.{router_name}-strip.stripprefix.prefixes={path_prefix}",
-                f"traefik.http.routers.{router_name}.middlewares={router_name}-strip",
-            ]
-            
-            # Add labels
-            for label in traefik_labels:
-                if label not in labels:
-                    labels.append(label)
-            
-            service_config['labels'] = labels
-            
-            # Remove conflicting port mappings (ports that would conflict on host)
-            if 'ports' in service_config:
-                new_ports = []
-                for port in service_config['ports']:
-                    port_str = str(port)
-                    # Keep internal-only ports, remove host-mapped ones
-                    if ':' not in port_str:
-                        new_ports.append(port)
-                    else:
-                        # Check if it's mapping to host ports 80 or 443 (which Traefik uses)
-                        host_port = port_str.split(':')[0]
-                        if host_port not in ['80', '443']:
-                            # Keep non-conflicting ports but comment them out by not adding
-                            pass
-                # Remove ports section if empty, Traefik handles routing
-                if new_ports:
-                    service_config['ports'] = new_ports
-                else:
-                    service_config.pop('ports', None)
-            
-            # Ensure service is on keystone_web network
-            networks = service_config.get('networks', [])
-            if isinstance(networks, list):
-                if TRAEFIK_NETWORK not in networks:
-                    networks.append(TRAEFIK_NETWORK)
-            elif isinstance(networks, dict):
-                if TRAEFIK_NETWORK not in networks:
-                    networks[TRAEFIK_NETWORK] = {}
-            else:
-                networks = [TRAEFIK_NETWORK]
-            service_config['networks'] = networks
-            
-            modified_services.append({
-                "name": service_name,
-                "port": service_port,
-                "path": path_prefix
-            })
-    
-    # Add keystone_web to top-level networks as external
-    if 'networks' not in compose_data:
-        compose_data['networks'] = {}
-    
-    compose_data['networks'][TRAEFIK_NETWORK] = {
-        'external': True
-    }
-    
-    # Write modified compose file
-    with open(compose_path, 'w') as f:
-        yaml.dump(compose_data, f, default_flow_style=False, sort_keys=False)
-    
-    return modified_services
-
-
-def run_cmd(cmd, cwd=None, timeout=300):
-    """Run a shell command and return result."""
-    try:
-        result = subprocess.run(
-            cmd, cwd=cwd, capture_output=True, text=True, timeout=timeout
+        return Response(
+            {**summary, "actions": [{"app": name, "step": step} for name, step in actions]},
+            status=status.HTTP_202_ACCEPTED if actions else status.HTTP_200_OK
         )
-        return result.returncode, result.stdout, result.stderr
-    except subprocess.TimeoutExpired:
-        return 1, "", "Command timed out"
-    except Exception as e:
-        return 1, "", str(e)
-
-
-class AppViewSet(viewsets.ModelViewSet):
-    """
-    CRUD for Apps + prepare/deploy actions.
-    """
-    queryset = App.objects.all().order_by("-created_at")
-    serializer_class = AppSerializer
     
-    def _find_dockerfile_or_app(self, repo_dir):
+    @action(detail=False, methods=["get", "post"], throttle_classes=[ScopedRateThrottle], throttle_scope="app_actions")
+    def restore(self, request):
         """
-        Find Dockerfile or app files in repo, checking root and common subdirectories.
-        Returns: (dockerfile_path, app_type, build_context)
+        GET: report of the last fleet restore.
+        POST: start or recreate every app marked running, in restore_priority
+        order and without rebuilding, in the background.
         """
-        # Common subdirectory names to check
-        subdirs_to_check = ["", "backend", "app", "src", "api", "server"]
+        if request.method == "GET":
+            return Response(last_report() or {})
         
-        for subdir in subdirs_to_check:
-            check_dir = repo_dir / subdir if subdir else repo_dir
-            if not check_dir.exists():
-                continue
-                
-            # Check for Dockerfile
-            if (check_dir / "Dockerfile").exists():
-                return (check_dir / "Dockerfile", "dockerfile", check_dir)
-            
-            # Check for Django app
-            if (check_dir / "manage.py").exists():
-                return (None, "django", check_dir)
-            
-            # Check for Node app
-            if (check_dir / "package.json").exists():
-                return (None, "node", check_dir)
-            
-            # Check for Python app with requirements.txt
-            if (check_dir / "requirements.txt").exists():
-                return (None, "python", check_dir)
+        if restore_in_progress():
+            return Response({"error": "A fleet restore is already running"}, status=status.HTTP_409_CONFLICT)
         
-        return (None, None, None)
-
-    @action(detail=True, methods=["post"])
+        apps = restore_candidates()
+        restore_fleet_in_background()
+        return Response(
+            {"apps": [{"app": app.name, "priority": app.restore_priority} for app in apps]},
+            status=status.HTTP_202_ACCEPTED
+        )
+    
+    @action(detail=True, methods=["post"], throttle_classes=[ScopedRateThrottle], throttle_scope="app_actions")
     def prepare(self, request, pk=None):
         """
         Step 2: Prepare repo for Traefik deployment.
         - Clone the repo
         - Detect structure (Django backend, frontend, docker-compose, etc.)
-        - Generate Traefik labels
+        - Record Traefik routes
         """
         app = self.get_object()
         
-        if app.status not in ["imported", "failed", "prepared"]:
+        if not app.git_url:
             return Response(
-                {"error": f"Cannot prepare app in status: {app.status}"},
+                {"error": "App has no git_url. Image apps are deployed directly."},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        app.status = "preparing"
-        app.error_message = ""
-        app.save()
+        if app.status not in PREPARABLE_STATUSES:
+            return Response(
+                {"error": f"Cannot prepare app in status: {app.status}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         try:
-            # Clone or update repo
-            repo_dir = REPOS_DIR / app.slug
-            
-            if repo_dir.exists():
-                shutil.rmtree(repo_dir)
-            
-            # Clone repo
-            code, out, err = run_cmd(
-                ["git", "clone", "--depth", "1", "-b", app.branch, app.git_url, str(repo_dir)]
-            )
-            
-            if code != 0:
-                raise Exception(f"Git clone failed: {err or out}")
-            
-            # Check for docker-compose.yml first (multi-service apps)
-            has_compose = (repo_dir / "docker-compose.yml").exists() or (repo_dir / "compose.yml").exists()
-            compose_file = "docker-compose.yml" if (repo_dir / "docker-compose.yml").exists() else "compose.yml" if (repo_dir / "compose.yml").exists() else None
-            
-            # Detect app structure at root level
-            has_dockerfile = (repo_dir / "Dockerfile").exists()
-            has_requirements = (repo_dir / "requirements.txt").exists()
-            has_manage_py = (repo_dir / "manage.py").exists()
-            has_package_json = (repo_dir / "package.json").exists()
-            
-            # Find Dockerfile or app in subdirectories
-            dockerfile_path, app_type, build_context = self._find_dockerfile_or_app(repo_dir)
-            
-            structure = {
-                "dockerfile": has_dockerfile or (dockerfile_path is not None),
-                "docker_compose": has_compose,
-                "django": has_manage_py or app_type == "django",
-                "python": has_requirements or app_type == "python",
-                "node": has_package_json or app_type == "node",
-                "build_context": str(build_context.relative_to(repo_dir)) if build_context and build_context != repo_dir else ".",
-                "deploy_mode": "compose" if has_compose else "dockerfile",
-            }
-            
-            # Determine deployment strategy
-            if has_compose:
-                # Multi-service app with docker-compose.yml
-                # INJECT TRAEFIK CONFIGURATION into the compose file
-                compose_path = repo_dir / compose_file
-                modified_services = inject_traefik_config(
-                    compose_path, 
-                    app.slug, 
-                    f"PathPrefix(`/{app.slug}`)"
-                )
-                
-                # Store the compose file path for deploy step
-                app.env_vars = app.env_vars or {}
-                app.env_vars["_keystone_deploy_mode"] = "compose"
-                app.env_vars["_keystone_compose_file"] = compose_file
-                
-                structure["message"] = "Modified docker-compose.yml with Traefik routing"
-                structure["modified_services"] = modified_services
-                structure["traefik_injected"] = True
-                
-            elif dockerfile_path:
-                # Found Dockerfile (possibly in subdirectory)
-                app.env_vars = app.env_vars or {}
-                app.env_vars["_keystone_deploy_mode"] = "dockerfile"
-                app.env_vars["_keystone_build_context"] = str(build_context.relative_to(repo_dir)) if build_context != repo_dir else "."
-                
-            elif has_dockerfile:
-                # Dockerfile at root
-                app.env_vars = app.env_vars or {}
-                app.env_vars["_keystone_deploy_mode"] = "dockerfile"
-                app.env_vars["_keystone_build_context"] = "."
-                
-            elif app_type == "django":
-                # Generate Django Dockerfile
-                dockerfile_content = self._generate_django_dockerfile()
-                with open(build_context / "Dockerfile", "w") as f:
-                    f.write(dockerfile_content)
-                app.env_vars = app.env_vars or {}
-                app.env_vars["_keystone_deploy_mode"] = "dockerfile"
-                app.env_vars["_keystone_build_context"] = str(build_context.relative_to(repo_dir)) if build_context != repo_dir else "."
-                structure["generated_dockerfile"] = True
-                
-            elif app_type == "node":
-                # Generate Node Dockerfile
-                dockerfile_content = self._generate_node_dockerfile()
-                with open(build_context / "Dockerfile", "w") as f:
-                    f.write(dockerfile_content)
-                app.env_vars = app.env_vars or {}
-                app.env_vars["_keystone_deploy_mode"] = "dockerfile"
-                app.env_vars["_keystone_build_context"] = str(build_context.relative_to(repo_dir)) if build_context != repo_dir else "."
-                structure["generated_dockerfile"] = True
-                
-            else:
-                raise Exception(
-                    "No Dockerfile or docker-compose.yml found, and couldn't detect app type. "
-                    "Checked: root, backend/, app/, src/, api/, server/ directories. "
-                    "Please add a Dockerfile or docker-compose.yml to your repository."
-                )
-            
-            # Set Traefik rule (path-based routing)
-            app.traefik_rule = f"PathPrefix(`/{app.slug}`)"
-            app.status = "prepared"
-            app.save()
-            
-            return Response({
-                "status": "prepared",
-                "structure": structure,
-                "traefik_rule": app.traefik_rule,
-                "message": f"App prepared. Will be accessible at /{app.slug}"
-            })
-            
+            return Response(prepare_app(app))
         except Exception as e:
-            app.status = "failed"
-            app.error_message = str(e)
-            app.save()
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            invalidate_app(app.pk)
     
-    @action(detail=True, methods=["post"])
+    @action(detail=True, methods=["post"], throttle_classes=[ScopedRateThrottle], throttle_scope="app_actions")
     def deploy(self, request, pk=None):
         """
         Step 3: Deploy the app.
         - For docker-compose apps: use docker compose up
-        - For single Dockerfile apps: build and run with Traefik labels
+        - For single Dockerfile apps: build and run on the Traefik network
+        - For image apps: pull the image and run it
         """
         app = self.get_object()
         
-        if app.status not in ["prepared", "running", "stopped", "failed"]:
+        if not deployable(app):
             return Response(
                 {"error": f"App must be prepared first. Current status: {app.status}"},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create deployment record
-        deployment = Deployment.objects.create(app=app, status="running")
-        
-        app.status = "deploying"
-        app.error_message = ""
-        app.save()
-        
-        logs = []
-        
         try:
-            repo_dir = REPOS_DIR / app.slug
-            
-            if not repo_dir.exists():
-                raise Exception("Repo not found. Please prepare first.")
-            
-            # Get deployment mode from env_vars (set during prepare)
-            env_vars = app.env_vars or {}
-            deploy_mode = env_vars.get("_keystone_deploy_mode", "dockerfile")
-            
-            if deploy_mode == "compose":
-                # Deploy using docker-compose
-                return self._deploy_compose(app, deployment, repo_dir, logs)
-            else:
-                # Deploy using single Dockerfile
-                return self._deploy_dockerfile(app, deployment, repo_dir, logs)
-            
+            return Response(deploy_app(app))
+        except DeploymentCancelled as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
         except Exception as e:
-            app.status = "failed"
-            app.error_message = str(e)
-            app.save()
-            
-            deployment.status = "failed"
-            deployment.error = str(e)
-            deployment.logs = "\n".join(logs)
-            deployment.finished_at = timezone.now()
-            deployment.save()
-            
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-    def _deploy_compose(self, app, deployment, repo_dir, logs):
-        """Deploy app using docker-compose with Traefik routing."""
-        env_vars = app.env_vars or {}
-        compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
-        
-        logs.append(f"Deploying with docker-compose: {compose_file}")
-        logs.append(f"Traefik routing: {app.traefik_rule}")
-        
-        # Create a project name based on app slug
-        project_name = f"keystone-{app.slug}"
-        
-        # Stop existing compose stack if any
-        logs.append("Stopping existing containers...")
-        run_cmd(
-            ["docker", "compose", "-p", project_name, "-f", compose_file, "down", "--remove-orphans"],
-            cwd=str(repo_dir),
-            timeout=120
-        )
-        
-        # Handle .env file - copy from .env.example if exists and .env doesn't
-        env_example = repo_dir / ".env.example"
-        env_file = repo_dir / ".env"
-        if env_example.exists() and not env_file.exists():
-            shutil.copy(env_example, env_file)
-            logs.append("Created .env from .env.example")
-        
-        # Prepare environment variables to inject
-        env_file_content = []
-        for key, value in env_vars.items():
-            if not key.startswith("_keystone_"):  # Skip internal keys
-                env_file_content.append(f"{key}={value}")
-        
-        # Append Keystone env vars to .env file
-        if env_file_content:
-            mode = "a" if env_file.exists() else "w"
-            with open(env_file, mode) as f:
-                f.write("\n# Keystone injected vars\n")
-                f.write("\n".join(env_file_content) + "\n")
-            logs.append(f"Added {len(env_file_content)} env vars to .env")
-        
-        # Build images
-        logs.append("Building images...")
-        code, out, err = run_cmd(
-            ["docker", "compose", "-p", project_name, "-f", compose_file, "build", "--no-cache"],
-            cwd=str(repo_dir),
-            timeout=900
-        )
-        logs.append(f"Build output:\n{out}\n{err}")
-        
-        if code != 0:
-            raise Exception(f"Docker compose build failed: {err or out}")
-        
-        # Start services
-        logs.append("Starting services with Traefik routing...")
-        code, out, err = run_cmd(
-            ["docker", "compose", "-p", project_name, "-f", compose_file, "up", "-d"],
-            cwd=str(repo_dir),
-            timeout=300
-        )
-        logs.append(f"Up output:\n{out}\n{err}")
-        
-        if code != 0:
-            raise Exception(f"Docker compose up failed: {err or out}")
-        
-        # Get running containers
-        code, out, err = run_cmd(
-            ["docker", "compose", "-p", project_name, "-f", compose_file, "ps", "--format", "table"],
-            cwd=str(repo_dir)
-        )
-        logs.append(f"Running containers:\n{out}")
-        
-        app.container_id = project_name  # Store project name for compose apps
-        app.status = "running"
-        app.save()
-        
-        deployment.status = "success"
-        deployment.logs = "\n".join(logs)
-        deployment.finished_at = timezone.now()
-        deployment.save()
-        
-        return Response({
-            "status": "running",
-            "container_id": project_name,
-            "deploy_mode": "compose",
-            "url": f"/{app.slug}",
-            "message": f"App deployed! Access at http://YOUR_VPS_IP/{app.slug}"
-        })
-
-    def _deploy_dockerfile(self, app, deployment, repo_dir, logs):
-        """Deploy app using single Dockerfile."""
-        env_vars = app.env_vars or {}
-        build_context = env_vars.get("_keystone_build_context", ".")
-        build_dir = repo_dir / build_context if build_context != "." else repo_dir
-        
-        # Stop existing container if any
-        container_name = f"keystone-app-{app.slug}"
-        run_cmd(["docker", "stop", container_name])
-        run_cmd(["docker", "rm", container_name])
-        
-        # Build image
-        image_tag = f"keystone/{app.slug}:latest"
-        logs.append(f"Building image: {image_tag} (context: {build_context})")
-        
-        code, out, err = run_cmd(
-            ["docker", "build", "-t", image_tag, "."],
-            cwd=str(build_dir),
-            timeout=600
-        )
-        logs.append(f"Build output:\n{out}\n{err}")
-        
-        if code != 0:
-            raise Exception(f"Docker build failed: {err or out}")
-        
-        # Prepare environment variables (skip internal keys)
-        env_args = []
-        for key, value in env_vars.items():
-            if not key.startswith("_keystone_"):
-                env_args.extend(["-e", f"{key}={value}"])
+        finally:
+            invalidate_app(app.pk)
+    
+    @action(detail=True, methods=["post"], throttle_classes=[ScopedRateThrottle], throttle_scope="app_actions")
+    def stop(self, request, pk=None):
+        """Stop a running app."""
+        app = self.get_object()
+        try:
+            return Response(stop_app(app))
+        finally:
+            invalidate_app(app.pk)
+    
+    @action(detail=True, methods=["get"], throttle_classes=[ScopedRateThrottle], throttle_scope="app_reads")
+    def logs(self, request, pk=None):
+        """
+        Get container logs (?tail=, default 100). Concurrent requests for the
+        same app share one docker call and its result for a few seconds.
+        """
+        app = self.get_object()
+        try:
+            tail = min(max(int(request.query_params.get("tail", 100)), 1), 1000)
+        except ValueError:
+            tail = 100
         
-        # Run container with Traefik labels
-        docker_run_cmd = [
-            "docker", "run", "-d",
-            "--name", container_name,
-            "--network", TRAEFIK_NETWORK,
-            "--restart", "unless-stopped",
-            # Traefik labels
-            "-l", "traefik.enable=true",
-            "-l", f"traefik.http.routers.{app.slug}.rule={app.traefik_rule}",
-            "-l", f"traefik.http.routers.{app.slug}.entrypoints=web",
-            "-l", f"traefik.http.services.{app.slug}.loadbalancer.server.port={app.container_port}",
-            # Strip path prefix so app receives clean URLs
-            "-l", f"traefik.http.middlewares.{app.slug}-strip.stripprefix.prefixes=/{app.slug}",
-            "-l", f"traefik.http.routers.{app.slug}.middlewares={app.slug}-strip",
-        ] + env_args + [image_tag]
+        try:
+            logs = APP_LOGS.get((app.pk, tail), lambda: app_logs(app, tail))
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response({"logs": logs})
+    
+    @action(detail=True, methods=["get"], throttle_classes=[ScopedRateThrottle], throttle_scope="app_reads", url_path="status")
+    def live_status(self, request, pk=None):
+        """Live state of the app's containers (coalesced like logs)."""
+        app = self.get_object()
+        try:
+            containers = APP_STATUS.get((app.pk,), lambda: app_status(app))
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response({"status": app.status, "containers": containers})
+    
+    @action(detail=False, methods=["get"], url_path="cache-stats")
+    def cache_stats(self, request):
+        """Hit/miss counters of the logs and status read caches."""
+        return Response({cache.name: cache.stats() for cache in [APP_LOGS, APP_STATUS]})
+
+
+class DeploymentViewSet(viewsets.ReadOnlyModelViewSet):
+    """View deployment history."""
+    queryset = Deployment.objects.select_related("app")
+    serializer_class = DeploymentSerializer
+    throttle_scope = None
+    
+    def get_queryset(self):
+        qs = super().get_queryset()
+        params = self.request.query_params
         
-        logs.append(f"Running container: {container_name}")
-        code, out, err = run_cmd(docker_run_cmd)
-        logs.append(f"Run output:\n{out}\n{err}")
+        app_id = params.get("app")
+        if app_id:
+            qs = qs.filter(app_id=app_id)
         
-        if code != 0:
-            raise Exception(f"Docker run failed: {err or out}")
+        deployment_status = params.get("status")
+        if deployment_status:
+            qs = qs.filter(status=deployment_status)
+        
+        # Time window: ISO datetime or date (until=<date> includes that whole day)
+        for param, lookup, day_time in [("since", "created_at__gte", datetime.time.min), ("until", "created_at__lte", datetime.time.max)]:
+            value = params.get(param)
+            if value:
+                try:
+                    when = parse_datetime(value)
+                    if when is None and parse_date(value):
+                        when = datetime.datetime.combine(parse_date(value), day_time)
+                except ValueError:
+                    when = None
+                if when is None:
+                    raise ValidationError({param: "Expected an ISO date or datetime"})
+                if timezone.is_naive(when):
+                    when = timezone.make_aware(when)
+                qs = qs.filter(**{lookup: when})
+        return qs
+    
+    @action(detail=False, methods=["get"])
+    def search(self, request):
+        """
+        Full-text search over deployment logs and errors.
+        Supports the same app/status/since/until filters as the list view.
+        """
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"error": "Missing search query (q)"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Get container ID
-        app.container_id = out.strip()[:12]
-        app.status = "running"
-        app.save()
+        try:
+            limit = max(1, min(int(request.query_params.get("limit", 50)), 200))
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
         
-        deployment.status = "success"
-        deployment.logs = "\n".join(logs)
-        deployment.finished_at = timezone.now()
-        deployment.save()
+        qs = search_deployments(self.get_queryset().select_related("app"), query)
+        if connection.vendor in ["postgresql", "sqlite"]:
+            # Snippets come from the index, no need to load full log bodies
+            qs = qs.defer("logs")
         
-        return Response({
-            "status": "running",
-            "container_id": app.container_id,
-            "url": f"/{app.slug}",
-            "deploy_mode": "dockerfile",
-            "message": f"App deployed! Access at http://YOUR_VPS_IP/{app.slug}"
-        })
+        serializer = DeploymentSearchSerializer(qs[:limit], many=True, context={"query": query})
+        return Response({"query": query, "results": serializer.data})
     
-    @action(detail=True, methods=["post"])
-    def stop(self, request, pk=None):
-        """Stop a running app."""
-        app = self.get_object()
-        env_vars = app.env_vars or {}
-        deploy_mode = env_vars.get("_keystone_deploy_mode", "dockerfile")
+    @action(detail=True, methods=["get"])
+    def logs(self, request, pk=None):
+        """Full build logs, read from the archive for compacted deployments."""
+        deployment = self.get_object()
+        return Response({"logs": read_logs(deployment), "compacted": deployment.compacted})
+    
+    @action(detail=True, methods=["post"], throttle_classes=[ScopedRateThrottle], throttle_scope="app_actions")
+    def rollback(self, request, pk=None):
+        """
+        Restart the app from the images a previous deployment produced.
+        No git clone or docker build is involved.
+        """
+        target = self.get_object()
+        app = target.app
         
-        if deploy_mode == "compose":
-            # Stop compose stack
-            repo_dir = REPOS_DIR / app.slug
-            compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
-            project_name = f"keystone-{app.slug}"
-            run_cmd(
-                ["docker", "compose", "-p", project_name, "-f", compose_file, "stop"],
-                cwd=str(repo_dir)
+        if target.status != "success" or not target.images:
+            return Response(
+                {"error": "Only successful deployments with recorded images can be rolled back to"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        else:
-            # Stop single container
-            container_name = f"keystone-app-{app.slug}"
-            run_cmd(["docker", "stop", container_name])
         
-        app.status = "stopped"
-        app.save()
+        if app.status in ["preparing", "deploying"]:
+            return Response(
+                {"error": f"Cannot roll back app in status: {app.status}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return Response({"status": "stopped"})
+        try:
+            return Response(rollback_deployment(target))
+        except DeploymentCancelled as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            invalidate_app(app.pk)
     
-    @action(detail=True, methods=["get"])
-    def logs(self, request, pk=None):
-        """Get container logs."""
-        app = self.get_object()
-        env_vars = app.env_vars or {}
-        deploy_mode = env_vars.get("_keystone_deploy_mode", "dockerfile")
+    @action(detail=True, methods=["post"], throttle_classes=[ScopedRateThrottle], throttle_scope="app_actions")
+    def cancel(self, request, pk=None):
+        """
+        Cancel a running deployment. Its current command is killed with its
+        whole process tree, a partial compose stack is taken down and the
+        app can be deployed again immediately.
+        """
+        deployment = self.get_object()
         
-        if deploy_mode == "compose":
-            # Get compose logs
-            repo_dir = REPOS_DIR / app.slug
-            compose_file = env_vars.get("_keystone_compose_file", "docker-compose.yml")
-            project_name = f"keystone-{app.slug}"
-            code, out, err = run_cmd(
-                ["docker", "compose", "-p", project_name, "-f", compose_file, "logs", "--tail", "100"],
-                cwd=str(repo_dir)
+        if deployment.status != "running":
+            return Response(
+                {"error": f"Only running deployments can be cancelled (status: {deployment.status})"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        else:
-            # Get single container logs
-            container_name = f"keystone-app-{app.slug}"
-            code, out, err = run_cmd(["docker", "logs", "--tail", "100", container_name])
         
-        return Response({"logs": out or err})
-    
-    def _generate_django_dockerfile(self):
-        """Generate Dockerfile for Django app."""
-        return '''FROM python:3.12-slim
-
-WORKDIR /app
-
-# Install dependencies
-COPY requirements.txt .
-RUN pip install --no-cache-dir -r requirements.txt gunicorn
+        try:
+            result = cancel_deployment(deployment)
+        finally:
+            invalidate_app(deployment.app_id)
+        if result is None:
+            deployment.refresh_from_db(fields=["status"])
+            return Response(
+                {"error": f"Only running deployments can be cancelled (status: {deployment.status})"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(result)
 
-# Copy app
-COPY . .
 
-# Collect static files
-RUN python manage.py collectstatic --noinput 2>/dev/null || true
+class NodeViewSet(viewsets.ModelViewSet):
+    """CRUD for Docker nodes apps can be placed on."""
+    queryset = Node.objects.all().order_by("name")
+    serializer_class = NodeSerializer
+    
+    @action(detail=True, methods=["post"])
+    def refresh(self, request, pk=None):
+        """Re-read capacity and current load from the node's daemon."""
+        node = self.get_object()
+        if not refresh_node(node):
+            return Response(
+                {"error": f"Node unreachable: {node.last_error}"},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+        return Response(NodeSerializer(node).data)
 
-EXPOSE 8000
 
-CMD ["gunicorn", "--bind", "0.0.0.0:8000", "--workers", "2", "config.wsgi:application"]
-'''
+class RouteViewSet(viewsets.ModelViewSet):
+    """
+    CRUD for app routes. Every change rewrites the Traefik routes file,
+    containers are not touched.
+    """
+    queryset = Route.objects.select_related("app")
+    serializer_class = RouteSerializer
+    
+    def get_queryset(self):
+        qs = super().get_queryset()
+        app_id = self.request.query_params.get("app")
+        if app_id:
+            qs = qs.filter(app_id=app_id)
+        return qs
     
-    def _generate_node_dockerfile(self):
-        """Generate Dockerfile for Node app."""
-        return '''FROM node:20-alpine
+    def perform_create(self, serializer):
+        serializer.save()
+        sync_routes()
+    
+    def perform_update(self, serializer):
+        serializer.save()
+        sync_routes()
+    
+    def perform_destroy(self, instance):
+        instance.delete()
+        sync_routes()
 
-WORKDIR /app
 
-COPY package*.json ./
-RUN npm install
+class ProfileViewSet(viewsets.ViewSet):
+    """Recent request profiles recorded by ProfilingMiddleware (staff only)."""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def list(self, request):
+        """Profile summaries, newest first (call trees only in the detail view)."""
+        return Response([
+            {key: value for key, value in profile.items() if key != "tree"}
+            for profile in recent_profiles()
+        ])
+    
+    def retrieve(self, request, pk=None):
+        profile = get_profile(int(pk)) if str(pk).isdigit() else None
+        if profile is None:
+            raise Http404
+        return Response(profile)
+    
+    @action(detail=False, methods=["post"])
+    def token(self, request):
+        """Token for the X-Keystone-Profile header; profiles requests even with sampling off."""
+        return Response({"header": PROFILE_HEADER, "token": profile_token(request.user), "expires_in": TOKEN_MAX_AGE})
 
-COPY . .
-RUN npm run build 2>/dev/null || true
 
-EXPOSE 3000
+# =============================================================================
+# Event Stream
+# =============================================================================
 
-CMD ["npm", "start"]
-'''
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients ask for text/event-stream; only error bodies go through it."""
+    media_type = "text/event-stream"
+    format = "sse"
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
 
 
-class DeploymentViewSet(viewsets.ReadOnlyModelViewSet):
-    """View deployment history."""
-    queryset = Deployment.objects.all()
-    serializer_class = DeploymentSerializer
+class EventStreamView(APIView):
+    """
+    App and deployment changes as Server-Sent Events (see api/events.py).
+    Resume with the Last-Event-ID header (or ?last_event_id=).
+    """
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
     
-    def get_queryset(self):
-        qs = super().get_queryset()
-        app_id = self.request.query_params.get("app")
-        if app_id:
-            qs = qs.filter(app_id=app_id)
-        return qs
+    def get(self, request):
+        last_event_id = request.headers.get("Last-Event-ID") or request.query_params.get("last_event_id")
+        response = StreamingHttpResponse(stream(EVENTS, last_event_id), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
 
 
 # =============================================================================
@@ -751,6 +484,69 @@ class LogoutView(APIView):
         return Response({"ok": True})
 
 
+MAINTENANCE_PAGE = """<!doctype html>
+<html>
+<head><meta charset="utf-8"><title>{name} - Maintenance</title></head>
+<body style="font-family: sans-serif; text-align: center; padding-top: 15vh">
+<h1>{name} is down for maintenance</h1>
+<p>We'll be back shortly.</p>
+</body>
+</html>
+"""
+
+
+@csrf_exempt
+def maintenance(request, slug):
+    """Page Traefik serves (via replacePath) for apps in maintenance mode."""
+    names = [app.name for app in App.objects.filter(maintenance=True).only("name") if app.slug == slug]
+    if not names:
+        raise Http404
+    response = HttpResponse(MAINTENANCE_PAGE.format(name=escape(names[0])), status=503)
+    response["Retry-After"] = "300"
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+# Traefik's file provider applies a rewritten routes file within ~2 seconds
+ROUTE_RELOAD_SECONDS = 2
+
+
+def _wake(app_id):
+    app = App.objects.select_related("node").get(pk=app_id)
+    if app.status == "sleeping":
+        wake_app(app, timeout=settings.KEYSTONE_WAKE_TIMEOUT)
+        invalidate_app(app.pk)
+
+
+@csrf_exempt
+def wake(request, slug, path=None):
+    """
+    Requests for sleeping apps arrive here (Traefik prefixes them with
+    /api/wake/<slug>). The app is started, the request held until it
+    accepts connections, then redirected (307, method and body kept) to
+    its original URL, which Traefik by then routes to the app again.
+    """
+    apps = App.objects.filter(status__in=["sleeping", "running"]).only("id", "name")
+    app = next((app for app in apps if app.slug == slug), None)
+    if app is None:
+        raise Http404
+    
+    try:
+        APP_WAKES.get((app.pk,), lambda: _wake(app.pk))
+    except Exception as e:
+        return HttpResponse(f"{escape(app.name)} could not be started: {escape(str(e))}", status=503)
+    
+    time.sleep(ROUTE_RELOAD_SECONDS)
+    
+    location = "/" + (path or f"/{slug}").lstrip("/")
+    if request.META.get("QUERY_STRING"):
+        location += "?" + request.META["QUERY_STRING"]
+    response = HttpResponse(status=307)
+    response["Location"] = location
+    response["Cache-Control"] = "no-store"
+    return response
+
+
 @api_view(["GET"])
 @permission_classes([permissions.AllowAny])
 def health(request):
@@ -22,6 +22,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so profiles cover the other middleware too (see api/profiling.py)
+    "api.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -64,6 +66,11 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.TokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
+    # Per-user limits for actions that shell out to Docker (see throttle_scope in api/views.py)
+    "DEFAULT_THROTTLE_RATES": {
+        "app_reads": os.getenv("KEYSTONE_THROTTLE_READS", "120/min"),
+        "app_actions": os.getenv("KEYSTONE_THROTTLE_ACTIONS", "20/min"),
+    },
 }
 
 # CORS - Allow all in dev
@@ -71,3 +78,41 @@ CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 
 AUTH_PASSWORD_VALIDATORS = []
+
+# Image retention - deployment images kept per app and build cache budget for gc_images
+KEYSTONE_IMAGE_RETENTION = int(os.getenv("KEYSTONE_IMAGE_RETENTION", "5"))
+KEYSTONE_BUILD_CACHE_BUDGET = os.getenv("KEYSTONE_BUILD_CACHE_BUDGET", "5GB")
+
+# Multi-host - published port range for apps on remote nodes, Traefik file provider directory
+KEYSTONE_PORT_RANGE = (int(os.getenv("PORT_RANGE_START", "9000")), int(os.getenv("PORT_RANGE_END", "9999")))
+KEYSTONE_TRAEFIK_DYNAMIC_DIR = os.getenv("KEYSTONE_TRAEFIK_DYNAMIC_DIR", "/runtime/traefik")
+
+# Routing - where Traefik reaches Keystone's own backend (maintenance pages)
+KEYSTONE_BACKEND_URL = os.getenv("KEYSTONE_BACKEND_URL", "http://keystone-backend:8000")
+
+# Deployment retention - rows kept in full per app by compact_deployments; older logs are archived (or dropped)
+KEYSTONE_DEPLOYMENT_RETENTION = int(os.getenv("KEYSTONE_DEPLOYMENT_RETENTION", "20"))
+KEYSTONE_DEPLOYMENT_MILESTONES = int(os.getenv("KEYSTONE_DEPLOYMENT_MILESTONES", "10"))
+KEYSTONE_DEPLOYMENT_LOG_ARCHIVE = os.getenv("KEYSTONE_DEPLOYMENT_LOG_ARCHIVE", "1") == "1"
+
+# Read coalescing - seconds container logs/status results are shared between requests
+KEYSTONE_READ_CACHE_TTL = float(os.getenv("KEYSTONE_READ_CACHE_TTL", "3"))
+
+# Scale to zero - Traefik access log read by scale_idle_apps, how long the waker waits for an app
+KEYSTONE_TRAEFIK_ACCESS_LOG = os.getenv("KEYSTONE_TRAEFIK_ACCESS_LOG", "/runtime/logs/traefik/access.log")
+KEYSTONE_ACCESS_LOG_MAX_BYTES = int(os.getenv("KEYSTONE_ACCESS_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+KEYSTONE_WAKE_TIMEOUT = int(os.getenv("KEYSTONE_WAKE_TIMEOUT", "60"))
+
+# Event stream - seconds between DB reads while dashboards are connected to /api/events/
+KEYSTONE_EVENT_POLL_INTERVAL = float(os.getenv("KEYSTONE_EVENT_POLL_INTERVAL", "1"))
+
+# Build context - prepare and deploy warn when a Dockerfile app sends more than this to the daemon
+KEYSTONE_BUILD_CONTEXT_WARN_MB = int(os.getenv("KEYSTONE_BUILD_CONTEXT_WARN_MB", "200"))
+
+# Fleet restore - run restore_fleet when the backend container starts, apps restored at once
+KEYSTONE_RESTORE_ON_START = os.getenv("KEYSTONE_RESTORE_ON_START", "1") == "1"
+KEYSTONE_RESTORE_CONCURRENCY = int(os.getenv("KEYSTONE_RESTORE_CONCURRENCY", "3"))
+
+# Request sampling - off unless enabled; fraction of requests profiled (staff tokens work either way)
+KEYSTONE_PROFILING = os.getenv("KEYSTONE_PROFILING", "0") == "1"
+KEYSTONE_PROFILE_SAMPLE_RATE = float(os.getenv("KEYSTONE_PROFILE_SAMPLE_RATE", "0.01"))
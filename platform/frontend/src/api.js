@@ -61,6 +61,79 @@ class ApiClient {
   delete(path) {
     return this.request('DELETE', path)
   }
+
+  /**
+   * Follow a Server-Sent Events stream. Uses fetch rather than EventSource
+   * so the auth token can be sent; reconnects with Last-Event-ID.
+   * onError(err) is called whenever the stream is down, onOpen() whenever
+   * it is (re)connected. Returns { close }.
+   */
+  subscribe(path, handlers, { onOpen, onError } = {}) {
+    const controller = new AbortController()
+    let lastEventId = null
+    let retry = 3000
+    let closed = false
+
+    const dispatch = (block) => {
+      let event = 'message'
+      let id = null
+      const data = []
+      for (const line of block.split('\n')) {
+        if (!line || line.startsWith(':')) continue
+        const sep = line.indexOf(':')
+        const field = sep === -1 ? line : line.slice(0, sep)
+        const value = sep === -1 ? '' : line.slice(sep + 1).replace(/^ /, '')
+        if (field === 'event') event = value
+        else if (field === 'data') data.push(value)
+        else if (field === 'id') id = value
+        else if (field === 'retry' && /^\d+$/.test(value)) retry = Number(value)
+      }
+      if (id !== null) lastEventId = id
+      if (data.length && handlers[event]) handlers[event](JSON.parse(data.join('\n')))
+    }
+
+    const connect = async () => {
+      while (!closed) {
+        try {
+          const headers = { 'Accept': 'text/event-stream' }
+          if (this.token) headers['Authorization'] = `Token ${this.token}`
+          if (lastEventId) headers['Last-Event-ID'] = lastEventId
+
+          const response = await fetch(`${API_BASE}/api${path}`, { headers, signal: controller.signal })
+          if (!response.ok || !response.body) {
+            throw new Error(`Stream failed: ${response.status}`)
+          }
+          onOpen?.()
+
+          const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+          let buffer = ''
+          for (;;) {
+            const { value, done } = await reader.read()
+            if (done) break
+            buffer += value
+            let end
+            while ((end = buffer.indexOf('\n\n')) !== -1) {
+              dispatch(buffer.slice(0, end))
+              buffer = buffer.slice(end + 2)
+            }
+          }
+          throw new Error('Stream closed')
+        } catch (err) {
+          if (closed) return
+          onError?.(err)
+        }
+        await new Promise(resolve => setTimeout(resolve, retry))
+      }
+    }
+
+    connect()
+    return {
+      close() {
+        closed = true
+        controller.abort()
+      },
+    }
+  }
 }
 
 export const api = new ApiClient()
@@ -10,7 +10,9 @@ const STATUS_STYLES = {
   failed: 'bg-red-100 text-red-700',
 }
 
-export default function AppCard({ app, selected, onClick }) {
+export default function AppCard({ app, deployment, selected, onClick }) {
+  const phase = deployment?.status === 'running' ? deployment.phases?.[deployment.phases.length - 1] : null
+
   return (
     <div
       onClick={onClick}
@@ -35,6 +37,12 @@ export default function AppCard({ app, selected, onClick }) {
         </div>
       )}
 
+      {deployment?.status === 'running' && (
+        <p className="mt-2 text-xs text-purple-600">
+          Deployment #{deployment.id}{phase ? `: ${phase.phase}` : ''}...
+        </p>
+      )}
+
       {app.status === 'failed' && app.error_message && (
         <p className="mt-2 text-xs text-red-600 truncate">{app.error_message}</p>
       )}
@@ -1,7 +1,14 @@
 import React, { useState } from 'react'
 import { api } from '../api'
 
-export default function AppDetail({ app, onUpdate, onDelete }) {
+const PHASE_STYLES = {
+  running: 'text-purple-600',
+  ok: 'text-emerald-600',
+  failed: 'text-red-600',
+  cancelled: 'text-gray-500',
+}
+
+export default function AppDetail({ app, deployment, onUpdate, onDelete }) {
   const [loading, setLoading] = useState('')
   const [logs, setLogs] = useState('')
   const [showLogs, setShowLogs] = useState(false)
@@ -202,6 +209,24 @@ export default function AppDetail({ app, onUpdate, onDelete }) {
             <div className="ml-4 flex-1">
               <h4 className="font-medium text-gray-900">Deploy Application</h4>
               <p className="text-sm text-gray-500">Build Docker image and run with Traefik</p>
+
+              {deployment && (
+                <div className="mt-3 text-sm">
+                  <p className="text-gray-600">
+                    Deployment #{deployment.id}: <span className="font-medium">{deployment.status}</span>
+                    {deployment.duration != null && ` in ${Math.round(deployment.duration)}s`}
+                  </p>
+                  {deployment.phases?.length > 0 && (
+                    <ul className="mt-1 space-y-0.5">
+                      {deployment.phases.map((phase, i) => (
+                        <li key={i} className={PHASE_STYLES[phase.status] || 'text-gray-500'}>
+                          {phase.phase}: {phase.status}{phase.seconds != null && ` (${phase.seconds}s)`}
+                        </li>
+                      ))}
+                    </ul>
+                  )}
+                </div>
+              )}
               
               {step >= 2 && (
                 <div className="mt-4 space-y-4">
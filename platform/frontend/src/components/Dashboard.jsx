@@ -4,12 +4,16 @@ import ImportApp from './ImportApp'
 import AppCard from './AppCard'
 import AppDetail from './AppDetail'
 
+const ACTIVE_DEPLOYMENT = ['pending', 'running']
+
 export default function Dashboard({ onLogout, user }) {
   const [apps, setApps] = useState([])
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState('')
   const [showImport, setShowImport] = useState(false)
   const [selectedApp, setSelectedApp] = useState(null)
+  // Latest deployment seen on the event stream, by app id
+  const [deployments, setDeployments] = useState({})
 
   const loadApps = useCallback(async () => {
     try {
@@ -24,10 +28,54 @@ export default function Dashboard({ onLogout, user }) {
   }, [])
 
   useEffect(() => {
-    loadApps()
-    // Poll for updates every 5 seconds
-    const interval = setInterval(loadApps, 5000)
-    return () => clearInterval(interval)
+    // App changes are pushed by the server; poll every 5 seconds only while the stream is down
+    let interval = null
+    const startPolling = () => {
+      if (interval) return
+      loadApps()
+      interval = setInterval(loadApps, 5000)
+    }
+    const stopPolling = () => {
+      clearInterval(interval)
+      interval = null
+    }
+
+    const stream = api.subscribe('/events/', {
+      snapshot: ({ apps, deployments }) => {
+        setApps(apps)
+        // The snapshot lists unfinished deployments only, so any other one still shown as active is over
+        setDeployments(prev => ({
+          ...Object.fromEntries(Object.entries(prev).filter(([, d]) => !ACTIVE_DEPLOYMENT.includes(d.status))),
+          ...Object.fromEntries(deployments.map(d => [d.app, d])),
+        }))
+        setError('')
+        setLoading(false)
+      },
+      app: (change) => {
+        setApps(prev => prev.some(a => a.id === change.id)
+          ? prev.map(a => a.id === change.id ? { ...a, ...change } : a)
+          : [change, ...prev])
+        setSelectedApp(prev => prev?.id === change.id ? { ...prev, ...change } : prev)
+      },
+      'app-deleted': ({ id }) => {
+        setApps(prev => prev.filter(a => a.id !== id))
+        setSelectedApp(prev => prev?.id === id ? null : prev)
+        setDeployments(({ [id]: _, ...rest }) => rest)
+      },
+      deployment: (change) => {
+        // New deployments arrive with all fields, later events only with what changed
+        setDeployments(prev => {
+          const current = prev[change.app]
+          if (current && current.id > change.id) return prev
+          return { ...prev, [change.app]: current?.id === change.id ? { ...current, ...change } : change }
+        })
+      },
+    }, { onOpen: stopPolling, onError: startPolling })
+
+    return () => {
+      stream.close()
+      stopPolling()
+    }
   }, [loadApps])
 
   const handleAppImported = (newApp) => {
@@ -132,6 +180,7 @@ export default function Dashboard({ onLogout, user }) {
                   <AppCard
                     key={app.id}
                     app={app}
+                    deployment={deployments[app.id]}
                     selected={selectedApp?.id === app.id}
                     onClick={() => setSelectedApp(app)}
                   />
@@ -145,6 +194,7 @@ export default function Dashboard({ onLogout, user }) {
             {selectedApp ? (
               <AppDetail
                 app={selectedApp}
+                deployment={deployments[selectedApp.id]}
                 onUpdate={handleAppUpdated}
                 onDelete={handleAppDeleted}
               />